@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from numpy import add
+from numpy import array
+from numpy import concatenate
+from numpy import diff
+from numpy import int64
+from numpy import load
+from numpy import maximum
+from numpy import minimum
+from numpy import savez
+from numpy import unique
+from os import path
+from os import remove
+
+from archive import ARCHIVE_INDEX_FILE
+from archive import empty_bars
+from archive import epoch_to_market_days
+from archive import select_bars
+from files import write_file
+from logs import Logs
+from market_calendar import MARKET_TIMEZONE
+from market_calendar import market_time_to_epoch
+
+# The filename pattern for the cached aggregate bars of a ticker at a
+# resolution. They live next to the historical market data they summarize.
+AGGREGATE_FILE = "market_data/%s_%s.npz"
+
+# The supported resolutions of aggregate bars and their length in seconds.
+# Daily bars follow market days instead of a fixed length.
+RESOLUTIONS = {"5min": 5 * 60,
+               "hour": 60 * 60,
+               "day": None}
+
+
+def get_bucket_starts(times, resolution):
+    """Finds the start of the aggregate bar containing each of an array of
+    epoch seconds.
+    """
+
+    seconds = RESOLUTIONS[resolution]
+    if seconds:
+        # The market timezone is a whole number of hours off UTC, so buckets
+        # of epoch seconds line up with the hours in market time.
+        return times // seconds * seconds
+
+    days = epoch_to_market_days(times)
+    unique_days, inverse = unique(days, return_inverse=True)
+    midnights = [market_time_to_epoch(MARKET_TIMEZONE.localize(
+        datetime.strptime("%d" % day, "%Y%m%d"))) for day in
+        unique_days.tolist()]
+    return array(midnights, dtype=int64)[inverse]
+
+
+def resample_bars(bars, resolution):
+    """Resamples sorted minute bars into coarser bars at a resolution. Each
+    bar is labeled with the start of its time span.
+    """
+
+    if not len(bars["time"]):
+        return empty_bars()
+
+    bucket_starts = get_bucket_starts(bars["time"], resolution)
+
+    # The positions where each new bar starts and where the last one ends.
+    starts = concatenate(([0], (diff(bucket_starts) != 0).nonzero()[0] + 1))
+    ends = concatenate((starts[1:], [len(bucket_starts)]))
+
+    return {"time": bucket_starts[starts],
+            "open": bars["open"][starts],
+            "high": maximum.reduceat(bars["high"], starts),
+            "low": minimum.reduceat(bars["low"], starts),
+            "close": bars["close"][ends - 1],
+            "volume": add.reduceat(bars["volume"], starts)}
+
+
+class Aggregates:
+    """A helper for resampling historical market data into coarser bars and
+    caching them on disk.
+    """
+
+    def __init__(self, history, logs_to_cloud):
+        self.logs = Logs(name="aggregates", to_cloud=logs_to_cloud)
+        self.history = history
+
+        # The aggregate bars which have been loaded, by ticker and resolution.
+        self.aggregates = {}
+
+    def get_bars(self, ticker, resolution, start=None, end=None):
+        """Finds the aggregate bars for a ticker at a resolution, optionally
+        only those starting between two times in epoch seconds.
+        """
+
+        if resolution not in RESOLUTIONS:
+            self.logs.error("Unknown resolution: %s" % resolution)
+            return None
+
+        key = (ticker, resolution)
+        if key not in self.aggregates:
+            bars = self.read_bars(ticker, resolution)
+            if bars is None:
+                aggregates = self.build(ticker)
+                if aggregates is None:
+                    return None
+                self.aggregates.update(aggregates)
+            else:
+                self.aggregates[key] = bars
+
+        bars = self.aggregates[key]
+        if start is not None:
+            bars = select_bars(bars, bars["time"] >= start)
+        if end is not None:
+            bars = select_bars(bars, bars["time"] <= end)
+        return bars
+
+    def build(self, ticker):
+        """Resamples all minute bars of a ticker at every resolution, writes
+        them to the cache and returns them by ticker and resolution.
+        """
+
+        self.logs.debug("Building aggregate bars for: %s" % ticker)
+
+        minute_bars = self.history.get_all_bars(ticker)
+        if minute_bars is None:
+            return None
+
+        aggregates = {}
+        for resolution in RESOLUTIONS:
+            bars = resample_bars(minute_bars, resolution)
+            if len(minute_bars["time"]):
+                self.write_bars(ticker, resolution, bars)
+            aggregates[(ticker, resolution)] = bars
+
+        return aggregates
+
+    def is_current(self, ticker, resolution):
+        """Checks whether the cached aggregate bars are newer than all minute
+        bars of a ticker.
+        """
+
+        filenames = [self.history.get_csv_filename(ticker, day) for day in
+                     self.history.get_csv_days(ticker)]
+        filenames.append(ARCHIVE_INDEX_FILE % ticker)
+
+        cache_time = path.getmtime(AGGREGATE_FILE % (ticker, resolution))
+        for filename in filenames:
+            if path.isfile(filename) and path.getmtime(filename) > cache_time:
+                return False
+
+        return True
+
+    def read_bars(self, ticker, resolution):
+        """Reads the cached aggregate bars for a ticker at a resolution or
+        returns None if they're missing or out of date.
+        """
+
+        filename = AGGREGATE_FILE % (ticker, resolution)
+        if not path.isfile(filename) or not self.is_current(ticker,
+                                                            resolution):
+            return None
+
+        try:
+            aggregate_file = load(filename)
+        except (IOError, ValueError) as exception:
+            self.logs.error("Failed to read aggregate bars: %s" % exception)
+            return None
+
+        try:
+            return dict((column, aggregate_file[column]) for column in
+                        aggregate_file.files)
+        finally:
+            aggregate_file.close()
+
+    def write_bars(self, ticker, resolution, bars):
+        """Writes the aggregate bars for a ticker at a resolution to the
+        cache.
+        """
+
+        write_file(AGGREGATE_FILE % (ticker, resolution),
+                   lambda aggregate_file: savez(aggregate_file, **bars),
+                   mode="wb")
+
+    def invalidate(self, ticker):
+        """Drops the cached aggregate bars for a ticker."""
+
+        for resolution in RESOLUTIONS:
+            self.aggregates.pop((ticker, resolution), None)
+            filename = AGGREGATE_FILE % (ticker, resolution)
+            if path.isfile(filename):
+                remove(filename)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from pytest import fixture
+
+from aggregates import resample_bars
+from archive import select_bars
+from history import History
+from history import MARKET_TIMEZONE
+from history import market_time_to_epoch
+
+
+@fixture
+def history(tmpdir, monkeypatch):
+    monkeypatch.setattr("aggregates.AGGREGATE_FILE",
+                        str(tmpdir.join("%s_%s.npz")))
+    monkeypatch.setattr("aggregates.ARCHIVE_INDEX_FILE",
+                        str(tmpdir.join("%s.index")))
+    monkeypatch.setattr("history.EOD_INDEX_FILE",
+                        str(tmpdir.join("%s_eod.csv")))
+    monkeypatch.setattr("history.ARCHIVE_INDEX_FILE",
+                        str(tmpdir.join("%s.index")))
+    monkeypatch.setattr("archive.ARCHIVE_DATA_FILE",
+                        str(tmpdir.join("%s.bars")))
+    monkeypatch.setattr("archive.ARCHIVE_INDEX_FILE",
+                        str(tmpdir.join("%s.index")))
+    return History(logs_to_cloud=False)
+
+
+def as_epoch(year, month, day, hour=0, minute=0):
+    """Creates epoch seconds from a time in market time."""
+
+    market_time = datetime(year, month, day, hour, minute)
+    return market_time_to_epoch(MARKET_TIMEZONE.localize(market_time))
+
+
+def test_resample_bars(history):
+    bars = history.read_csv_bars("BA", "20161205")
+
+    daily_bars = resample_bars(bars, "day")
+    assert daily_bars["time"].tolist() == [as_epoch(2016, 12, 5)]
+    assert daily_bars["open"].tolist() == [bars["open"][0]]
+    assert daily_bars["high"].tolist() == [bars["high"].max()]
+    assert daily_bars["low"].tolist() == [bars["low"].min()]
+    assert daily_bars["close"].tolist() == [bars["close"][-1]]
+    assert daily_bars["volume"].tolist() == [bars["volume"].sum()]
+
+    hourly_bars = resample_bars(bars, "hour")
+    start = as_epoch(2016, 12, 5, 10)
+    end = as_epoch(2016, 12, 5, 11)
+    in_hour = (bars["time"] >= start) & (bars["time"] < end)
+    hour_index = hourly_bars["time"].tolist().index(start)
+    assert hourly_bars["open"][hour_index] == bars["open"][in_hour][0]
+    assert hourly_bars["high"][hour_index] == bars["high"][in_hour].max()
+    assert hourly_bars["low"][hour_index] == bars["low"][in_hour].min()
+    assert hourly_bars["close"][hour_index] == bars["close"][in_hour][-1]
+    assert hourly_bars["volume"][hour_index] == bars["volume"][in_hour].sum()
+
+    five_minute_bars = resample_bars(bars, "5min")
+    assert (five_minute_bars["time"] % 300 == 0).all()
+    assert five_minute_bars["volume"].sum() == bars["volume"].sum()
+    assert len(resample_bars(select_bars(bars, slice(0)), "day")[
+        "time"]) == 0
+
+
+def test_get_aggregate_bars(history, tmpdir):
+    daily_bars = history.get_aggregate_bars("BA", "day")
+    assert daily_bars["time"].tolist() == [
+        as_epoch(2016, 12, 5), as_epoch(2016, 12, 6), as_epoch(2016, 12, 22),
+        as_epoch(2016, 12, 23)]
+    assert tmpdir.join("BA_day.npz").check()
+    assert tmpdir.join("BA_hour.npz").check()
+
+    # Cached bars are read back without the minute bars.
+    cached_bars = History(logs_to_cloud=False).get_aggregate_bars(
+        "BA", "hour", start=as_epoch(2016, 12, 6), end=as_epoch(2016, 12, 7))
+    hourly_bars = resample_bars(history.read_csv_bars("BA", "20161206"),
+                                "hour")
+    for column in hourly_bars:
+        assert cached_bars[column].tolist() == hourly_bars[column].tolist()
+
+    assert history.get_aggregate_bars("BA", "week") is None
+
+
+def test_ingest_invalidates(history, tmpdir):
+    daily_bars = history.get_aggregate_bars("TM", "day")
+    bars = history.read_csv_bars("TM", "20170105")
+    last_bar = select_bars(bars, slice(-1, None))
+    last_bar["close"] = last_bar["close"] + 1.0
+    history.ingest("TM", last_bar)
+    assert not tmpdir.join("TM_day.npz").check()
+
+    updated_bars = history.get_aggregate_bars("TM", "day")
+    day_index = updated_bars["time"].tolist().index(as_epoch(2017, 1, 5))
+    assert updated_bars["close"][day_index] == (
+        daily_bars["close"][day_index] + 1.0)
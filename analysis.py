@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 
+from google.auth import default
 from google.cloud import language
+from google.cloud.language.connection import Connection
+from google_auth_httplib2 import AuthorizedHttp
 from os import getenv
 from re import compile
 from re import IGNORECASE
 from requests import get
 from urllib import quote_plus
 
+from cassettes import Cassette
+from cassettes import CassetteHttp
 from logs import Logs
 
 # The URL for a GET request to the Wikidata API. The string parameter is the
@@ -38,9 +43,28 @@ MID_TO_TICKER_QUERY = (
 class Analysis:
     """A helper for analyzing company data in text."""
 
-    def __init__(self, logs_to_cloud):
+    def __init__(self, logs_to_cloud, cassette_mode=None):
         self.logs = Logs(name="analysis", to_cloud=logs_to_cloud)
-        self.gcnl_client = language.Client()
+
+        # Optionally record and replay the API responses.
+        if cassette_mode:
+            self.gcnl_cassette = Cassette(name="gcnl", mode=cassette_mode,
+                                          logs_to_cloud=logs_to_cloud)
+            self.wikidata_cassette = Cassette(name="wikidata",
+                                              mode=cassette_mode,
+                                              logs_to_cloud=logs_to_cloud)
+            self.gcnl_client = language.Client(http=CassetteHttp(
+                self.gcnl_cassette, self.make_gcnl_http))
+        else:
+            self.gcnl_cassette = None
+            self.wikidata_cassette = None
+            self.gcnl_client = language.Client()
+
+    def make_gcnl_http(self):
+        """Creates an HTTP client authorized for the Natural Language API."""
+
+        credentials, _ = default(scopes=Connection.SCOPE)
+        return AuthorizedHttp(credentials)
 
     def get_company_data(self, mid):
         """Looks up stock ticker information for a company via its Freebase ID.
@@ -191,11 +215,14 @@ class Analysis:
         query_url = WIKIDATA_QUERY_URL % quote_plus(query)
         self.logs.debug("Wikidata query: %s" % query_url)
 
-        response = get(query_url)
         try:
-            response_json = response.json()
-        except ValueError:
-            self.logs.error("Failed to decode JSON response: %s" % response)
+            if self.wikidata_cassette:
+                response_json = self.wikidata_cassette.call(
+                    ["GET", query_url], lambda: get(query_url).json())
+            else:
+                response_json = get(query_url).json()
+        except ValueError as exception:
+            self.logs.error("Failed to decode JSON response: %s" % exception)
             return None
         self.logs.debug("Wikidata response: %s" % response_json)
 
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from datetime import date
+from numpy import array
+from numpy import concatenate
+from numpy import cumsum
+from numpy import diff
+from numpy import dtype
+from numpy import fromfile
+from numpy import frombuffer
+from numpy import int64
+from numpy import rint
+from numpy import unique
+from numpy import zeros
+from os import path
+from os import remove
+from zlib import compress
+from zlib import decompress
+
+from files import write_file
+from logs import Logs
+from market_calendar import epoch_to_market_ordinals
+
+# The filename patterns for the compressed archive of historical market data
+# and for its block index.
+ARCHIVE_DATA_FILE = "market_data/%s.bars"
+ARCHIVE_INDEX_FILE = "market_data/%s.index"
+
+# The maximum number of minute bars per compressed block. A block never spans
+# more than one day.
+BLOCK_SIZE = 256
+
+# Prices are stored as integers in units of 1/10000 dollars, which is the
+# precision of the historical market data.
+PRICE_SCALE = 10000
+
+# Compact an archive once its data file is this many times larger than the
+# blocks still in use.
+COMPACT_RATIO = 2
+
+# The number of block indices kept in memory at once, by ticker.
+INDEX_CACHE_SIZE = 1024
+
+# The price columns of the minute bars.
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+
+# An entry in the block index: the market day as YYYYMMDD, the times of the
+# first and last bar in epoch seconds, and the position, compressed size and
+# bar count of the block in the data file.
+INDEX_DTYPE = dtype([("day", "<i4"),
+                     ("start", "<i8"),
+                     ("end", "<i8"),
+                     ("offset", "<i8"),
+                     ("length", "<i4"),
+                     ("count", "<i4")])
+
+
+def epoch_to_market_days(times):
+    """Finds the market day as YYYYMMDD for an array of epoch seconds."""
+
+    ordinals = epoch_to_market_ordinals(times)
+    unique_ordinals, inverse = unique(ordinals, return_inverse=True)
+    unique_days = [int(date.fromordinal(ordinal).strftime("%Y%m%d")) for
+                   ordinal in unique_ordinals.tolist()]
+    return array(unique_days, dtype=int64)[inverse]
+
+
+def sort_bars(bars):
+    """Sorts minute bars by time. For duplicate times the bar which came last
+    wins.
+    """
+
+    if not len(bars["time"]):
+        return bars
+
+    order = bars["time"].argsort(kind="mergesort")
+    times = bars["time"][order]
+    keep = concatenate((times[1:] != times[:-1], [True]))
+    return select_bars(bars, order[keep])
+
+
+def select_bars(bars, selection):
+    """Selects a subset of minute bars with a mask, indices or a slice."""
+
+    return dict((column, values[selection]) for column, values in
+                bars.iteritems())
+
+
+def make_index(entries):
+    """Creates a block index from a list of entry tuples."""
+
+    index = zeros(len(entries), dtype=INDEX_DTYPE)
+    for entry_index, entry in enumerate(entries):
+        index[entry_index] = entry
+    return index
+
+
+def concatenate_bars(bars_list):
+    """Joins a list of minute bars into one."""
+
+    if not bars_list:
+        return empty_bars()
+
+    return dict((column, concatenate([bars[column] for bars in bars_list]))
+                for column in bars_list[0])
+
+
+def empty_bars():
+    """Creates minute bars without any entries."""
+
+    bars = dict((column, zeros(0)) for column in PRICE_COLUMNS)
+    bars["time"] = zeros(0, dtype=int64)
+    bars["volume"] = zeros(0, dtype=int64)
+    return bars
+
+
+def encode_block(bars):
+    """Compresses minute bars into a block. Times are stored as deltas and
+    prices as scaled integers.
+    """
+
+    times = bars["time"]
+    columns = [concatenate(([0], diff(times)))]
+    for column in PRICE_COLUMNS:
+        columns.append(rint(bars[column] * PRICE_SCALE))
+    columns.append(bars["volume"])
+
+    values = concatenate(columns).astype("<i8")
+    return compress(values.tostring())
+
+
+def decode_block(data, entry):
+    """Decompresses a block into minute bars."""
+
+    count = int(entry["count"])
+    values = frombuffer(decompress(data), dtype="<i8").reshape(6, count)
+
+    bars = {"time": entry["start"] + cumsum(values[0])}
+    for column_index, column in enumerate(PRICE_COLUMNS):
+        bars[column] = values[1 + column_index] / float(PRICE_SCALE)
+    bars["volume"] = values[5].astype(int64)
+    return bars
+
+
+class Archive:
+    """A helper for storing historical market data in compressed blocks."""
+
+    def __init__(self, logs_to_cloud):
+        self.logs = Logs(name="archive", to_cloud=logs_to_cloud)
+
+        # The most recently used block indices, by ticker, along with the
+        # modification time of the index file.
+        self.indices = OrderedDict()
+
+    def get_index(self, ticker):
+        """Loads the block index for a ticker or returns None if the ticker
+        isn't archived.
+        """
+
+        filename = ARCHIVE_INDEX_FILE % ticker
+        if not path.isfile(filename):
+            return None
+
+        # Reuse the loaded index unless the file changed since.
+        modified = path.getmtime(filename)
+        cached = self.indices.pop(ticker, None)
+        if cached and cached[0] == modified:
+            self.indices[ticker] = cached
+            return cached[1]
+
+        index = fromfile(filename, dtype=INDEX_DTYPE)
+        if len(self.indices) >= INDEX_CACHE_SIZE:
+            self.indices.popitem(last=False)
+        self.indices[ticker] = (modified, index)
+        return index
+
+    def get_days(self, ticker):
+        """Lists the days in the archive for a ticker."""
+
+        index = self.get_index(ticker)
+        if index is None:
+            return []
+
+        return sorted(set(["%d" % day for day in index["day"].tolist()]))
+
+    def read_day(self, ticker, day):
+        """Reads the minute bars for a day as YYYYMMDD from the archive or
+        returns None if the day isn't archived.
+        """
+
+        index = self.get_index(ticker)
+        if index is None:
+            return None
+
+        entries = index[index["day"] == int(day)]
+        if not len(entries):
+            return None
+
+        return self.read_blocks(ticker, entries)
+
+    def read_window(self, ticker, start, end):
+        """Reads the minute bars between two times in epoch seconds from the
+        archive. Only the blocks overlapping the window are decompressed.
+        """
+
+        index = self.get_index(ticker)
+        if index is None:
+            return None
+
+        entries = index[(index["end"] >= start) & (index["start"] <= end)]
+        bars = self.read_blocks(ticker, entries)
+        if bars is None:
+            return None
+
+        return select_bars(bars, (bars["time"] >= start) &
+                           (bars["time"] <= end))
+
+    def read_blocks(self, ticker, entries):
+        """Reads and decompresses blocks from the data file of a ticker."""
+
+        bars_list = []
+        data_file = open(ARCHIVE_DATA_FILE % ticker, "rb")
+        try:
+            for entry in entries:
+                data_file.seek(int(entry["offset"]))
+                data = data_file.read(int(entry["length"]))
+                bars_list.append(decode_block(data, entry))
+        except (IOError, ValueError) as exception:
+            self.logs.error("Failed to read archive blocks for %s: %s" %
+                            (ticker, exception))
+            return None
+        finally:
+            data_file.close()
+
+        return concatenate_bars(bars_list)
+
+    def write(self, ticker, bars):
+        """Replaces the archive for a ticker with the given minute bars."""
+
+        bars = sort_bars(bars)
+        days = epoch_to_market_days(bars["time"])
+
+        entries = []
+
+        def write_data(data_file):
+            offset = 0
+            for day in sorted(set(days.tolist())):
+                day_bars = select_bars(bars, days == day)
+                offset = self.write_day(data_file, offset, day, day_bars,
+                                        entries)
+
+        write_file(ARCHIVE_DATA_FILE % ticker, write_data, mode="wb")
+        self.write_index(ticker, make_index(entries))
+        self.logs.debug("Wrote archive for %s: %s bars in %s blocks" %
+                        (ticker, len(bars["time"]), len(entries)))
+
+    def append(self, ticker, bars):
+        """Adds minute bars to the archive for a ticker and returns the days
+        they affected. The bars may be out of order or repeat bars already in
+        the archive, in which case the new bars win. Only the blocks which
+        overlap the new bars are rewritten, and they're appended to the data
+        file instead of rewriting it.
+        """
+
+        bars = sort_bars(bars)
+        days = epoch_to_market_days(bars["time"])
+        affected_days = ["%d" % day for day in sorted(set(days.tolist()))]
+
+        index = self.get_index(ticker)
+        if index is None:
+            self.write(ticker, bars)
+            return affected_days
+
+        data_filename = ARCHIVE_DATA_FILE % ticker
+        replaced = zeros(len(index), dtype=bool)
+        entries = []
+        data_file = open(data_filename, "ab")
+        try:
+            offset = path.getsize(data_filename)
+            for day in sorted(set(days.tolist())):
+                day_bars = select_bars(bars, days == day)
+                start = day_bars["time"][0]
+                end = day_bars["time"][-1]
+
+                # Find the blocks the new bars overlap. If they don't overlap
+                # any, continue the last block of the day if it has room.
+                in_day = index["day"] == day
+                overlapping = in_day & (index["end"] >= start) & (
+                    index["start"] <= end)
+                if not overlapping.any() and in_day.any():
+                    last = in_day.nonzero()[0][-1]
+                    if (index["end"][last] < start and
+                        index["count"][last] < BLOCK_SIZE):
+                        overlapping[last] = True
+
+                old_bars = self.read_blocks(ticker, index[overlapping])
+                if old_bars is None:
+                    return None
+                day_bars = sort_bars(concatenate_bars([old_bars, day_bars]))
+                replaced |= overlapping
+                offset = self.write_day(data_file, offset, day, day_bars,
+                                        entries)
+        finally:
+            data_file.close()
+
+        index = concatenate((index[~replaced], make_index(entries)))
+        index = index[index["start"].argsort(kind="mergesort")]
+        self.write_index(ticker, index)
+        self.logs.debug("Appended to archive for %s: %s bars in %s blocks" %
+                        (ticker, len(bars["time"]), len(entries)))
+
+        # Rewritten blocks leave unused space behind, so compact the archive
+        # once that dominates the data file.
+        if path.getsize(data_filename) > COMPACT_RATIO * index["length"].sum():
+            self.compact(ticker)
+
+        return affected_days
+
+    def compact(self, ticker):
+        """Rewrites the archive for a ticker without any unused space."""
+
+        bars = self.read_blocks(ticker, self.get_index(ticker))
+        if bars is None:
+            return
+        self.write(ticker, bars)
+
+    def write_day(self, data_file, offset, day, bars, entries):
+        """Writes the minute bars of a day as blocks at the offset of the data
+        file, adds their index entries and returns the new offset.
+        """
+
+        for block_start in range(0, len(bars["time"]), BLOCK_SIZE):
+            block = select_bars(bars, slice(block_start,
+                                            block_start + BLOCK_SIZE))
+            data = encode_block(block)
+            data_file.write(data)
+            entries.append((day,
+                            block["time"][0],
+                            block["time"][-1],
+                            offset,
+                            len(data),
+                            len(block["time"])))
+            offset += len(data)
+
+        return offset
+
+    def write_index(self, ticker, index):
+        """Replaces the block index for a ticker."""
+
+        filename = ARCHIVE_INDEX_FILE % ticker
+        write_file(filename, index.tofile, mode="wb")
+        self.indices[ticker] = (path.getmtime(filename), index)
+
+    def delete(self, ticker):
+        """Deletes the archive for a ticker."""
+
+        for filename in [ARCHIVE_DATA_FILE % ticker,
+                         ARCHIVE_INDEX_FILE % ticker]:
+            if path.isfile(filename):
+                remove(filename)
+        self.indices.pop(ticker, None)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from numpy import array
+from numpy import zeros
+from pytest import fixture
+
+from archive import Archive
+from archive import BLOCK_SIZE
+from archive import COMPACT_RATIO
+from archive import concatenate_bars
+from archive import epoch_to_market_days
+from archive import select_bars
+from archive import sort_bars
+from history import History
+from history import MARKET_TIMEZONE
+from history import market_time_to_epoch
+
+
+@fixture
+def archive(tmpdir, monkeypatch):
+    monkeypatch.setattr("archive.ARCHIVE_DATA_FILE",
+                        str(tmpdir.join("%s.bars")))
+    monkeypatch.setattr("archive.ARCHIVE_INDEX_FILE",
+                        str(tmpdir.join("%s.index")))
+    return Archive(logs_to_cloud=False)
+
+
+@fixture
+def history():
+    return History(logs_to_cloud=False)
+
+
+def as_epoch(year, month, day, hour=0, minute=0):
+    """Creates epoch seconds from a time in market time."""
+
+    market_time = datetime(year, month, day, hour, minute)
+    return market_time_to_epoch(MARKET_TIMEZONE.localize(market_time))
+
+
+def get_csv_bars(history, ticker):
+    """Reads all day files of a ticker."""
+
+    return concatenate_bars([history.read_csv_bars(ticker, day) for
+                             day in history.get_csv_days(ticker)])
+
+
+def assert_bars_equal(bars, expected):
+    assert sorted(bars) == sorted(expected)
+    for column in expected:
+        assert bars[column].tolist() == expected[column].tolist()
+
+
+def test_write_read_day(archive, history):
+    csv_bars = get_csv_bars(history, "F")
+    archive.write("F", csv_bars)
+    assert archive.get_days("F") == history.get_csv_days("F")
+    for day in history.get_csv_days("F"):
+        assert_bars_equal(archive.read_day("F", day),
+                          history.read_csv_bars("F", day))
+    assert archive.read_day("F", "20170105") is None
+    assert archive.read_day("GM", "20170103") is None
+
+
+def test_blocks(archive, history):
+    archive.write("M", get_csv_bars(history, "M"))
+    index = archive.get_index("M")
+    assert index["count"].max() == BLOCK_SIZE
+    assert (index["start"][1:] > index["end"][:-1]).all()
+    for entry in index:
+        assert epoch_to_market_days(entry["start"]) == entry["day"]
+        assert epoch_to_market_days(entry["end"]) == entry["day"]
+
+
+def test_read_window(archive, history):
+    archive.write("NYT", get_csv_bars(history, "NYT"))
+    start = as_epoch(2017, 2, 6, 15, 58)
+    end = as_epoch(2017, 2, 7, 9, 31)
+    bars = archive.read_window("NYT", start, end)
+    assert bars["time"].min() >= start
+    assert bars["time"].max() <= end
+    assert set(epoch_to_market_days(bars["time"]).tolist()) == set([
+        20170206, 20170207])
+    assert len(archive.read_window("NYT", start, start - 1)["time"]) == 0
+
+
+def test_sort_bars(history):
+    bars = history.read_csv_bars("TM", "20170105")
+    shuffled = concatenate_bars([bars, bars])
+    shuffled["open"][len(bars["time"]):] += 1.0
+    sorted_bars = sort_bars(shuffled)
+    assert sorted_bars["time"].tolist() == bars["time"].tolist()
+    assert sorted_bars["open"].tolist() == (bars["open"] + 1.0).tolist()
+
+
+def test_epoch_to_market_days():
+    assert epoch_to_market_days(array([
+        as_epoch(2017, 1, 3, 4, 0),
+        as_epoch(2017, 1, 3, 20, 0),
+        as_epoch(2017, 7, 3, 4, 0),
+        as_epoch(2017, 7, 3, 20, 0)])).tolist() == [
+            20170103, 20170103, 20170703, 20170703]
+
+
+def test_append(archive, history):
+    bars = get_csv_bars(history, "GM")
+    days = epoch_to_market_days(bars["time"])
+
+    # Start with only the first half of each day and add the rest later.
+    first_half = zeros(len(days), dtype=bool)
+    for day in set(days.tolist()):
+        day_indices = (days == day).nonzero()[0]
+        first_half[day_indices[:len(day_indices) // 2]] = True
+    archive.write("GM", select_bars(bars, first_half))
+    assert archive.append("GM", select_bars(bars, ~first_half)) == [
+        "20161230", "20170103", "20170117", "20170118", "20170124",
+        "20170125"]
+    assert_bars_equal(archive.read_blocks("GM", archive.get_index("GM")),
+                      bars)
+
+
+def test_append_out_of_order(archive, history):
+    bars = history.read_csv_bars("FOXA", "20170117")
+    archive.append("FOXA", select_bars(bars, slice(None, None, 2)))
+    reversed_bars = select_bars(bars, slice(None, None, -1))
+    assert archive.append("FOXA", reversed_bars) == ["20170117"]
+    assert_bars_equal(archive.read_day("FOXA", "20170117"), bars)
+    index = archive.get_index("FOXA")
+    assert (index["start"][1:] > index["end"][:-1]).all()
+
+
+def test_append_duplicates(archive, history):
+    bars = history.read_csv_bars("NWSA", "20170118")
+    archive.append("NWSA", bars)
+    updated_bars = select_bars(bars, slice(10, 20))
+    updated_bars["close"] = updated_bars["open"]
+    archive.append("NWSA", updated_bars)
+    archived_bars = archive.read_day("NWSA", "20170118")
+    assert archived_bars["time"].tolist() == bars["time"].tolist()
+    assert archived_bars["close"][10:20].tolist() == (
+        updated_bars["close"].tolist())
+    assert archived_bars["close"][20:].tolist() == bars["close"][20:].tolist()
+
+
+def test_append_intraday(archive, history, tmpdir):
+    bars = history.read_csv_bars("INTC", "20170208")
+    for minute in range(len(bars["time"])):
+        archive.append("INTC", select_bars(bars, slice(minute, minute + 1)))
+    assert_bars_equal(archive.read_day("INTC", "20170208"), bars)
+    index = archive.get_index("INTC")
+    assert len(index) == (len(bars["time"]) - 1) // BLOCK_SIZE + 1
+    assert tmpdir.join("INTC.bars").size() <= (
+        COMPACT_RATIO * index["length"].sum())
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from numpy import array
+from numpy import float64
+from numpy import int64
+from time import time
+
+from analysis import Analysis
+from benchmark import CASSETTE_MODE
+from benchmark import format_dollar
+from benchmark import format_ratio
+from history import History
+from logs import Logs
+from simulation import FUND_DOLLARS
+from simulation import get_fees
+from sweep import get_events
+from trading import CASH_HOLD
+from trading import get_direction
+from twitter import Twitter
+
+# The number of ticker-days of minute bars kept in memory at once.
+DAY_CACHE_SIZE = 256
+
+
+class DayCache:
+    """A bounded cache of the minute bars of ticker-days, which evicts the
+    least recently used day once it's full.
+    """
+
+    def __init__(self, history, size=DAY_CACHE_SIZE):
+        self.history = history
+        self.size = size
+        self.days = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_bars(self, ticker, timestamp):
+        """Reads the minute bars of a ticker on the day of a market timestamp.
+        Days without bars are cached too, as None.
+        """
+
+        key = (ticker, timestamp.strftime("%Y%m%d"))
+        if key in self.days:
+            self.hits += 1
+            bars = self.days.pop(key)
+        else:
+            self.misses += 1
+            bars = self.history.get_day_bars(ticker, timestamp)
+            if bars is not None and not len(bars["time"]):
+                bars = None
+            if len(self.days) >= self.size:
+                self.days.popitem(last=False)
+
+        self.days[key] = bars
+        return bars
+
+
+class StreamingBacktest:
+    """A fund simulation which walks events in chronological order and only
+    keeps the minute bars it needs in a bounded cache, so memory stays flat
+    regardless of how much market data there is.
+    """
+
+    def __init__(self, history, logs_to_cloud, cache_size=DAY_CACHE_SIZE):
+        self.logs = Logs(name="backtest", to_cloud=logs_to_cloud)
+        self.history = history
+        self.cache = DayCache(history, size=cache_size)
+
+    def get_prices(self, ticker, timestamp):
+        """Finds the price at a timestamp and at EOD from the cached minute
+        bars, with the same rules as the historical price lookup.
+        """
+
+        return self.history.get_historical_prices_from_bars(
+            ticker, timestamp, self.cache.get_bars)
+
+    def run(self, events, initial_value=FUND_DOLLARS, cash_hold=CASH_HOLD):
+        """Simulates the fund over an iterable of events with companies, which
+        is consumed one event at a time. Like the fund simulation, only the
+        first event with trades on each day trades. Returns the final value
+        and the throughput.
+        """
+
+        value = float(initial_value)
+        num_events = 0
+        num_trades = 0
+        traded_day = None
+        previous_timestamp = None
+        start = time()
+
+        for event in events:
+            timestamp = event["timestamp"]
+            if previous_timestamp and timestamp < previous_timestamp:
+                self.logs.error("Skipping event out of order: %s" % timestamp)
+                continue
+            previous_timestamp = timestamp
+            num_events += 1
+
+            day = timestamp.toordinal()
+            if day == traded_day:
+                continue
+
+            market_status = self.history.get_market_status(timestamp)
+            directions = []
+            prices_at = []
+            prices_eod = []
+            for company in event["companies"]:
+                direction, _ = get_direction(company, market_status)
+                if not direction:
+                    continue
+                prices = self.get_prices(company["ticker"], timestamp)
+                if not prices or not prices["at"] or not prices["eod"]:
+                    continue
+                directions.append(direction)
+                prices_at.append(prices["at"])
+                prices_eod.append(prices["eod"])
+
+            if not directions:
+                continue
+
+            # Invest the value less the cash hold, split evenly.
+            directions = array(directions, dtype=int64)
+            prices_at = array(prices_at, dtype=float64)
+            prices_eod = array(prices_eod, dtype=float64)
+            budget = round(max(0.0, value - cash_hold) / len(directions), 2)
+            quantities = (budget // prices_at).astype(int64)
+            fees = get_fees(quantities)
+            value += float((quantities * directions * (prices_eod - prices_at)
+                            - 2 * fees).sum())
+
+            traded_day = day
+            num_trades += len(directions)
+
+        elapsed = time() - start
+        return {"value": value,
+                "events": num_events,
+                "trades": num_trades,
+                "elapsed": elapsed,
+                "events_per_second": num_events / max(elapsed, 1e-9),
+                "cache_hits": self.cache.hits,
+                "cache_misses": self.cache.misses}
+
+
+if __name__ == "__main__":
+    analysis = Analysis(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+    history = History(logs_to_cloud=False)
+    twitter = Twitter(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+
+    backtest = StreamingBacktest(history, logs_to_cloud=False)
+    results = backtest.run(get_events(analysis, twitter))
+
+    # Print out the results as markdown.
+    print "## Backtest Report"
+    print
+    print ("This streams %s events through the fund simulation with at most "
+           "%s ticker-days of minute bars in memory.") % (results["events"],
+                                                          DAY_CACHE_SIZE)
+    print
+    print "Statistic | Value"
+    print "----------|------"
+    print "Trades | %s" % results["trades"]
+    print "Final value | %s" % format_dollar(results["value"])
+    print "Return | %s" % format_ratio(results["value"] / FUND_DOLLARS)
+    print "Events per second | %.0f" % results["events_per_second"]
+    print "Cache hits | %s" % results["cache_hits"]
+    print "Cache misses | %s" % results["cache_misses"]
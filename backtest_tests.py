@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from pytest import fixture
+
+from backtest import DayCache
+from backtest import StreamingBacktest
+from history import History
+from history import MARKET_TIMEZONE
+from simulation import get_final_value
+from simulation import make_simulation_inputs
+from simulation import simulate_fund
+from trading import get_direction
+
+
+@fixture
+def history():
+    return History(logs_to_cloud=False)
+
+
+def as_market_time(year, month, day, hour=0, minute=0):
+    """Creates a timestamp in market time."""
+
+    return MARKET_TIMEZONE.localize(datetime(year, month, day, hour, minute))
+
+
+def make_company(ticker, sentiment):
+    return {"ticker": ticker, "sentiment": sentiment}
+
+
+@fixture
+def events():
+    return [{"timestamp": as_market_time(2017, 1, 3, 11, 44),
+             "companies": [make_company("F", 0.2)]},
+            {"timestamp": as_market_time(2017, 1, 17, 12, 55),
+             "companies": [make_company("GM", 0.1),
+                           make_company("WMT", -0.4)]},
+            {"timestamp": as_market_time(2017, 1, 17, 14, 0),
+             "companies": [make_company("F", 0.3)]},
+            {"timestamp": as_market_time(2017, 1, 24, 12, 49),
+             "companies": [make_company("TRP", -0.5),
+                           make_company("ZZZZ", 0.5)]},
+            {"timestamp": as_market_time(2017, 1, 24, 19, 46),
+             "companies": [make_company("F", 0.5)]}]
+
+
+def test_get_direction():
+    assert get_direction(make_company("F", 0.2), "open") == (
+        1, "positive sentiment")
+    assert get_direction(make_company("F", -0.2), "pre") == (
+        -1, "negative sentiment")
+    assert get_direction(make_company("F", 0.0), "open") == (
+        0, "neutral sentiment")
+    assert get_direction(make_company("F", 0.2), "closed") == (
+        0, "market closed")
+    assert get_direction(make_company("F", 0.2), "open", 0.3) == (
+        0, "neutral sentiment")
+
+
+def test_day_cache(history):
+    cache = DayCache(history, size=2)
+    first = cache.get_bars("BA", as_market_time(2016, 12, 5))
+    cache.get_bars("BA", as_market_time(2016, 12, 6))
+    assert cache.get_bars("BA", as_market_time(2016, 12, 5)) is first
+    assert cache.get_bars("BA", as_market_time(2016, 12, 7)) is None
+    assert len(cache.days) == 2
+    assert cache.hits == 1
+    assert cache.misses == 3
+
+    # The least recently used day was evicted.
+    cache.get_bars("BA", as_market_time(2016, 12, 6))
+    assert cache.misses == 4
+
+
+def test_get_prices(history):
+    backtest = StreamingBacktest(history, logs_to_cloud=False)
+    for ticker, timestamp in [("BA", as_market_time(2016, 12, 5, 11, 0)),
+                              ("BA", as_market_time(2016, 12, 5, 20, 0)),
+                              ("BA", as_market_time(2016, 12, 6, 8, 0)),
+                              ("TRP", as_market_time(2017, 1, 24, 12, 49))]:
+        assert backtest.get_prices(ticker, timestamp) == \
+            history.get_historical_prices(ticker, timestamp)
+
+
+def test_run(history, events):
+    # Price the strategies like the benchmark for the fund simulation.
+    simulation_events = []
+    for event in events:
+        strategies = []
+        market_status = history.get_market_status(event["timestamp"])
+        for company in event["companies"]:
+            direction, _ = get_direction(company, market_status)
+            prices = history.get_historical_prices(company["ticker"],
+                                                   event["timestamp"])
+            strategies.append({
+                "action": {1: "bull", -1: "bear", 0: "hold"}[direction],
+                "price_at": prices and prices["at"],
+                "price_eod": prices and prices["eod"]})
+        simulation_events.append({"timestamp": event["timestamp"],
+                                  "strategies": strategies})
+    results = simulate_fund(**make_simulation_inputs(simulation_events))
+
+    backtest = StreamingBacktest(history, logs_to_cloud=False, cache_size=1)
+    streamed = backtest.run(iter(events))
+    assert streamed["events"] == 5
+    assert streamed["trades"] == results["trades"].sum()
+    assert abs(streamed["value"] - get_final_value(results)) < 1e-6
+    assert len(backtest.cache.days) == 1
+    assert streamed["events_per_second"] > 0
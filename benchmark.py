@@ -1,10 +1,27 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+from calendar import timegm
 from datetime import datetime
 from datetime import timedelta
+from heapq import merge
+from itertools import islice
+from multiprocessing import cpu_count
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from os import getenv
+from simplejson import dumps
+from simplejson import loads
+from tempfile import TemporaryFile
+from threading import local
+import __builtin__
 
 from analysis import Analysis
+from cassettes import RECORD_MODE
+from results import ResultCache
+from simulation import FUND_DOLLARS
+from simulation import get_final_value
+from simulation import simulate_event
 from trading import Trading
 from twitter import Twitter
 
@@ -19,13 +36,36 @@ TWEET_IDS = ["806134244384899072", "812061677160202240", "816260343391514624",
              "828642511698669569", "828793887275761665", "824765229527605248",
              "829410107406614534", "829356871848951809"]
 
-# The initial amount in dollars for the fund simulation.
-FUND_DOLLARS = 100000
+# Whether to record or only replay the responses from external APIs. By
+# default, known responses are replayed from the cassettes and new ones are
+# recorded, so that repeated runs don't need the network.
+CASSETTE_MODE = getenv("CASSETTE_MODE", RECORD_MODE)
 
-# The fee in dollars per trade (http://www.questrade.com/pricing/self-directed-investing/commissions/stocks).
-TRADE_FEE_MIN = 4.95
-TRADE_FEE_MAX = 9.95
-TRADE_FEE_PER_SHARE = 0.01
+# The number of workers analyzing and pricing tweets in parallel, and whether
+# they're threads or processes. Threads suffice while the analysis mostly waits
+# for APIs, but processes also parallelize the work in Python.
+BENCHMARK_WORKERS = int(getenv("BENCHMARK_WORKERS", cpu_count()))
+BENCHMARK_POOL = getenv("BENCHMARK_POOL", "thread")
+
+# The source files of the analysis and pricing stages. Cached results are
+# only reused while these are unchanged. The pricing includes this file for
+# the strategies and market status determined here.
+ANALYSIS_SOURCES = ["analysis.py"]
+PRICING_SOURCES = ["benchmark.py", "trading.py", "history.py", "archive.py",
+                   "market_calendar.py"]
+
+# The state of each worker. Each one gets its own analysis, because the
+# httplib2 instances of the API clients can't be shared between threads.
+worker_state = local()
+
+# An optional local archive of tweets to benchmark instead of the tweet IDs,
+# with one tweet in JSON per line.
+BENCHMARK_ARCHIVE = getenv("BENCHMARK_ARCHIVE")
+
+# The number of tweets analyzed at once by the workers, and the number of
+# tweets sorted in memory before they're spilled to a temporary file.
+BENCHMARK_BATCH_SIZE = 1000
+BENCHMARK_CHUNK_SIZE = 10000
 
 
 def format_ratio(ratio):
@@ -80,96 +120,292 @@ def get_sentiment_emoji(sentiment):
 def get_market_status(timestamp):
     """Tries to infer the market status from a timestamp."""
 
-    if not trading.is_trading_day(timestamp):
-        return "closed"
-
-    # Calculate the market hours for the given day. These are the same for NYSE
-    # and NASDAQ and include Questrade's extended hours. (http://help.questrade.com/how-to/frequently-asked-questions-
-    # (faqs)/self-directed-trading/learning-trading-basics/when-are-the-stock-markets-open-and-what-are-pre--and-post-market-hours-)
-    pre_time = timestamp.replace(hour=7, minute=30)
-    open_time = timestamp.replace(hour=9, minute=30)
-    close_time = timestamp.replace(hour=16)
-    after_time = timestamp.replace(hour=17, minute=30)
-
-    # Return the market status for each bucket.
-    if timestamp >= pre_time and timestamp < open_time:
-        return "pre"
-    elif timestamp >= open_time and timestamp < close_time:
-        return "open"
-    elif timestamp >= close_time and timestamp < after_time:
-        return "after"
+    return trading.history.get_market_status(timestamp)
+
+
+def init_worker():
+    """Creates the analysis for a worker."""
+
+    worker_state.analysis = Analysis(logs_to_cloud=False,
+                                     cassette_mode=CASSETTE_MODE)
+
+
+def make_pool():
+    """Creates the pool of workers for analyzing tweets."""
+
+    if BENCHMARK_POOL == "process":
+        return Pool(BENCHMARK_WORKERS, initializer=init_worker)
     else:
-        return "closed"
+        return ThreadPool(BENCHMARK_WORKERS, initializer=init_worker)
+
+
+def analyze_tweet(tweet):
+    """Extracts the companies from a tweet and determines the strategy and
+    historical prices for each.
+    """
+
+    event = {}
+
+    timestamp_str = tweet["created_at"]
+    timestamp = trading.utc_to_market_time(datetime.strptime(
+        timestamp_str, "%a %b %d %H:%M:%S +0000 %Y"))
+    text = tweet["text"]
+    event["timestamp"] = timestamp
+    event["text"] = text
+    event["link"] = twitter.get_tweet_link(tweet)
+
+    # Extract the companies, unless the tweet and the analysis code are the
+    # same as in an earlier run.
+    analysis = worker_state.analysis
+    companies = result_cache.call("analysis", get_analysis_inputs(tweet),
+                                  ANALYSIS_SOURCES,
+                                  lambda: analysis.find_companies(tweet))
+
+    # Determine the strategies and prices, unless the companies, the pricing
+    # code and the market data are the same as in an earlier run.
+    data_files = []
+    for company in companies:
+        data_files.extend(trading.history.get_data_files(company["ticker"]))
+    event["strategies"] = result_cache.call(
+        "pricing", {"companies": companies, "timestamp": timestamp.isoformat()},
+        PRICING_SOURCES + data_files,
+        lambda: get_strategies(companies, timestamp))
+
+    return event
+
+
+def get_analysis_inputs(tweet):
+    """Collects the parts of a tweet which the analysis uses."""
+
+    return {"text": tweet.get("text"),
+            "user_mentions": tweet.get("entities", {}).get("user_mentions")}
+
+
+def get_strategies(companies, timestamp):
+    """Determines the strategy and the historical prices at a timestamp for
+    each company.
+    """
+
+    strategies = []
+    price_requests = []
+    for company in companies:
+
+        # What would have been the strategy?
+        market_status = get_market_status(timestamp)
+        strategy = trading.get_strategy(company, market_status)
+        strategies.append(strategy)
+
+        # Remember to look up the price at tweet and at EOD.
+        price_requests.append((company["ticker"], timestamp))
+
+    # Look up the prices for all strategies at once.
+    prices = trading.get_historical_prices_bulk(price_requests)
+    for strategy, price in zip(strategies, prices):
+        if price:
+            strategy["price_at"] = price["at"]
+            strategy["price_eod"] = price["eod"]
+        else:
+            strategy["price_at"] = None
+            strategy["price_eod"] = None
 
+    return strategies
 
-# TODO: Refactor trading so this logic can live there.
-def should_trade(strategy, date, previous_trade_date):
-    """Determines whether a trade is happening for the strategy."""
 
-    # We invest the whole value, so we can only trade once a day.
-    if (previous_trade_date and
-        previous_trade_date.replace(hour=0, minute=0, second=0) ==
-            date.replace(hour=0, minute=0, second=0)):
-        return False
+def get_tweet_time(tweet):
+    """Finds the time of a tweet in epoch seconds."""
 
-    # The strategy needs to be active.
-    if strategy["action"] == "hold":
-        return False
+    return timegm(datetime.strptime(tweet["created_at"],
+                                    "%a %b %d %H:%M:%S +0000 %Y").timetuple())
 
-    # We need to know the stock price.
-    if not strategy["price_at"] or not strategy["price_eod"]:
-        return False
 
-    return True
+def read_tweet_archive(filename):
+    """Reads the tweets from a local archive one at a time."""
 
-if __name__ == "__main__":
-    analysis = Analysis(logs_to_cloud=False)
-    trading = Trading(logs_to_cloud=False)
-    twitter = Twitter(logs_to_cloud=False)
-
-    # Look up the metadata for the tweets.
-    tweets = twitter.get_tweets(TWEET_IDS)
-
-    events = []
-    for tweet in tweets:
-        event = {}
-
-        timestamp_str = tweet["created_at"]
-        timestamp = trading.utc_to_market_time(datetime.strptime(
-            timestamp_str, "%a %b %d %H:%M:%S +0000 %Y"))
-        text = tweet["text"]
-        event["timestamp"] = timestamp
-        event["text"] = text
-        event["link"] = twitter.get_tweet_link(tweet)
-
-        # Extract the companies.
-        companies = analysis.find_companies(tweet)
-
-        strategies = []
-        for company in companies:
-
-            # What would have been the strategy?
-            market_status = get_market_status(timestamp)
-            strategy = trading.get_strategy(company, market_status)
-
-            # What was the price at tweet and at EOD?
-            price = trading.get_historical_prices(
-                company["ticker"], timestamp)
-            if price:
-                strategy["price_at"] = price["at"]
-                strategy["price_eod"] = price["eod"]
+    with open(filename) as archive:
+        for line in archive:
+            if line.strip():
+                yield loads(line)
+
+
+def write_chunk(chunk):
+    """Sorts a chunk of (time, sequence, JSON) tweets into a temporary file.
+    """
+
+    chunk_file = TemporaryFile()
+    for time, sequence, tweet in sorted(chunk):
+        chunk_file.write("%d\t%d\t%s\n" % (time, sequence, tweet))
+    chunk_file.seek(0)
+    return chunk_file
+
+
+def read_chunk(chunk_file):
+    """Reads the (time, sequence, JSON) tweets back from a chunk file."""
+
+    for line in chunk_file:
+        time, sequence, tweet = line.rstrip("\n").split("\t", 2)
+        yield int(time), int(sequence), tweet
+
+
+def sort_tweets(tweets, chunk_size=BENCHMARK_CHUNK_SIZE):
+    """Sorts tweets by time in bounded memory. Sorted chunks of tweets are
+    spilled to temporary files and merged, keeping the original order of
+    tweets from the same time.
+    """
+
+    chunk = []
+    chunk_files = []
+    try:
+        for sequence, tweet in enumerate(tweets):
+            chunk.append((get_tweet_time(tweet), sequence, dumps(tweet)))
+            if len(chunk) >= chunk_size:
+                chunk_files.append(write_chunk(chunk))
+                chunk = []
+
+        # Skip the files if all tweets fit in one chunk.
+        if not chunk_files:
+            for _, _, tweet in sorted(chunk):
+                yield loads(tweet)
+            return
+
+        if chunk:
+            chunk_files.append(write_chunk(chunk))
+            chunk = []
+        for _, _, tweet in merge(*[read_chunk(chunk_file) for chunk_file in
+                                   chunk_files]):
+            yield loads(tweet)
+    finally:
+        for chunk_file in chunk_files:
+            chunk_file.close()
+
+
+def analyze_tweets(pool, tweets, batch_size=BENCHMARK_BATCH_SIZE):
+    """Analyzes and prices tweets on the workers one batch at a time and
+    yields the events in the same order.
+    """
+
+    tweets = iter(tweets)
+    while True:
+        batch = list(islice(tweets, batch_size))
+        if not batch:
+            return
+        for event in pool.map(analyze_tweet, batch):
+            yield event
+
+
+def print_event(event):
+    """Prints the results of the analysis and the market performance of an
+    event.
+    """
+
+    timestamp = format_timestamp(event["timestamp"], weekday=True)
+    print
+    print "##### [%s](%s)" % (timestamp, event["link"])
+    print
+    lines = ["> %s" % line for line in event["text"].split("\n")]
+    print "\n\n".join(lines)
+    print
+
+    strategies = event["strategies"]
+    if strategies:
+        print "*Strategy*"
+        print
+        print "Company | Root | Sentiment | Strategy | Reason"
+        print "--------|------|-----------|----------|-------"
+
+        for strategy in strategies:
+            root = "-" if "root" not in strategy else strategy["root"]
+            sentiment = strategy["sentiment"]
+            sentiment_emoji = get_sentiment_emoji(sentiment)
+            print "%s | %s | %s %s | %s | %s" % (
+                strategy["name"],
+                root,
+                sentiment,
+                sentiment_emoji,
+                strategy["action"],
+                strategy["reason"])
+
+        print
+        print "*Performance*"
+        print
+        print "Ticker | Exchange | Price @ tweet | Price EOD | Gain"
+        print "-------|----------|---------------|-----------|-----"
+
+        for strategy in strategies:
+            price_at = strategy["price_at"]
+            price_eod = strategy["price_eod"]
+            if price_at and price_eod:
+                price_at_str = format_dollar(price_at)
+                price_eod_str = format_dollar(price_eod)
             else:
-                strategy["price_at"] = None
-                strategy["price_eod"] = None
+                price_at_str = "-"
+                price_eod_str = "-"
+            ratio = get_ratio(strategy)
+            gain = format_ratio(ratio)
+            print "%s | %s | %s | %s | %s" % (
+                strategy["ticker"],
+                strategy["exchange"],
+                price_at_str,
+                price_eod_str,
+                gain)
+    else:
+        print "*(No companies)*"
+
+
+def get_fund_rows(event, results, start_date):
+    """Formats the rows of the fund simulation table for an event, given the
+    results of simulating it and the date of the first event.
+    """
 
-            strategies.append(strategy)
+    rows = []
+    date = event["timestamp"]
+    for strategy_index, strategy in enumerate(event["strategies"]):
+        trade = results["trades"][0, strategy_index]
+        value = results["values"][0, strategy_index]
 
-        event["strategies"] = strategies
+        total_ratio = value / FUND_DOLLARS
+        total_return = format_ratio(total_ratio)
+
+        days = (date - start_date).days
+        if days > 0:
+            annualized_return = format_ratio(pow(total_ratio, 365.0 / days))
+        else:
+            annualized_return = "-"
+
+        date_str = format_timestamp(date)
+        trade_str = u"%s %s" % (
+            strategy["ticker"],
+            get_sentiment_emoji(strategy["sentiment"]))
+        ratio = get_ratio(strategy)
+        gain = format_ratio(ratio)
+
+        if trade:
+            date_str = "**%s**" % date_str
+            trade_str = "**%s**" % trade_str
 
-        events.append(event)
+        rows.append(u"%s | %s | %s | %s | %s | %s" % (
+            date_str,
+            trade_str,
+            gain,
+            format_dollar(value),
+            total_return,
+            annualized_return))
 
-    # Make sure the events are ordered by ascending timestatmp.
-    events = sorted(events, key=lambda event: event["timestamp"])
+    return rows
+
+
+if __name__ == "__main__":
+    # Read the authentication keys for Questrade from environment variables.
+    __builtin__.QUESTRADE_REFRESH_TOKEN = getenv("QUESTRADE_REFRESH_TOKEN")
+
+    trading = Trading(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+    twitter = Twitter(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+    result_cache = ResultCache(logs_to_cloud=False)
+
+    # Read the tweets from a local archive or look up their metadata.
+    if BENCHMARK_ARCHIVE:
+        tweets = read_tweet_archive(BENCHMARK_ARCHIVE)
+    else:
+        tweets = twitter.get_tweets(TWEET_IDS)
 
     # Print out the formatted benchmark results as markdown.
     print "## Benchmark Report"
@@ -189,142 +425,41 @@ if __name__ == "__main__":
     print ("Here's each tweet with the results of its analysis and individual "
            "market performance.")
 
-    for event in events:
-        timestamp = format_timestamp(event["timestamp"], weekday=True)
+    # Analyze and price the tweets in parallel and in order of time. Each
+    # event is printed and simulated as soon as it's ready, while the rows of
+    # the fund simulation wait in a temporary file.
+    pool = make_pool()
+    fund_rows = TemporaryFile()
+    try:
+        value = FUND_DOLLARS
+        traded_day = None
+        start_date = None
+        for event in analyze_tweets(pool, sort_tweets(tweets)):
+            print_event(event)
+
+            if start_date is None:
+                start_date = event["timestamp"]
+            results, traded_day = simulate_event(event, value, traded_day)
+            for row in get_fund_rows(event, results, start_date):
+                fund_rows.write(row.encode("utf-8") + "\n")
+            value = get_final_value(results, value)
+
         print
-        print "##### [%s](%s)" % (timestamp, event["link"])
+        print "### Fund simulation"
         print
-        lines = ["> %s" % line for line in event["text"].split("\n")]
-        print "\n\n".join(lines)
+        print (u"This is how an initial investment of %s would have grown, inc"
+               u"luding fees of 2 \u00d7 trades per pair of orders. Bold means "
+               u"that the data was used to trade.") % (
+                   format_dollar(FUND_DOLLARS))
         print
-
-        strategies = event["strategies"]
-        if strategies:
-            print "*Strategy*"
-            print
-            print "Company | Root | Sentiment | Strategy | Reason"
-            print "--------|------|-----------|----------|-------"
-
-            for strategy in strategies:
-                root = "-" if "root" not in strategy else strategy["root"]
-                sentiment = strategy["sentiment"]
-                sentiment_emoji = get_sentiment_emoji(sentiment)
-                print "%s | %s | %s %s | %s | %s" % (
-                    strategy["name"],
-                    root,
-                    sentiment,
-                    sentiment_emoji,
-                    strategy["action"],
-                    strategy["reason"])
-
-            print
-            print "*Performance*"
-            print
-            print "Ticker | Exchange | Price @ tweet | Price EOD | Gain"
-            print "-------|----------|---------------|-----------|-----"
-
-            for strategy in strategies:
-                price_at = strategy["price_at"]
-                price_eod = strategy["price_eod"]
-                if price_at and price_eod:
-                    price_at_str = format_dollar(price_at)
-                    price_eod_str = format_dollar(price_eod)
-                else:
-                    price_at_str = "-"
-                    price_eod_str = "-"
-                ratio = get_ratio(strategy)
-                gain = format_ratio(ratio)
-                print "%s | %s | %s | %s | %s" % (
-                    strategy["ticker"],
-                    strategy["exchange"],
-                    price_at_str,
-                    price_eod_str,
-                    gain)
-        else:
-            print "*(No companies)*"
-
-    print
-    print "### Fund simulation"
-    print
-    print (u"This is how an initial investment of %s would have grown, includi"
-           u"ng fees of 2 \u00d7 trades per pair of orders. Bold means that the da"
-           u"ta was used to trade.") % (format_dollar(FUND_DOLLARS))
-    print
-    print "Time | Trade | Gain | Value | Return | Annualized"
-    print "-----|-------|------|-------|--------|-----------"
-    start_date = events[0]["timestamp"]
-    value = FUND_DOLLARS
-    print "*Initial* | - | - | *%s* | - | -" % format_dollar(value)
-
-    previous_trade_date = None
-    for event in events:
-        date = event["timestamp"]
-        strategies = event["strategies"]
-
-        # Figure out what to spend on each trade.
-        num_actionable_strategies = sum(
-            [1 for strategy in strategies if should_trade(
-                strategy, date, previous_trade_date)])
-        budget = trading.get_budget(value, num_actionable_strategies)
-
-        for strategy in strategies:
-            trade = should_trade(strategy, date, previous_trade_date)
-
-            price_at = strategy["price_at"]
-            price_eod = strategy["price_eod"]
-
-            if trade:
-                # Use the price at tweet to determine stock quantity.
-                quantity = int(budget // price_at)
-
-                # Pay the fees for both trades, accounting for Questrade's fee logic
-                if quantity < (TRADE_FEE_MIN / TRADE_FEE_PER_SHARE):
-                    current_fee = TRADE_FEE_MIN
-                elif quantity > (TRADE_FEE_MAX / TRADE_FEE_PER_SHARE):
-                    current_fee = TRADE_FEE_MAX
-                else:
-                    current_fee = quantity * TRADE_FEE_PER_SHARE
-
-                value -= 2 * current_fee
-
-                # Calculate the returns depending on the strategy.
-                if strategy["action"] == "bull":
-                    value -= quantity * price_at  # Buy
-                    value += quantity * price_eod  # Sell
-                elif strategy["action"] == "bear":
-                    value += quantity * price_at  # Short
-                    value -= quantity * price_eod  # Cover
-            else:
-                quantity = 0
-
-            total_ratio = value / FUND_DOLLARS
-            total_return = format_ratio(total_ratio)
-
-            if date != start_date:
-                days = (date - start_date).days
-                annualized_return = format_ratio(
-                    pow(total_ratio, 365.0 / days))
-            else:
-                annualized_return = "-"
-
-            date_str = format_timestamp(date)
-            trade_str = u"%s %s" % (
-                strategy["ticker"],
-                get_sentiment_emoji(strategy["sentiment"]))
-            ratio = get_ratio(strategy)
-            gain = format_ratio(ratio)
-
-            if trade:
-                date_str = "**%s**" % date_str
-                trade_str = "**%s**" % trade_str
-
-            print "%s | %s | %s | %s | %s | %s" % (
-                date_str,
-                trade_str,
-                gain,
-                format_dollar(value),
-                total_return,
-                annualized_return)
-
-        if trade:
-            previous_trade_date = date
+        print "Time | Trade | Gain | Value | Return | Annualized"
+        print "-----|-------|------|-------|--------|-----------"
+        print "*Initial* | - | - | *%s* | - | -" % format_dollar(FUND_DOLLARS)
+
+        fund_rows.seek(0)
+        for row in fund_rows:
+            print row.decode("utf-8").rstrip("\n")
+    finally:
+        pool.close()
+        pool.join()
+        fund_rows.close()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from simplejson import dumps
+
+from benchmark import get_tweet_time
+from benchmark import make_pool
+from benchmark import read_tweet_archive
+from benchmark import sort_tweets
+from benchmark import worker_state
+
+
+def make_tweet(id_str, created_at):
+    return {"id_str": id_str, "created_at": created_at}
+
+
+def test_get_tweet_time():
+    assert get_tweet_time(make_tweet(
+        "1", "Tue Dec 06 13:52:35 +0000 2016")) == 1481032355
+
+
+def test_read_tweet_archive(tmpdir):
+    archive = tmpdir.join("tweets.jsonl")
+    archive.write("\n".join([
+        dumps(make_tweet("1", "Tue Dec 06 13:52:35 +0000 2016")),
+        "",
+        dumps(make_tweet("2", "Wed Dec 07 13:52:35 +0000 2016"))]))
+    tweets = read_tweet_archive(str(archive))
+    assert [tweet["id_str"] for tweet in tweets] == ["1", "2"]
+
+
+def test_sort_tweets():
+    times = ["Wed Dec 07 13:52:35 +0000 2016",
+             "Tue Dec 06 13:52:35 +0000 2016",
+             "Thu Dec 08 13:52:35 +0000 2016",
+             "Tue Dec 06 13:52:35 +0000 2016",
+             "Mon Dec 05 13:52:35 +0000 2016"]
+    tweets = [make_tweet(str(index), created_at) for index, created_at in
+              enumerate(times)]
+    expected = ["4", "1", "3", "0", "2"]
+
+    # Spilling chunks to files keeps the same order as sorting in memory.
+    for chunk_size in [1, 2, 100]:
+        sorted_tweets = sort_tweets(iter(tweets), chunk_size=chunk_size)
+        assert [tweet["id_str"] for tweet in sorted_tweets] == expected
+
+
+def test_make_pool(monkeypatch):
+    monkeypatch.setattr("benchmark.BENCHMARK_WORKERS", 2)
+    monkeypatch.setattr("benchmark.BENCHMARK_POOL", "thread")
+    pool = make_pool()
+    try:
+        # Each worker has its own analysis.
+        analyses = pool.map(lambda _: id(worker_state.analysis), range(20))
+    finally:
+        pool.close()
+        pool.join()
+    assert 1 <= len(set(analyses)) <= 2
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+from httplib2 import Response
+from numpy import array
+from numpy import int64
+from numpy import searchsorted
+from simplejson import dumps
+from simplejson import loads
+from urlparse import parse_qs
+from urlparse import urlsplit
+
+from history import epoch_to_market_time
+from history import market_time_to_epoch
+from logs import Logs
+from market_calendar import epoch_to_market_ordinals
+from simulation import FUND_DOLLARS
+from simulation import get_fees
+
+# The API server the paper broker hands out with its access tokens.
+PAPER_API_SERVER = "https://paper.questrade.invalid/%s"
+
+# The host which hands out the access tokens.
+PAPER_AUTH_HOST = "login.questrade.com"
+
+# The market cap reported for every symbol. Minute bars don't include it, so
+# it's large enough to pass the safeguards.
+PAPER_MARKET_CAP = 10000000000
+
+# The number of days of daily volume averaged for the reported volume.
+PAPER_VOLUME_DAYS = 91
+
+
+class PaperBroker:
+    """A local broker which answers the Questrade API requests made by the
+    trading code from the historical minute bars at a simulated clock. It acts
+    as the HTTP client in the style of httplib2. Market orders fill at the open
+    of the next bar.
+    """
+
+    def __init__(self, history, timestamp, logs_to_cloud, cash=FUND_DOLLARS):
+        self.logs = Logs(name="broker", to_cloud=logs_to_cloud)
+        self.history = history
+        self.time = market_time_to_epoch(timestamp)
+        self.cash = cash
+        self.bars = {}
+        self.symbol_ids = {}
+        self.tickers = []
+        self.positions = {}
+        self.orders = []
+        self.pending_orders = []
+        self.num_requests = 0
+
+    def set_time(self, timestamp):
+        """Moves the simulated clock forward to a timestamp and fills the
+        orders which are due by then.
+        """
+
+        time = market_time_to_epoch(timestamp)
+        if time < self.time:
+            self.logs.warn("Not moving clock backwards: %s" % timestamp)
+            return
+
+        self.time = time
+        self.fill_orders()
+
+    def get_time(self):
+        """Finds the simulated clock as a timestamp in market time."""
+
+        return epoch_to_market_time(self.time)
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """Answers an API request and returns the response and its content."""
+
+        self.num_requests += 1
+        status, content = self.route(uri, method, body)
+
+        response = Response({"status": status,
+                             "content-type": "application/json"})
+        return response, dumps(content)
+
+    def route(self, uri, method, body):
+        """Finds the answer to an API request as a status and JSON content."""
+
+        parts = urlsplit(uri)
+        if parts.netloc == PAPER_AUTH_HOST and parts.path == "/oauth2/token":
+            return 200, self.get_tokens()
+
+        server_parts = urlsplit(PAPER_API_SERVER)
+        if parts.netloc != server_parts.netloc:
+            return 404, self.get_error("Unknown server: %s" % parts.netloc)
+
+        segments = parts.path.strip("/").split("/")
+        if method == "GET":
+            if segments == ["v1", "time"]:
+                return 200, {"time": self.get_time().isoformat()}
+            if segments == ["v1", "symbols", "search"]:
+                prefixes = parse_qs(parts.query).get("prefix", [""])
+                return 200, self.search_symbols(prefixes[0])
+            if segments[:2] == ["v1", "symbols"] and len(segments) == 3:
+                return self.get_symbol(segments[2])
+            if segments[:3] == ["v1", "markets", "quotes"] and len(
+                    segments) == 4:
+                return self.get_quote(segments[3])
+            if segments[:2] == ["v1", "accounts"] and segments[3:] == [
+                    "balances"]:
+                return 200, self.get_balances()
+            if segments[:2] == ["v1", "accounts"] and segments[3:] == [
+                    "positions"]:
+                return 200, self.get_positions()
+        elif method == "POST":
+            if segments[:2] == ["v1", "accounts"] and segments[3:] == [
+                    "orders"]:
+                return self.place_order(body, impact=False)
+            if segments[:2] == ["v1", "accounts"] and segments[3:] == [
+                    "orders", "impact"]:
+                return self.place_order(body, impact=True)
+
+        return 404, self.get_error("Unknown endpoint: %s %s" % (method, uri))
+
+    def get_error(self, message):
+        """Creates an error response in the style of the API."""
+
+        self.logs.warn("Paper broker error: %s" % message)
+        return {"code": 1001, "message": message}
+
+    def get_tokens(self):
+        """Hands out access tokens for the paper API server."""
+
+        return {"access_token": "paper",
+                "api_server": PAPER_API_SERVER,
+                "expires_in": 1800,
+                "refresh_token": "paper",
+                "token_type": "Bearer"}
+
+    def get_bars(self, ticker):
+        """Reads all minute bars of a ticker once."""
+
+        if ticker not in self.bars:
+            self.bars[ticker] = self.history.get_all_bars(ticker)
+        return self.bars[ticker]
+
+    def get_symbol_id(self, ticker):
+        """Assigns a symbol ID to a ticker."""
+
+        if ticker not in self.symbol_ids:
+            self.symbol_ids[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+        return self.symbol_ids[ticker]
+
+    def get_ticker(self, symbol_id):
+        """Finds the ticker of a symbol ID, or None if it's unknown."""
+
+        try:
+            return self.tickers[int(symbol_id)]
+        except (IndexError, ValueError):
+            return None
+
+    def get_price(self, ticker):
+        """Finds the price of the last quote at or before the clock, as long as
+        it's from the same day or the previous trading day.
+        """
+
+        bars = self.get_bars(ticker)
+        if bars is None or not len(bars["time"]):
+            return None
+
+        index = searchsorted(bars["time"], self.time, side="right") - 1
+        if index < 0:
+            return None
+
+        positions, trading = self.history.calendar.get_positions(
+            epoch_to_market_ordinals(array([self.time, bars["time"][index]],
+                                           dtype=int64)))
+        if positions[1] < positions[0] - trading[0]:
+            return None
+
+        return float(bars["open"][index])
+
+    def get_average_volume(self, ticker):
+        """Averages the daily volume of a ticker before the day of the clock.
+        Without earlier days on file, it's the volume of the day of the clock.
+        """
+
+        day = epoch_to_market_ordinals(self.time)
+        start = self.time - PAPER_VOLUME_DAYS * 24 * 3600
+        bars = self.history.get_aggregate_bars(ticker, "day", start, self.time)
+        if bars is None or not len(bars["time"]):
+            return 0
+
+        previous = epoch_to_market_ordinals(bars["time"]) < day
+        if not previous.any():
+            return float(bars["volume"][-1])
+
+        return float(bars["volume"][previous].mean())
+
+    def search_symbols(self, prefix):
+        """Finds the symbol matching a ticker."""
+
+        if not prefix:
+            return {"symbols": []}
+
+        return {"symbols": [{"symbol": prefix,
+                             "symbolId": self.get_symbol_id(prefix),
+                             "currency": "USD",
+                             "securityType": "Stock"}]}
+
+    def get_symbol(self, symbol_id):
+        """Finds the details of a symbol."""
+
+        ticker = self.get_ticker(symbol_id)
+        if ticker is None:
+            return 404, self.get_error("Unknown symbol: %s" % symbol_id)
+
+        return 200, {"symbols": [{
+            "symbol": ticker,
+            "symbolId": int(symbol_id),
+            "marketCap": PAPER_MARKET_CAP,
+            "averageVol3Months": self.get_average_volume(ticker)}]}
+
+    def get_quote(self, symbol_id):
+        """Finds the quote of a symbol at the clock."""
+
+        ticker = self.get_ticker(symbol_id)
+        if ticker is None:
+            return 404, self.get_error("Unknown symbol: %s" % symbol_id)
+
+        price = self.get_price(ticker)
+        if price is None:
+            return 404, self.get_error("No quote for: %s" % ticker)
+
+        return 200, {"quotes": [{"symbol": ticker,
+                                 "symbolId": int(symbol_id),
+                                 "lastTradePrice": price,
+                                 "isHalted": False}]}
+
+    def get_market_value(self):
+        """Values all positions at the clock."""
+
+        value = 0.0
+        for symbol_id, quantity in self.positions.iteritems():
+            price = self.get_price(self.tickers[symbol_id])
+            if price is not None:
+                value += quantity * price
+        return value
+
+    def get_balances(self):
+        """Reports the cash and market value of the account."""
+
+        market_value = self.get_market_value()
+        return {"perCurrencyBalances": [
+            {"currency": "CAD",
+             "cash": 0.0,
+             "marketValue": 0.0,
+             "totalEquity": 0.0},
+            {"currency": "USD",
+             "cash": self.cash,
+             "marketValue": market_value,
+             "totalEquity": self.cash + market_value}]}
+
+    def get_positions(self):
+        """Lists the open positions of the account."""
+
+        positions = []
+        for symbol_id, quantity in sorted(self.positions.iteritems()):
+            if not quantity:
+                continue
+            ticker = self.tickers[symbol_id]
+            price = self.get_price(ticker)
+            positions.append({"symbol": ticker,
+                              "symbolId": symbol_id,
+                              "openQuantity": quantity,
+                              "currentPrice": price,
+                              "currentMarketValue": (
+                                  quantity * price if price is not None
+                                  else None)})
+        return {"positions": positions}
+
+    def place_order(self, body, impact):
+        """Places a market order, or only estimates its impact."""
+
+        try:
+            data = loads(body)
+        except ValueError:
+            return 400, self.get_error("Malformed order: %s" % body)
+
+        ticker = self.get_ticker(data.get("symbolId"))
+        quantity = data.get("quantity")
+        action = data.get("action")
+        if (ticker is None or action not in ["Buy", "Sell"] or
+                not isinstance(quantity, (int, long)) or quantity <= 0):
+            return 400, self.get_error("Invalid order: %s" % data)
+
+        price = self.get_price(ticker)
+        if price is None:
+            return 400, self.get_error("No quote for order: %s" % data)
+
+        fee = float(get_fees(array([quantity]))[0])
+        signed_quantity = quantity if action == "Buy" else -quantity
+        if impact:
+            return 200, {"estimatedCommissions": fee,
+                         "buyingPowerEffect": -signed_quantity * price - fee,
+                         "buyingPowerResult": (self.cash -
+                                               signed_quantity * price - fee)}
+
+        order = {"id": len(self.orders),
+                 "symbol": ticker,
+                 "symbolId": data["symbolId"],
+                 "totalQuantity": quantity,
+                 "filledQuantity": 0,
+                 "side": action,
+                 "orderType": "Market",
+                 "timeInForce": "Day",
+                 "state": "Pending",
+                 "avgExecPrice": None,
+                 "commission": 0.0,
+                 "creationTime": self.get_time().isoformat(),
+                 "signedQuantity": signed_quantity,
+                 "time": self.time}
+        self.orders.append(order)
+        self.pending_orders.append(order)
+        self.logs.debug("Paper order: %s" % order)
+
+        return 200, {"orderId": order["id"],
+                     "orders": [self.get_order_response(order)]}
+
+    def get_order_response(self, order):
+        """Leaves out the internal fields of an order."""
+
+        return dict((key, value) for key, value in order.iteritems() if key
+                    not in ["signedQuantity", "time"])
+
+    def fill_orders(self):
+        """Fills the pending orders at the open of the first bar after each
+        order, once the clock reaches it. Orders expire if there's no such bar
+        on the day of the order.
+        """
+
+        pending_orders = []
+        for order in self.pending_orders:
+            bars = self.get_bars(order["symbol"])
+            index = searchsorted(bars["time"], order["time"], side="right")
+            order_day = epoch_to_market_ordinals(order["time"])
+            if (index == len(bars["time"]) or
+                    epoch_to_market_ordinals(bars["time"][index]) != order_day):
+                if epoch_to_market_ordinals(self.time) > order_day:
+                    order["state"] = "Expired"
+                    self.logs.warn("Paper order expired: %s" % order)
+                else:
+                    pending_orders.append(order)
+                continue
+
+            if bars["time"][index] > self.time:
+                pending_orders.append(order)
+                continue
+
+            price = float(bars["open"][index])
+            fee = float(get_fees(array([order["totalQuantity"]]))[0])
+            symbol_id = order["symbolId"]
+            self.positions[symbol_id] = (self.positions.get(symbol_id, 0) +
+                                         order["signedQuantity"])
+            self.cash -= order["signedQuantity"] * price + fee
+            order["state"] = "Executed"
+            order["filledQuantity"] = order["totalQuantity"]
+            order["avgExecPrice"] = price
+            order["commission"] = fee
+            self.logs.debug("Paper fill: %s" % order)
+
+        self.pending_orders = pending_orders
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from pytest import fixture
+from simplejson import dumps
+from simplejson import loads
+import __builtin__
+
+from broker import PAPER_API_SERVER
+from broker import PaperBroker
+from history import History
+from history import MARKET_TIMEZONE
+from simulation import FUND_DOLLARS
+from simulation import TRADE_FEE_MIN
+from trading import Trading
+
+
+def as_market_time(year, month, day, hour=0, minute=0):
+    """Creates a timestamp in market time."""
+
+    return MARKET_TIMEZONE.localize(datetime(year, month, day, hour, minute))
+
+
+@fixture
+def history():
+    return History(logs_to_cloud=False)
+
+
+@fixture
+def broker(history):
+    return PaperBroker(history, as_market_time(2017, 1, 24, 12, 49),
+                       logs_to_cloud=False)
+
+
+@fixture
+def trading(broker, monkeypatch):
+    monkeypatch.setattr(__builtin__, "QUESTRADE_REFRESH_TOKEN", "paper",
+                        raising=False)
+    return Trading(logs_to_cloud=False, broker=broker)
+
+
+def get(broker, path):
+    response, content = broker.request(PAPER_API_SERVER % path)
+    return response.status, loads(content)
+
+
+def test_time(broker):
+    status, content = get(broker, "v1/time")
+    assert status == 200
+    assert content["time"] == "2017-01-24T12:49:00-05:00"
+
+
+def test_quotes(broker, history):
+    status, content = get(broker, "v1/symbols/search?prefix=TRP")
+    assert status == 200
+    symbol_id = content["symbols"][0]["symbolId"]
+
+    status, content = get(broker, "v1/markets/quotes/%s" % symbol_id)
+    assert status == 200
+    assert content["quotes"][0]["lastTradePrice"] == \
+        history.get_historical_prices(
+            "TRP", as_market_time(2017, 1, 24, 12, 49))["at"]
+
+    status, content = get(broker, "v1/symbols/%s" % symbol_id)
+    assert status == 200
+    assert content["symbols"][0]["averageVol3Months"] > 0
+
+    status, content = get(broker, "v1/markets/quotes/12345")
+    assert status == 404
+    assert "quotes" not in content
+
+
+def test_orders(broker, history):
+    _, content = get(broker, "v1/symbols/search?prefix=TRP")
+    symbol_id = content["symbols"][0]["symbolId"]
+    body = dumps({"symbolId": symbol_id, "quantity": 10, "action": "Buy"})
+
+    response, content = broker.request(
+        PAPER_API_SERVER % "v1/accounts/1/orders/impact", method="POST",
+        body=body)
+    assert "orderId" not in loads(content)
+    assert not broker.orders
+
+    response, content = broker.request(
+        PAPER_API_SERVER % "v1/accounts/1/orders", method="POST", body=body)
+    order = loads(content)["orders"][0]
+    assert order["state"] == "Pending"
+
+    # The order fills at the open of the next bar.
+    broker.set_time(as_market_time(2017, 1, 24, 12, 49))
+    assert broker.orders[0]["state"] == "Pending"
+    broker.set_time(as_market_time(2017, 1, 24, 12, 50))
+    assert broker.orders[0]["state"] == "Executed"
+    price = history.get_historical_prices(
+        "TRP", as_market_time(2017, 1, 24, 12, 50))["at"]
+    assert broker.orders[0]["avgExecPrice"] == price
+    assert broker.cash == FUND_DOLLARS - 10 * price - TRADE_FEE_MIN
+
+    _, content = get(broker, "v1/accounts/1/positions")
+    assert content["positions"][0]["symbol"] == "TRP"
+    assert content["positions"][0]["openQuantity"] == 10
+
+
+def test_expired_order(broker):
+    _, content = get(broker, "v1/symbols/search?prefix=TRP")
+    broker.set_time(as_market_time(2017, 1, 24, 20, 0))
+    broker.request(PAPER_API_SERVER % "v1/accounts/1/orders", method="POST",
+                   body=dumps({"symbolId": content["symbols"][0]["symbolId"],
+                               "quantity": 10, "action": "Sell"}))
+    broker.set_time(as_market_time(2017, 1, 25, 12, 0))
+    assert broker.orders[0]["state"] == "Expired"
+    assert broker.cash == FUND_DOLLARS
+
+
+def test_trading(broker, trading):
+    assert trading.get_market_status() == "open"
+    assert trading.get_balance() == FUND_DOLLARS
+    assert trading.get_last_price("TRP") > 1
+    assert trading.bear("TRP", 10000)
+
+    broker.set_time(as_market_time(2017, 1, 24, 12, 50))
+    positions = trading.get_current_positions()
+    assert len(positions) == 1
+    assert positions[0]["openQuantity"] < 0
+    assert trading.get_balance() > FUND_DOLLARS
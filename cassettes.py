@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+from fcntl import flock
+from fcntl import LOCK_EX
+from fcntl import LOCK_UN
+from hashlib import sha1
+from httplib2 import Response
+from os import makedirs
+from os import path
+from os import SEEK_END
+from simplejson import dumps
+from simplejson import loads
+from threading import Lock
+from urllib import urlencode
+from urlparse import parse_qsl
+from urlparse import urlsplit
+from urlparse import urlunsplit
+
+from logs import Logs
+
+# The filename pattern for cassettes of recorded responses from external APIs.
+CASSETTE_FILE = "cassettes/%s.jsonl"
+
+# The cassette modes. Recording replays known requests and records the
+# responses to new ones, while replaying never touches the network.
+RECORD_MODE = "record"
+REPLAY_MODE = "replay"
+CASSETTE_MODES = [RECORD_MODE, REPLAY_MODE]
+
+# The URL query parameters which hold credentials. They change between runs
+# and don't identify a request, so they're left out of the fingerprint.
+IGNORED_PARAMETERS = ["refresh_token"]
+
+# The fields of JSON responses which hold credentials. They're replaced with a
+# placeholder in recordings, so that cassettes never contain secrets.
+REDACTED_FIELDS = ["access_token", "refresh_token"]
+REDACTED_PLACEHOLDER = "REDACTED"
+
+
+def get_fingerprint(request):
+    """Creates a stable identifier for a JSON-serializable request."""
+
+    return sha1(dumps(request, sort_keys=True)).hexdigest()
+
+
+def strip_ignored_parameters(url):
+    """Removes the ignored query parameters from a URL."""
+
+    parts = urlsplit(url)
+    parameters = [(key, value) for key, value in parse_qsl(
+        parts.query, keep_blank_values=True) if key not in IGNORED_PARAMETERS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path,
+                       urlencode(parameters), parts.fragment))
+
+
+def parse_body(body):
+    """Parses a JSON request body, so that the order of its keys doesn't
+    change the fingerprint. Other bodies are used as they are.
+    """
+
+    if not body:
+        return body
+
+    try:
+        return loads(body)
+    except ValueError:
+        return body
+
+
+def redact_content(content):
+    """Replaces the credentials in a JSON response body with a placeholder.
+    Other bodies are used as they are.
+    """
+
+    try:
+        data = loads(content)
+    except ValueError:
+        return content
+
+    if not isinstance(data, dict) or not any(
+            field in data for field in REDACTED_FIELDS):
+        return content
+
+    for field in REDACTED_FIELDS:
+        if field in data:
+            data[field] = REDACTED_PLACEHOLDER
+    return dumps(data)
+
+
+def redact_response(response):
+    """Replaces the credentials in a recorded HTTP response."""
+
+    return {"headers": response["headers"],
+            "content": redact_content(response["content"])}
+
+
+class Cassette:
+    """A helper for recording responses from an external API to a local file
+    and replaying them by request fingerprint. The file is append-only, with
+    one interaction per line, and only the positions of the interactions are
+    kept in memory.
+    """
+
+    def __init__(self, name, mode, logs_to_cloud):
+        self.logs = Logs(name="cassettes", to_cloud=logs_to_cloud)
+        self.name = name
+        self.mode = mode
+        self.filename = CASSETTE_FILE % name
+        self.lock = Lock()
+
+        # The offsets of the recorded interactions in the file by fingerprint,
+        # and how much of the file has been indexed.
+        self.index = {}
+        self.indexed_size = 0
+
+        if mode not in CASSETTE_MODES:
+            self.logs.error("Unknown cassette mode: %s" % mode)
+
+    def call(self, request, function, redact=None):
+        """Replays the response to a request or, when recording, calls the
+        function to get the response and records it. Both the request and the
+        response need to be JSON-serializable. The optional redact function
+        removes secrets from the response before it's recorded or replayed.
+        """
+
+        fingerprint = get_fingerprint(request)
+        with self.lock:
+            interaction = self.find_interaction(fingerprint)
+        if interaction:
+            self.logs.debug("Replaying %s response: %s" % (self.name, request))
+            response = interaction["response"]
+            if redact:
+                response = redact(response)
+            return response
+
+        if self.mode != RECORD_MODE:
+            self.logs.error("No recorded %s response: %s" %
+                            (self.name, request))
+            raise LookupError("No recorded %s response: %s" %
+                              (self.name, request))
+
+        response = function()
+
+        if redact:
+            recorded = redact(response)
+        else:
+            recorded = response
+        with self.lock:
+            self.logs.debug("Recording %s response: %s" % (self.name, request))
+            self.append_interaction(fingerprint, {"request": request,
+                                                  "response": recorded})
+
+        return response
+
+    def find_interaction(self, fingerprint):
+        """Reads a recorded interaction or returns None if there is none. The
+        interactions recorded since the file was last indexed, like by other
+        processes, are indexed first.
+        """
+
+        if fingerprint not in self.index:
+            self.update_index()
+
+        offset = self.index.get(fingerprint)
+        if offset is None:
+            return None
+
+        cassette_file = open(self.filename, "rb")
+        try:
+            cassette_file.seek(offset)
+            line = cassette_file.readline()
+            return loads(line.split("\t", 1)[1])
+        except (IndexError, ValueError) as exception:
+            self.logs.error("Failed to read cassette %s: %s" %
+                            (self.name, exception))
+            return None
+        finally:
+            cassette_file.close()
+
+    def update_index(self):
+        """Indexes the interactions which were added to the file since it was
+        last indexed.
+        """
+
+        if not path.isfile(self.filename):
+            return
+
+        cassette_file = open(self.filename, "rb")
+        try:
+            cassette_file.seek(self.indexed_size)
+            offset = self.indexed_size
+            for line in cassette_file:
+                # Skip a partial line which is still being written.
+                if not line.endswith("\n"):
+                    break
+
+                fingerprint = line.split("\t", 1)[0]
+                self.index.setdefault(fingerprint, offset)
+                offset += len(line)
+            self.indexed_size = offset
+        finally:
+            cassette_file.close()
+
+    def append_interaction(self, fingerprint, interaction):
+        """Appends a recorded interaction to the file."""
+
+        directory = path.dirname(self.filename)
+        if directory and not path.isdir(directory):
+            try:
+                makedirs(directory)
+            except OSError:
+                # Another worker created it first.
+                pass
+
+        # The JSON is escaped to ASCII, so it never contains a line break.
+        line = "%s\t%s\n" % (fingerprint, dumps(interaction, sort_keys=True))
+
+        # Other processes may be recording to the same cassette, so hold a
+        # lock while appending.
+        cassette_file = open(self.filename, "a+b")
+        flock(cassette_file, LOCK_EX)
+        try:
+            cassette_file.seek(0, SEEK_END)
+            offset = cassette_file.tell()
+
+            # Finish a partial line left behind by an interrupted write.
+            if offset:
+                cassette_file.seek(-1, SEEK_END)
+                if cassette_file.read(1) != "\n":
+                    cassette_file.seek(0, SEEK_END)
+                    cassette_file.write("\n")
+                    offset += 1
+
+            cassette_file.seek(0, SEEK_END)
+            cassette_file.write(line)
+            cassette_file.flush()
+        finally:
+            flock(cassette_file, LOCK_UN)
+            cassette_file.close()
+
+        self.index.setdefault(fingerprint, offset)
+
+
+class CassetteHttp:
+    """An HTTP client in the style of httplib2 which goes through a cassette.
+    The real client is only created once a request needs the network.
+    """
+
+    def __init__(self, cassette, make_http):
+        self.cassette = cassette
+        self.make_http = make_http
+        self.http = None
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """Makes a request and returns the response and its content."""
+
+        request = [method, strip_ignored_parameters(uri), parse_body(body)]
+        recorded = self.cassette.call(request, lambda: self.make_request(
+            uri, method, body, headers, **kwargs), redact=redact_response)
+
+        return Response(recorded["headers"]), recorded["content"].encode(
+            "utf-8")
+
+    def make_request(self, uri, method, body, headers, **kwargs):
+        """Makes a request with the real client."""
+
+        if not self.http:
+            self.http = self.make_http()
+
+        response, content = self.http.request(uri, method=method, body=body,
+                                              headers=headers, **kwargs)
+        return {"headers": dict(response), "content": content.decode("utf-8")}
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+from httplib2 import Response
+from pytest import fixture
+from pytest import raises
+from simplejson import dumps
+
+from analysis import Analysis
+from cassettes import Cassette
+from cassettes import CassetteHttp
+from cassettes import get_fingerprint
+from cassettes import parse_body
+from cassettes import redact_content
+from cassettes import RECORD_MODE
+from cassettes import REPLAY_MODE
+from cassettes import strip_ignored_parameters
+
+
+@fixture
+def cassette_file(tmpdir, monkeypatch):
+    monkeypatch.setattr("cassettes.CASSETTE_FILE",
+                        str(tmpdir.join("cassettes", "%s.jsonl")))
+    return tmpdir.join("cassettes", "test.jsonl")
+
+
+class RecordingHttp:
+    """An HTTP client which counts its requests and answers with JSON."""
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, uri, method="GET", body=None, headers=None):
+        self.requests.append((uri, method, body, headers))
+        return Response({"status": "200"}), dumps({"uri": uri})
+
+
+def test_get_fingerprint():
+    assert get_fingerprint({"a": 1, "b": [2, 3]}) == get_fingerprint(
+        {"b": [2, 3], "a": 1})
+    assert get_fingerprint(["GET", "x"]) != get_fingerprint(["POST", "x"])
+
+
+def test_parse_body():
+    assert parse_body('{"b": 1, "a": 2}') == {"a": 2, "b": 1}
+    assert parse_body("a=1") == "a=1"
+    assert parse_body("") == ""
+    assert parse_body(None) is None
+
+
+def test_strip_ignored_parameters():
+    assert strip_ignored_parameters(
+        "https://login.questrade.com/oauth2/token?grant_type=refresh_token"
+        "&refresh_token=abc") == (
+            "https://login.questrade.com/oauth2/token?grant_type=refresh_token")
+    assert strip_ignored_parameters("https://a.b/c?d=e") == "https://a.b/c?d=e"
+
+
+def test_redact_content():
+    assert redact_content(
+        '{"access_token": "abc", "refresh_token": "def", "expires_in": 1}'
+    ) == dumps({"access_token": "REDACTED", "refresh_token": "REDACTED",
+                "expires_in": 1})
+    assert redact_content('{"uri": "x"}') == '{"uri": "x"}'
+    assert redact_content("[1]") == "[1]"
+    assert redact_content("abc") == "abc"
+
+
+def test_call(cassette_file):
+    calls = []
+
+    def function():
+        calls.append(True)
+        return {"value": u"é"}
+
+    cassette = Cassette(name="test", mode=RECORD_MODE, logs_to_cloud=False)
+    assert cassette.call(["request"], function) == {"value": u"é"}
+    assert cassette.call(["request"], function) == {"value": u"é"}
+    assert len(calls) == 1
+    assert cassette_file.check()
+
+    replay_cassette = Cassette(name="test", mode=REPLAY_MODE,
+                               logs_to_cloud=False)
+    assert replay_cassette.call(["request"], function) == {
+        "value": u"é"}
+    with raises(LookupError):
+        replay_cassette.call(["other request"], function)
+    assert len(calls) == 1
+
+
+def test_cassette_http(cassette_file):
+    http = RecordingHttp()
+    cassette = Cassette(name="test", mode=RECORD_MODE, logs_to_cloud=False)
+    cassette_http = CassetteHttp(cassette, lambda: http)
+    response, content = cassette_http.request("https://a.b/c?refresh_token=1")
+    assert response.status == 200
+    assert content == '{"uri": "https://a.b/c?refresh_token=1"}'
+
+    # The credentials in the URL don't matter for replaying.
+    replay_cassette = Cassette(name="test", mode=REPLAY_MODE,
+                               logs_to_cloud=False)
+    response, content = CassetteHttp(replay_cassette, None).request(
+        "https://a.b/c?refresh_token=2")
+    assert response.status == 200
+    assert content == '{"uri": "https://a.b/c?refresh_token=1"}'
+    assert len(http.requests) == 1
+
+
+def test_analysis_replay(cassette_file, monkeypatch):
+    monkeypatch.setattr("analysis.get", None)
+    analysis = Analysis(logs_to_cloud=False, cassette_mode=RECORD_MODE)
+    analysis.gcnl_cassette.call(
+        ["POST", "https://language.googleapis.com/v1/documents:"
+         "analyzeSentiment",
+         {"document": {"content": "Great!", "type": "PLAIN_TEXT",
+                       "language": "en-US"}}],
+        lambda: {"headers": {"status": "200",
+                             "content-type": "application/json"},
+                 "content": '{"documentSentiment": {"score": 0.9,'
+                            ' "magnitude": 0.9}}'})
+    analysis.wikidata_cassette.call(
+        ["GET", "https://query.wikidata.org/sparql?query=x&format=JSON"],
+        lambda: {"results": {"bindings": [{"tickerLabel": {"value": "F"}}]}})
+
+    replay_analysis = Analysis(logs_to_cloud=False, cassette_mode=REPLAY_MODE)
+    assert replay_analysis.get_sentiment("Great!") == 0.9
+    assert replay_analysis.make_wikidata_request("x") == [
+        {"tickerLabel": {"value": "F"}}]
+
+
+def test_concurrent_recording(cassette_file):
+    first_cassette = Cassette(name="test", mode=RECORD_MODE,
+                              logs_to_cloud=False)
+    second_cassette = Cassette(name="test", mode=RECORD_MODE,
+                               logs_to_cloud=False)
+    first_cassette.call(["first"], lambda: 1)
+    second_cassette.call(["second"], lambda: 2)
+
+    # Each cassette sees what the other one recorded.
+    assert first_cassette.call(["second"], None) == 2
+    assert second_cassette.call(["first"], None) == 1
+
+    replay_cassette = Cassette(name="test", mode=REPLAY_MODE,
+                               logs_to_cloud=False)
+    assert replay_cassette.call(["first"], None) == 1
+    assert replay_cassette.call(["second"], None) == 2
+
+
+def test_redacted_recording(cassette_file):
+    class TokenHttp:
+        def request(self, uri, method="GET", body=None, headers=None):
+            return Response({"status": "200"}), dumps(
+                {"access_token": "secret", "api_server": "https://a.b/"})
+
+    # The live response keeps the credentials, but the recording doesn't.
+    cassette = Cassette(name="test", mode=RECORD_MODE, logs_to_cloud=False)
+    response, content = CassetteHttp(cassette, TokenHttp).request(
+        "https://a.b/token?refresh_token=1")
+    assert "secret" in content
+    assert "secret" not in cassette_file.read()
+
+    replay_cassette = Cassette(name="test", mode=REPLAY_MODE,
+                               logs_to_cloud=False)
+    response, content = CassetteHttp(replay_cassette, None).request(
+        "https://a.b/token?refresh_token=2")
+    assert '"access_token": "REDACTED"' in content
+
+
+def test_append_only(cassette_file):
+    cassette = Cassette(name="test", mode=RECORD_MODE, logs_to_cloud=False)
+    cassette.call(["first"], lambda: 1)
+    cassette.call(["second"], lambda: {"value": u"\u00e9\n"})
+    lines = cassette_file.read().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith(get_fingerprint(["first"]) + "\t")
+
+    # An interrupted write leaves a partial line, which is skipped.
+    cassette_file.write("abc\t{", mode="a")
+    cassette.call(["third"], lambda: 3)
+    replay_cassette = Cassette(name="test", mode=REPLAY_MODE,
+                               logs_to_cloud=False)
+    assert replay_cassette.call(["first"], None) == 1
+    assert replay_cassette.call(["second"], None) == {"value": u"\u00e9\n"}
+    assert replay_cassette.call(["third"], None) == 3
+    assert get_fingerprint(["third"]) in replay_cassette.index
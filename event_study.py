@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+from numpy import arange
+from numpy import array
+from numpy import float64
+from numpy import full
+from numpy import int64
+from numpy import maximum
+from numpy import nan
+from numpy import searchsorted
+from numpy import where
+
+from history import market_time_to_epoch
+from market_calendar import epoch_to_market_ordinals
+
+# The default window of the event study in minutes relative to each tweet,
+# from an hour before until a full trading session after.
+EVENT_WINDOW_START = -60
+EVENT_WINDOW_END = 390
+
+
+def get_offsets(start=EVENT_WINDOW_START, end=EVENT_WINDOW_END):
+    """Lists the minute offsets of an event window, including both ends."""
+
+    return arange(start, end + 1, dtype=int64)
+
+
+def get_event_prices(history, requests, offsets=None):
+    """Finds the price of each (ticker, timestamp) pair at every minute offset
+    in the window around the timestamp, as a matrix with a row per pair and a
+    column per offset. The price is that of the last quote at or before the
+    time, as long as the quote is from the same day or the previous trading
+    day. Other prices are NaN.
+    """
+
+    if offsets is None:
+        offsets = get_offsets()
+
+    prices = full((len(requests), len(offsets)), nan, dtype=float64)
+
+    # Look up all pairs of a ticker at once.
+    rows_by_ticker = {}
+    for row, (ticker, timestamp) in enumerate(requests):
+        if ticker not in rows_by_ticker:
+            rows_by_ticker[ticker] = []
+        rows_by_ticker[ticker].append(row)
+
+    for ticker, rows in rows_by_ticker.iteritems():
+        bars = history.get_all_bars(ticker)
+        if bars is None or not len(bars["time"]):
+            continue
+
+        event_times = array([market_time_to_epoch(requests[row][1]) for row
+                             in rows], dtype=int64)
+        times = event_times[:, None] + offsets[None, :] * 60
+        indices = searchsorted(bars["time"], times, side="right") - 1
+        safe_indices = maximum(indices, 0)
+
+        # Don't carry quotes across days without market data.
+        positions, trading = history.calendar.get_positions(
+            epoch_to_market_ordinals(times))
+        quote_positions, _ = history.calendar.get_positions(
+            epoch_to_market_ordinals(bars["time"]))
+        fresh = (indices >= 0) & (
+            quote_positions[safe_indices] >= positions - trading)
+
+        prices[rows] = where(fresh, bars["open"][safe_indices], nan)
+
+    return prices
+
+
+def get_event_returns(prices, offsets=None):
+    """Converts a matrix of event prices into returns relative to the price
+    at the time of each event.
+    """
+
+    if offsets is None:
+        offsets = get_offsets()
+
+    zero_offset = searchsorted(offsets, 0)
+    if zero_offset == len(offsets) or offsets[zero_offset] != 0:
+        raise ValueError("Event window doesn't include the event time.")
+
+    return prices / prices[:, zero_offset:zero_offset + 1] - 1
+
+
+def get_entry_returns(prices, exit_prices, directions=None):
+    """Calculates the return of entering at each offset of the event window
+    and exiting at a given price per event, like the price at EOD. Directions
+    of -1 for bear strategies reverse the returns.
+    """
+
+    returns = exit_prices[:, None] / prices - 1
+    if directions is not None:
+        returns = where(directions[:, None] < 0, prices / exit_prices[:, None]
+                        - 1, returns)
+    return returns
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from datetime import timedelta
+from numpy import array
+from numpy import isnan
+from pytest import fixture
+from pytest import raises
+
+from event_study import get_entry_returns
+from event_study import get_event_prices
+from event_study import get_event_returns
+from event_study import get_offsets
+from history import History
+from history import MARKET_TIMEZONE
+
+
+@fixture
+def history():
+    return History(logs_to_cloud=False)
+
+
+def as_market_time(year, month, day, hour=0, minute=0):
+    """Creates a timestamp in market time."""
+
+    return MARKET_TIMEZONE.localize(datetime(year, month, day, hour, minute))
+
+
+def test_get_offsets():
+    offsets = get_offsets()
+    assert offsets[0] == -60
+    assert offsets[-1] == 390
+    assert len(offsets) == 451
+    assert get_offsets(-1, 1).tolist() == [-1, 0, 1]
+
+
+def test_get_event_prices(history):
+    timestamp = as_market_time(2017, 1, 24, 12, 49)
+    offsets = get_offsets(-30, 30)
+    prices = get_event_prices(history, [("TRP", timestamp), ("ZZZZ", timestamp),
+                                        ("TRP", timestamp)], offsets)
+    assert prices.shape == (3, 61)
+    for column in [0, 29, 30, 31, 60]:
+        offset_timestamp = timestamp + timedelta(minutes=int(offsets[column]))
+        assert prices[0, column] == history.get_historical_prices(
+            "TRP", offset_timestamp)["at"]
+    assert isnan(prices[1]).all()
+    assert (prices[2] == prices[0]).all()
+
+
+def test_get_event_prices_stale(history):
+    # Without the previous trading day on file, quotes before the open are
+    # missing, but quotes after the close carry over into the evening.
+    prices = get_event_prices(history, [
+        ("BA", as_market_time(2016, 12, 5, 9, 30)),
+        ("BA", as_market_time(2016, 12, 6, 20, 0))], get_offsets(-60, 60))
+    assert isnan(prices[0, :30]).all()
+    assert not isnan(prices[0, 60:]).any()
+    assert not isnan(prices[1]).any()
+    assert prices[1, 0] == prices[1, -1]
+
+
+def test_get_event_returns():
+    prices = array([[10.0, 11.0, 12.0], [20.0, 20.0, 18.0]])
+    returns = get_event_returns(prices, array([-1, 0, 1]))
+    assert returns[0].tolist() == [10.0 / 11 - 1, 0.0, 12.0 / 11 - 1]
+    assert returns[1].tolist() == [0.0, 0.0, 18.0 / 20 - 1]
+    with raises(ValueError):
+        get_event_returns(prices, array([1, 2, 3]))
+
+
+def test_get_entry_returns():
+    prices = array([[10.0, 11.0], [20.0, 25.0]])
+    returns = get_entry_returns(prices, array([11.0, 20.0]),
+                                directions=array([1, -1]))
+    assert returns[0].tolist() == [11.0 / 10 - 1, 0.0]
+    assert returns[1].tolist() == [0.0, 0.25]
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from numpy import arange
+from numpy import array
+from numpy import float64
+from numpy import inf
+from numpy import int64
+from numpy import isnan
+from numpy import maximum
+from numpy import minimum
+from numpy import unravel_index
+from numpy import where
+
+from analysis import Analysis
+from benchmark import CASSETTE_MODE
+from event_study import get_event_prices
+from event_study import get_offsets
+from history import History
+from history import market_time_to_epoch
+from history import MARKET_TIMEZONE
+from sweep import get_events
+from trading import get_direction
+from twitter import Twitter
+
+# The longest time in minutes a position can be held, from the start of the
+# pre-market session until the close.
+EXIT_WINDOW = 510
+
+# The exit rules to evaluate, as fractions of the entry value and as minutes
+# after the entry. None disables a rule, which means holding until the close.
+STOP_LOSSES = [None, 0.0025, 0.005, 0.01, 0.02, 0.05]
+TAKE_PROFITS = [None, 0.0025, 0.005, 0.01, 0.02, 0.05]
+TRAILING_STOPS = [None, 0.0025, 0.005, 0.01, 0.02]
+HOLDING_TIMES = [None, 5, 15, 30, 60, 120, 240]
+
+
+def get_thresholds(rules):
+    """Converts exit rules into an array of thresholds where None never
+    triggers.
+    """
+
+    return array([inf if rule is None else rule for rule in rules],
+                 dtype=float64)
+
+
+def count_before(values, limits):
+    """Counts the leading values of each row which are below each limit, which
+    for non-decreasing rows is the index of the first value at or above it.
+    Returns a matrix with a row per row of values and a column per limit.
+    """
+
+    return (values[:, :, None] < limits[None, None, :]).sum(axis=1)
+
+
+def get_exit_paths(history, requests, directions):
+    """Finds the value of a position relative to its entry at each minute
+    until the close, for a list of (ticker, timestamp) entries with
+    directions of 1 for bull and -1 for bear strategies. Values after the
+    close stay at the closing value.
+    """
+
+    offsets = get_offsets(0, EXIT_WINDOW)
+    prices = get_event_prices(history, requests, offsets)
+    entry_prices = prices[:, :1]
+    values = where(directions[:, None] < 0, entry_prices / prices,
+                   prices / entry_prices)
+
+    # Find the minute of the close after each entry.
+    close_indices = []
+    for ticker, timestamp in requests:
+        close_hour, close_minute = history.get_close_time(timestamp)
+        close_timestamp = MARKET_TIMEZONE.localize(timestamp.replace(
+            hour=close_hour, minute=close_minute, tzinfo=None))
+        close_indices.append((market_time_to_epoch(close_timestamp) -
+                              market_time_to_epoch(timestamp)) // 60)
+    close_indices = minimum(maximum(array(close_indices, dtype=int64), 0),
+                            EXIT_WINDOW)
+
+    rows = arange(len(requests))
+    close_values = values[rows, close_indices]
+    values = where(offsets[None, :] > close_indices[:, None],
+                   close_values[:, None], values)
+
+    # Only entries with prices all the way to the close can be evaluated.
+    valid = ~isnan(values).any(axis=1) & (close_indices > 0)
+    values = where(valid[:, None], values, 1.0)
+
+    return {"values": values,
+            "close_indices": close_indices,
+            "valid": valid}
+
+
+def backtest_exits(paths, stop_losses=STOP_LOSSES, take_profits=TAKE_PROFITS,
+                   trailing_stops=TRAILING_STOPS,
+                   holding_times=HOLDING_TIMES):
+    """Evaluates every combination of stop-loss, take-profit, trailing-stop and
+    holding time exits on the position paths. Each position exits at the first
+    minute where any rule triggers. Returns the return of every position and
+    the mean return over the valid positions for each combination, indexed by
+    stop loss, take profit, trailing stop and holding time, or None if there
+    are no valid positions.
+    """
+
+    values = paths["values"]
+    close_indices = paths["close_indices"]
+    valid = paths["valid"]
+    if not valid.any():
+        return None
+
+    # The running extremes never decrease (or increase), so the first minute
+    # a threshold is crossed is the number of minutes before it.
+    lowest = minimum.accumulate(values, axis=1)
+    highest = maximum.accumulate(values, axis=1)
+    drawdowns = maximum.accumulate(1 - values / highest, axis=1)
+    stop_loss_exits = count_before(-lowest, get_thresholds(stop_losses) - 1)
+    take_profit_exits = count_before(highest, get_thresholds(take_profits) +
+                                     1)
+    trailing_stop_exits = count_before(drawdowns,
+                                       get_thresholds(trailing_stops))
+    holding_limits = array([EXIT_WINDOW if holding_time is None else
+                            holding_time for holding_time in holding_times],
+                           dtype=int64)
+    time_exits = minimum(holding_limits[None, :], close_indices[:, None])
+
+    exit_indices = minimum(
+        minimum(stop_loss_exits[:, :, None, None, None],
+                take_profit_exits[:, None, :, None, None]),
+        minimum(trailing_stop_exits[:, None, None, :, None],
+                time_exits[:, None, None, None, :]))
+
+    rows = arange(len(values))[:, None, None, None, None]
+    returns = values[rows, exit_indices] - 1
+    mean_returns = returns[valid].mean(axis=0)
+
+    return {"returns": returns,
+            "mean_returns": mean_returns,
+            "exit_indices": exit_indices}
+
+
+def get_best_exits(results, count=1, stop_losses=STOP_LOSSES,
+                   take_profits=TAKE_PROFITS, trailing_stops=TRAILING_STOPS,
+                   holding_times=HOLDING_TIMES):
+    """Ranks the combinations of exit rules by their mean return and returns
+    the best ones, highest first. Ties go to the combination which comes
+    first in the lists of rules.
+    """
+
+    mean_returns = results["mean_returns"]
+    order = (-mean_returns.ravel()).argsort(kind="mergesort")
+
+    best_exits = []
+    for flat_index in order[:count].tolist():
+        stop_loss, take_profit, trailing_stop, holding_time = unravel_index(
+            flat_index, mean_returns.shape)
+        best_exits.append({
+            "stop_loss": stop_losses[stop_loss],
+            "take_profit": take_profits[take_profit],
+            "trailing_stop": trailing_stops[trailing_stop],
+            "holding_time": holding_times[holding_time],
+            "mean_return": float(mean_returns[stop_loss, take_profit,
+                                              trailing_stop, holding_time])})
+
+    return best_exits
+
+
+def format_rule(rule, unit):
+    """Converts an exit rule into a readable string."""
+
+    if rule is None:
+        return "-"
+    if unit == "%":
+        return "%.2f%%" % (100 * rule)
+    return "%s %s" % (rule, unit)
+
+
+if __name__ == "__main__":
+    analysis = Analysis(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+    history = History(logs_to_cloud=False)
+    twitter = Twitter(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+
+    # Enter every position the benchmark strategy would take at the tweet.
+    requests = []
+    directions = []
+    for event in get_events(analysis, twitter):
+        market_status = history.get_market_status(event["timestamp"])
+        for company in event["companies"]:
+            direction, _ = get_direction(company, market_status)
+            if not direction:
+                continue
+            requests.append((company["ticker"], event["timestamp"]))
+            directions.append(direction)
+
+    paths = get_exit_paths(history, requests, array(directions,
+                                                    dtype=int64))
+    results = backtest_exits(paths)
+
+    # Print out the best combinations of exit rules as markdown.
+    print "## Exit Rule Report"
+    print
+    if not results:
+        print "There are no valid positions to evaluate the exit rules on."
+    else:
+        print ("This ranks combinations of exit rules by their mean return "
+               "over %s positions entered at the tweet.") % (
+                   paths["valid"].sum())
+        print
+        print ("Stop loss | Take profit | Trailing stop | Holding time | "
+               "Mean return")
+        print ("----------|-------------|---------------|--------------|"
+               "------------")
+        for best_exit in get_best_exits(results, count=20):
+            print "%s | %s | %s | %s | %.3f%%" % (
+                format_rule(best_exit["stop_loss"], "%"),
+                format_rule(best_exit["take_profit"], "%"),
+                format_rule(best_exit["trailing_stop"], "%"),
+                format_rule(best_exit["holding_time"], "min"),
+                100 * best_exit["mean_return"])
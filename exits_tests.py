@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from numpy import array
+from numpy import float64
+from numpy import int64
+from pytest import fixture
+
+from exits import backtest_exits
+from exits import EXIT_WINDOW
+from exits import get_best_exits
+from exits import get_exit_paths
+from history import History
+from history import MARKET_TIMEZONE
+
+
+@fixture
+def history():
+    return History(logs_to_cloud=False)
+
+
+def as_market_time(year, month, day, hour=0, minute=0):
+    """Creates a timestamp in market time."""
+
+    return MARKET_TIMEZONE.localize(datetime(year, month, day, hour, minute))
+
+
+def make_paths(values, close_indices):
+    return {"values": array(values, dtype=float64),
+            "close_indices": array(close_indices, dtype=int64),
+            "valid": array([True] * len(values))}
+
+
+def test_get_exit_paths(history):
+    timestamp = as_market_time(2017, 1, 24, 12, 49)
+    paths = get_exit_paths(history, [("TRP", timestamp), ("TRP", timestamp),
+                                     ("ZZZZ", timestamp)],
+                           array([1, -1, 1], dtype=int64))
+    assert paths["values"].shape == (3, EXIT_WINDOW + 1)
+    assert paths["close_indices"].tolist() == [191, 191, 191]
+    assert paths["valid"].tolist() == [True, True, False]
+
+    values = paths["values"]
+    assert values[0, 0] == 1.0
+    assert abs(values[0, 191] * values[1, 191] - 1) < 1e-12
+    assert (values[0, 191:] == values[0, 191]).all()
+    assert (values[2] == 1.0).all()
+
+    price_at = history.get_historical_prices("TRP", timestamp)["at"]
+    price_close = history.get_historical_prices(
+        "TRP", as_market_time(2017, 1, 24, 16, 0))["at"]
+    assert values[0, 191] == price_close / price_at
+
+
+def test_backtest_exits():
+    paths = make_paths([[1.0, 1.01, 0.98, 1.03, 1.0, 1.0],
+                        [1.0, 0.99, 1.02, 1.0, 1.02, 1.0]], [5, 4])
+    results = backtest_exits(paths, stop_losses=[None, 0.01],
+                             take_profits=[None, 0.02],
+                             trailing_stops=[None, 0.025],
+                             holding_times=[None, 1])
+    exit_indices = results["exit_indices"]
+    returns = results["returns"]
+
+    # Hold until the close.
+    assert exit_indices[:, 0, 0, 0, 0].tolist() == [5, 4]
+
+    # Stop out at the first loss of at least 1%.
+    assert exit_indices[:, 1, 0, 0, 0].tolist() == [2, 1]
+    assert abs(returns[0, 1, 0, 0, 0] + 0.02) < 1e-12
+
+    # Take profits at the first gain of at least 2%.
+    assert exit_indices[:, 0, 1, 0, 0].tolist() == [3, 2]
+
+    # Trail the peak by 2.5%.
+    assert exit_indices[:, 0, 0, 1, 0].tolist() == [2, 4]
+
+    # Exit after a minute unless another rule triggers first.
+    assert exit_indices[:, 0, 0, 0, 1].tolist() == [1, 1]
+    assert exit_indices[:, 0, 1, 1, 1].tolist() == [1, 1]
+
+    assert results["mean_returns"].shape == (2, 2, 2, 2)
+    assert abs(results["mean_returns"][0, 1, 0, 0] - 0.025) < 1e-12
+
+
+def test_backtest_exits_invalid():
+    paths = make_paths([[1.0, 1.1], [1.0, 0.5]], [1, 1])
+    paths["valid"] = array([True, False])
+    results = backtest_exits(paths, stop_losses=[None], take_profits=[None],
+                             trailing_stops=[None], holding_times=[None])
+    assert abs(results["mean_returns"][0, 0, 0, 0] - 0.1) < 1e-12
+
+
+def test_backtest_exits_no_valid():
+    paths = make_paths([[1.0, 1.1]], [1])
+    paths["valid"] = array([False])
+    assert backtest_exits(paths, stop_losses=[None], take_profits=[None],
+                          trailing_stops=[None], holding_times=[None]) is None
+
+
+def test_get_best_exits():
+    paths = make_paths([[1.0, 1.02, 0.9], [1.0, 1.02, 0.95]], [2, 2])
+    results = backtest_exits(paths, stop_losses=[None, 0.01],
+                             take_profits=[None, 0.02],
+                             trailing_stops=[None], holding_times=[None, 1])
+    best_exits = get_best_exits(results, count=3, stop_losses=[None, 0.01],
+                                take_profits=[None, 0.02],
+                                trailing_stops=[None], holding_times=[None, 1])
+
+    # Taking profits and exiting after a minute tie, so the combination which
+    # comes first in the lists of rules wins.
+    assert [(best_exit["stop_loss"], best_exit["take_profit"],
+             best_exit["trailing_stop"], best_exit["holding_time"]) for
+            best_exit in best_exits] == [(None, None, None, 1),
+                                         (None, 0.02, None, None),
+                                         (None, 0.02, None, 1)]
+    assert abs(best_exits[0]["mean_return"] - 0.02) < 1e-12
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from os import chmod
+from os import close
+from os import path
+from os import remove
+from os import rename
+from os import umask
+from tempfile import mkstemp
+
+
+def get_file_mode():
+    """Finds the permissions which new files get under the umask."""
+
+    mask = umask(0)
+    umask(mask)
+    return 0666 & ~mask
+
+
+# The permissions for new files. Temporary files are created private, so they
+# get these before they are renamed into place.
+FILE_MODE = get_file_mode()
+
+
+def make_temp_filename(filename):
+    """Creates a unique temporary file next to a file, to write it before
+    renaming it into place, even with other workers writing the same file.
+    """
+
+    temp_file, temp_filename = mkstemp(
+        prefix="%s." % path.basename(filename), suffix=".tmp",
+        dir=path.dirname(filename) or ".")
+    close(temp_file)
+    chmod(temp_filename, FILE_MODE)
+    return temp_filename
+
+
+def write_file(filename, write, mode="w"):
+    """Writes a file through a function which is given a temporary file next
+    to it, then renames that into place so that readers never see a partial
+    file. The temporary file is removed if writing it fails.
+    """
+
+    temp_filename = make_temp_filename(filename)
+    try:
+        temp_file = open(temp_filename, mode)
+        try:
+            write(temp_file)
+        finally:
+            temp_file.close()
+        rename(temp_filename, filename)
+    finally:
+        if path.exists(temp_filename):
+            remove(temp_filename)
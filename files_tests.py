@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+from os import stat
+from pytest import raises
+from stat import S_IMODE
+
+from files import FILE_MODE
+from files import make_temp_filename
+from files import write_file
+
+
+def test_make_temp_filename(tmpdir):
+    filename = str(tmpdir.join("NYT.bars"))
+    first = make_temp_filename(filename)
+    second = make_temp_filename(filename)
+    assert first != second
+    assert first.startswith(filename) and first.endswith(".tmp")
+    assert tmpdir.join(first.split("/")[-1]).check()
+    assert S_IMODE(stat(first).st_mode) == FILE_MODE
+
+
+def test_write_file(tmpdir):
+    filename = str(tmpdir.join("results.json"))
+    write_file(filename, lambda result_file: result_file.write("first"))
+    assert tmpdir.join("results.json").read() == "first"
+    assert S_IMODE(stat(filename).st_mode) == FILE_MODE
+
+    def fail(result_file):
+        result_file.write("partial")
+        raise IOError("Disk full.")
+
+    # A failed write leaves the file as it was and no temporary file behind.
+    with raises(IOError):
+        write_file(filename, fail)
+    assert tmpdir.join("results.json").read() == "first"
+    assert tmpdir.listdir() == [tmpdir.join("results.json")]
@@ -0,0 +1,589 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from datetime import timedelta
+from glob import glob
+from numpy import array
+from numpy import float64
+from numpy import int64
+from numpy import maximum
+from numpy import searchsorted
+from os import path
+
+from aggregates import Aggregates
+from archive import Archive
+from archive import ARCHIVE_DATA_FILE
+from archive import ARCHIVE_INDEX_FILE
+from archive import concatenate_bars
+from archive import empty_bars
+from archive import epoch_to_market_days
+from archive import sort_bars
+from files import write_file
+from logs import Logs
+from market_calendar import epoch_to_market_time
+from market_calendar import get_market_midnight
+from market_calendar import MarketCalendar
+from market_calendar import MARKET_TIMEZONE
+from market_calendar import market_time_to_epoch
+
+# The filename pattern for historical market data.
+MARKET_DATA_FILE = "market_data/%s_%s.txt"
+
+# The filename pattern for the end-of-day index of the historical market data.
+# It has one line per day with the last price and the first and last quote
+# times, so that closing prices don't require reading a whole day of quotes.
+EOD_INDEX_FILE = "market_data/%s_eod.csv"
+
+# The header line of the end-of-day index files.
+EOD_INDEX_HEADER = "<date>,<close>,<first>,<last>\n"
+
+# The format of the market times in the historical market data.
+MARKET_TIME_FORMAT = "%Y%m%d%H%M"
+
+
+def market_times_to_epoch(market_times):
+    """Converts market time strings in the historical market data format to
+    an array of epoch seconds.
+    """
+
+    if not market_times:
+        return array([], dtype=int64)
+
+    values = array([int(market_time) for market_time in market_times],
+                   dtype=int64)
+    dates = values // 10000
+    hours = values // 100 % 100
+    minutes = values % 100
+    if (hours >= 24).any() or (minutes >= 60).any():
+        raise ValueError("Invalid market time.")
+
+    times = hours * 3600 + minutes * 60
+    for date in set(dates.tolist()):
+        times[dates == date] += get_market_midnight(
+            datetime.strptime(str(date), "%Y%m%d"))
+
+    return times
+
+
+def get_prices_at(bars, timestamps):
+    """Finds the prices of the last quotes at or before a list of market
+    timestamps during the day of minute bars.
+    """
+
+    times = array([market_time_to_epoch(timestamp) for timestamp in
+                   timestamps], dtype=int64)
+    quote_indices = maximum(
+        searchsorted(bars["time"], times, side="right") - 1, 0)
+    return bars["open"][quote_indices].tolist()
+
+
+class History:
+    """A helper for looking up historical market data."""
+
+    def __init__(self, logs_to_cloud):
+        self.logs = Logs(name="history", to_cloud=logs_to_cloud)
+        self.archive = Archive(logs_to_cloud=logs_to_cloud)
+        self.calendar = MarketCalendar()
+        self.aggregates = Aggregates(history=self, logs_to_cloud=logs_to_cloud)
+
+        # The end-of-day indices which have been loaded, by ticker.
+        self.eod_indices = {}
+
+    def get_historical_prices(self, ticker, timestamp):
+        """Finds the last price at or before a timestamp and at EOD."""
+
+        return self.get_historical_prices_bulk([(ticker, timestamp)])[0]
+
+    def get_historical_prices_bulk(self, requests):
+        """Finds the last price at or before a timestamp and at EOD for a list
+        of (ticker, timestamp) pairs. Each day of quotes is loaded only once
+        and all timestamps during that day are looked up together.
+        """
+
+        prices = [None] * len(requests)
+
+        # Resolve whatever the end-of-day index can answer and group the rest
+        # by the day of quotes they need.
+        day_requests = {}
+        for index, (ticker, timestamp) in enumerate(requests):
+            located = self.locate_historical_prices(ticker, timestamp)
+            if not located:
+                continue
+
+            if located["at"] is not None:
+                prices[index] = {"at": located["at"], "eod": located["eod"]}
+                continue
+
+            day_timestamp = located["timestamp"]
+            key = (ticker, day_timestamp.strftime("%Y%m%d"))
+            if key not in day_requests:
+                day_requests[key] = []
+            day_requests[key].append((index, day_timestamp, located["eod"]))
+
+        for (ticker, day), day_entries in day_requests.iteritems():
+            bars = self.get_day_bars(ticker, day_entries[0][1])
+            if not bars or not len(bars["time"]):
+                self.logs.error("No quotes for indexed day: %s %s" %
+                                (ticker, day))
+                continue
+
+            prices_at = get_prices_at(bars, [timestamp for _, timestamp, _
+                                             in day_entries])
+
+            for (index, _, price_eod), price_at in zip(day_entries,
+                                                       prices_at):
+                prices[index] = {"at": price_at, "eod": price_eod}
+
+        self.logs.debug("Found prices for %s of %s requests." % (
+            len([price for price in prices if price]), len(requests)))
+        return prices
+
+    def get_historical_prices_from_bars(self, ticker, timestamp, get_bars):
+        """Finds the last price at or before a timestamp and at EOD like the
+        end-of-day index lookup, but from a lookup of a day's minute bars by
+        ticker and timestamp instead, such as a cache of them.
+        """
+
+        located = self.locate_historical_prices(ticker, timestamp,
+                                                get_bars=get_bars)
+        if not located:
+            return None
+
+        price_at = located["at"]
+        if price_at is None:
+            bars = get_bars(ticker, located["timestamp"])
+            price_at = get_prices_at(bars, [located["timestamp"]])[0]
+
+        return {"at": price_at, "eod": located["eod"]}
+
+    def locate_historical_prices(self, ticker, timestamp, get_bars=None,
+                                 depth=0):
+        """Uses the end-of-day index to find the price at EOD for a timestamp,
+        along with the price at the timestamp unless that falls during the day
+        and needs the day's quotes. The end-of-day summaries can come from a
+        lookup of a day's minute bars instead.
+        """
+
+        if get_bars:
+            def get_eod(ticker, timestamp):
+                return self.summarize_day(get_bars(ticker, timestamp))
+        else:
+            get_eod = self.get_eod
+
+        # Limit the recursion depth to two weeks.
+        if depth >= 14:
+            self.logs.warn("Limiting recursion.")
+            return None
+
+        # Start with today's end-of-day summary.
+        eod = get_eod(ticker, timestamp)
+        if not eod:
+            self.logs.warn("No quotes for day: %s" % timestamp)
+            # Use the end of the previous trading day and retry recursively.
+            timestamp_eod = timestamp.replace(hour=15, minute=59, second=59)
+            previous_day = self.get_previous_day(timestamp_eod)
+            return self.locate_historical_prices(ticker, previous_day,
+                                                 get_bars=get_bars,
+                                                 depth=depth + 1)
+
+        # Depending on where we land relative to the trading day, pick the
+        # right quote and EOD quote.
+        if timestamp < eod["first"]:
+            self.logs.debug("Using previous quote.")
+            previous_day = self.get_previous_day(timestamp)
+            previous_eod = get_eod(ticker, previous_day)
+            if not previous_eod:
+                self.logs.error("No quotes for previous day: %s" %
+                                previous_day)
+                return None
+            price_at = previous_eod["close"]
+            price_eod = eod["close"]
+        elif timestamp <= eod["last"]:
+            self.logs.debug("Using closest quote.")
+            price_at = None
+            price_eod = eod["close"]
+        else:  # timestamp > eod["last"]
+            self.logs.debug("Using last quote.")
+            price_at = eod["close"]
+            next_day = self.get_next_day(timestamp)
+            next_eod = get_eod(ticker, next_day)
+            if not next_eod:
+                self.logs.error("No quotes for next day: %s" % next_day)
+                return None
+            price_eod = next_eod["close"]
+
+        return {"at": price_at, "eod": price_eod, "timestamp": timestamp}
+
+    def get_eod(self, ticker, timestamp):
+        """Looks up the end-of-day summary for the day of the market timestamp.
+        """
+
+        eod_index = self.get_eod_index(ticker)
+        day = timestamp.strftime("%Y%m%d")
+        if day not in eod_index:
+            self.logs.debug("No end-of-day summary for: %s %s" %
+                            (ticker, timestamp))
+            return None
+
+        return eod_index[day]
+
+    def get_eod_index(self, ticker):
+        """Loads the end-of-day index for a ticker, building it first if it's
+        missing or outdated.
+        """
+
+        if ticker in self.eod_indices:
+            return self.eod_indices[ticker]
+
+        days = self.get_days(ticker)
+        eod_index = self.read_eod_index(ticker)
+        if eod_index is None or not self.is_eod_index_current(ticker, days,
+                                                              eod_index):
+            eod_index = self.build_eod_index(ticker, days)
+
+        self.eod_indices[ticker] = eod_index
+        return eod_index
+
+    def get_days(self, ticker):
+        """Lists the days with historical market data for a ticker, either in
+        the archive or on file.
+        """
+
+        return sorted(set(self.archive.get_days(ticker)) |
+                      set(self.get_csv_days(ticker)))
+
+    def get_csv_days(self, ticker):
+        """Lists the days with historical market data on file for a ticker."""
+
+        filenames = glob(MARKET_DATA_FILE % (ticker, "[0-9]" * 8))
+        start = len(ticker) + 1
+        return sorted([path.basename(filename)[start:start + 8]
+                       for filename in filenames])
+
+    def get_data_files(self, ticker):
+        """Lists the files with historical market data for a ticker, in the
+        archive and on file.
+        """
+
+        filenames = [self.get_csv_filename(ticker, day) for day in
+                     self.get_csv_days(ticker)]
+        for filename in [ARCHIVE_DATA_FILE % ticker,
+                         ARCHIVE_INDEX_FILE % ticker]:
+            if path.isfile(filename):
+                filenames.append(filename)
+
+        return filenames
+
+    def get_csv_filename(self, ticker, day):
+        """Creates the filename of a day file of historical market data."""
+
+        return MARKET_DATA_FILE % (ticker, day)
+
+    def is_eod_index_current(self, ticker, days, eod_index):
+        """Checks whether the end-of-day index covers all days with data and
+        is newer than all of it.
+        """
+
+        if set(days) - set(eod_index):
+            return False
+
+        filenames = [self.get_csv_filename(ticker, day) for day in days]
+        filenames.append(ARCHIVE_INDEX_FILE % ticker)
+
+        index_time = path.getmtime(EOD_INDEX_FILE % ticker)
+        for filename in filenames:
+            if path.isfile(filename) and path.getmtime(filename) > index_time:
+                return False
+
+        return True
+
+    def build_eod_index(self, ticker, days):
+        """Summarizes each day of quotes on file for a ticker and writes the
+        end-of-day index.
+        """
+
+        self.logs.debug("Building end-of-day index for: %s" % ticker)
+
+        eod_index = {}
+        for day in days:
+            timestamp = MARKET_TIMEZONE.localize(datetime.strptime(day,
+                                                                   "%Y%m%d"))
+            eod = self.summarize_day(self.get_day_bars(ticker, timestamp))
+            if eod:
+                eod_index[day] = eod
+
+        if eod_index:
+            self.write_eod_index(ticker, eod_index)
+        return eod_index
+
+    def summarize_day(self, bars):
+        """Finds the end-of-day summary for a day of minute bars."""
+
+        if not bars or not len(bars["time"]):
+            return None
+
+        return {"close": bars["open"][-1].item(),
+                "first": epoch_to_market_time(bars["time"][0].item()),
+                "last": epoch_to_market_time(bars["time"][-1].item())}
+
+    def read_eod_index(self, ticker):
+        """Reads the end-of-day index file for a ticker."""
+
+        filename = EOD_INDEX_FILE % ticker
+        if not path.isfile(filename):
+            return None
+
+        index_file = open(filename, "r")
+        try:
+            lines = index_file.readlines()
+            eod_index = {}
+
+            # Skip the header line, then read the days.
+            for line in lines[1:]:
+                columns = line.strip().split(",")
+                try:
+                    eod_index[columns[0]] = {
+                        "close": float(columns[1]),
+                        "first": MARKET_TIMEZONE.localize(datetime.strptime(
+                            columns[2], MARKET_TIME_FORMAT)),
+                        "last": MARKET_TIMEZONE.localize(datetime.strptime(
+                            columns[3], MARKET_TIME_FORMAT))}
+                except (IndexError, ValueError):
+                    self.logs.error("Malformed end-of-day index line: %s" %
+                                    line)
+                    return None
+
+            return eod_index
+        except IOError as exception:
+            self.logs.error("Failed to read end-of-day index: %s" % exception)
+            return None
+        finally:
+            index_file.close()
+
+    def write_eod_index(self, ticker, eod_index):
+        """Writes the end-of-day index file for a ticker."""
+
+        def write_index(index_file):
+            index_file.write(EOD_INDEX_HEADER)
+            for day in sorted(eod_index):
+                eod = eod_index[day]
+                index_file.write("%s,%r,%s,%s\n" % (
+                    day,
+                    eod["close"],
+                    eod["first"].strftime(MARKET_TIME_FORMAT),
+                    eod["last"].strftime(MARKET_TIME_FORMAT)))
+
+        write_file(EOD_INDEX_FILE % ticker, write_index)
+
+    def get_day_quotes(self, ticker, timestamp):
+        """Collects all quotes from the day of the market timestamp."""
+
+        bars = self.get_day_bars(ticker, timestamp)
+        if bars is None:
+            return None
+
+        # The price of each quote is the opening price of its minute bar.
+        return [{"time": epoch_to_market_time(time), "price": price} for
+                time, price in zip(bars["time"].tolist(),
+                                   bars["open"].tolist())]
+
+    def get_day_bars(self, ticker, timestamp):
+        """Reads the minute bars from the day of the market timestamp into
+        arrays of times in epoch seconds and open, high, low and close prices
+        and volumes.
+        """
+
+        # The timestamp is expected in market time.
+        day = timestamp.strftime("%Y%m%d")
+
+        # Prefer the archive and fall back to the day file.
+        bars = self.archive.read_day(ticker, day)
+        if bars is not None:
+            return bars
+
+        return self.read_csv_bars(ticker, day)
+
+    def get_all_bars(self, ticker):
+        """Reads all minute bars of a ticker, from the archive and from the
+        day files which aren't archived yet.
+        """
+
+        bars_list = []
+        index = self.archive.get_index(ticker)
+        if index is not None:
+            bars = self.archive.read_blocks(ticker, index)
+            if bars is None:
+                return None
+            bars_list.append(bars)
+
+        archived_days = set(self.archive.get_days(ticker))
+        for day in self.get_csv_days(ticker):
+            if day in archived_days:
+                continue
+            bars = self.read_csv_bars(ticker, day)
+            if bars is None:
+                return None
+            bars_list.append(bars)
+
+        return sort_bars(concatenate_bars(bars_list))
+
+    def get_aggregate_bars(self, ticker, resolution, start=None, end=None):
+        """Finds the bars for a ticker resampled to a coarser resolution,
+        optionally only those starting between two times in epoch seconds.
+        """
+
+        return self.aggregates.get_bars(ticker, resolution, start, end)
+
+    def read_csv_bars(self, ticker, day):
+        """Reads the minute bars from a day file of historical market data."""
+
+        filename = self.get_csv_filename(ticker, day)
+        if not path.isfile(filename):
+            self.logs.error("Day quotes not on file for: %s %s" %
+                            (ticker, day))
+            return None
+
+        bars_by_ticker = self.read_bars_file(filename)
+        if bars_by_ticker is None:
+            return None
+
+        return bars_by_ticker.get(ticker, empty_bars())
+
+    def read_bars_file(self, filename):
+        """Reads a file of minute bars in the historical market data format
+        and groups them by ticker.
+        """
+
+        quotes_file = open(filename, "r")
+        try:
+            lines = quotes_file.readlines()
+        except IOError as exception:
+            self.logs.error("Failed to read quotes cache file: %s" % exception)
+            return None
+        finally:
+            quotes_file.close()
+
+        # Skip the header line, then read the columns.
+        rows_by_ticker = {}
+        for line in lines[1:]:
+            if not line.strip():
+                continue
+            row = line.strip().split(",")
+            if row[0] not in rows_by_ticker:
+                rows_by_ticker[row[0]] = []
+            rows_by_ticker[row[0]].append(row)
+
+        bars_by_ticker = {}
+        for ticker, rows in rows_by_ticker.iteritems():
+            market_times = [fields[1] for fields in rows]
+            try:
+                times = market_times_to_epoch(market_times)
+            except (IndexError, ValueError):
+                self.logs.error("Failed to decode market times: %s %s" %
+                                (ticker, filename))
+                return None
+
+            try:
+                columns = array([fields[2:7] for fields in rows],
+                                dtype=float64).reshape(len(rows), 5)
+            except ValueError:
+                self.logs.error("Failed to decode prices: %s %s" %
+                                (ticker, filename))
+                return None
+
+            bars_by_ticker[ticker] = {"time": times,
+                                      "open": columns[:, 0],
+                                      "high": columns[:, 1],
+                                      "low": columns[:, 2],
+                                      "close": columns[:, 3],
+                                      "volume": columns[:, 4].astype(int64)}
+
+        return bars_by_ticker
+
+    def ingest(self, ticker, bars):
+        """Adds new minute bars for a ticker to the archive and updates the
+        end-of-day index for the days they affect. Returns those days.
+        """
+
+        # Load the end-of-day index before the archive changes, so that only
+        # the affected days need to be summarized again.
+        eod_index = self.get_eod_index(ticker)
+
+        # Days which are only on file so far move into the archive together
+        # with the new bars, which win over any bars with the same time.
+        archived_days = set(self.archive.get_days(ticker))
+        csv_days = set(self.get_csv_days(ticker))
+        new_days = set(["%d" % day for day in
+                        epoch_to_market_days(bars["time"]).tolist()])
+        bars_list = []
+        for day in sorted((new_days & csv_days) - archived_days):
+            day_bars = self.read_csv_bars(ticker, day)
+            if day_bars is None:
+                self.logs.warn("Skipping unreadable day file: %s %s" %
+                               (ticker, day))
+                continue
+            bars_list.append(day_bars)
+        bars_list.append(bars)
+        days = self.archive.append(ticker, concatenate_bars(bars_list))
+        if days is None:
+            self.logs.error("Failed to ingest bars for: %s" % ticker)
+            return None
+
+        for day in days:
+            timestamp = MARKET_TIMEZONE.localize(datetime.strptime(day,
+                                                                   "%Y%m%d"))
+            eod = self.summarize_day(self.get_day_bars(ticker, timestamp))
+            if eod:
+                eod_index[day] = eod
+            else:
+                eod_index.pop(day, None)
+
+        self.write_eod_index(ticker, eod_index)
+        self.eod_indices[ticker] = eod_index
+
+        # The cached aggregates no longer match the minute bars.
+        self.aggregates.invalidate(ticker)
+        return days
+
+    def get_market_status(self, timestamp):
+        """Infers the market status at a timestamp."""
+
+        return self.calendar.get_market_status(timestamp)
+
+    def get_close_time(self, timestamp):
+        """Finds the closing time as (hour, minute) in market time on the day
+        of a timestamp.
+        """
+
+        return self.calendar.get_close_time(timestamp)
+
+    def is_trading_day(self, timestamp):
+        """Tests whether markets are open on a given day."""
+
+        if not self.calendar.is_trading_day(timestamp):
+            self.logs.debug("Identified weekend or holiday: %s" % timestamp)
+            return False
+
+        return True
+
+    def get_previous_day(self, timestamp):
+        """Finds the previous trading day."""
+
+        day = self.calendar.get_previous_day(timestamp)
+        previous_day = timestamp - timedelta(
+            days=timestamp.toordinal() - day.toordinal())
+
+        self.logs.debug("Previous trading day for %s: %s" %
+                        (timestamp, previous_day))
+        return previous_day
+
+    def get_next_day(self, timestamp):
+        """Finds the next trading day."""
+
+        day = self.calendar.get_next_day(timestamp)
+        next_day = timestamp + timedelta(
+            days=day.toordinal() - timestamp.toordinal())
+
+        self.logs.debug("Next trading day for %s: %s" %
+                        (timestamp, next_day))
+        return next_day
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from pytest import fixture
+
+from archive import select_bars
+from history import epoch_to_market_time
+from history import History
+from history import MARKET_TIMEZONE
+from history import market_time_to_epoch
+from history import market_times_to_epoch
+
+
+@fixture
+def history():
+    return History(logs_to_cloud=False)
+
+
+def as_market_time(year, month, day, hour=0, minute=0, second=0):
+    """Creates a timestamp in market time."""
+
+    market_time = datetime(year, month, day, hour, minute, second)
+    return MARKET_TIMEZONE.localize(market_time)
+
+
+def test_get_historical_prices(history):
+    assert history.get_historical_prices(
+        "F", as_market_time(2017, 1, 24, 19, 46, 57)) == {
+            "at": 12.6, "eod": 12.78}
+    assert history.get_historical_prices(
+        "TRP", as_market_time(2017, 1, 24, 12, 49, 17)) == {
+            "at": 48.93, "eod": 48.87}
+    assert history.get_historical_prices(
+        "BLK", as_market_time(2017, 1, 18, 8, 0, 51)) == {
+            "at": 374.8, "eod": 378.0}
+    assert history.get_historical_prices(
+        "FCAU", as_market_time(2017, 1, 9, 9, 14, 10)) == {
+            "at": 10.55, "eod": 10.57}
+    assert history.get_historical_prices(
+        "GM", as_market_time(2017, 1, 3, 7, 30, 5)) == {
+            "at": 34.84, "eod": 35.15}
+    assert history.get_historical_prices(
+        "BA", as_market_time(2016, 12, 22, 17, 26, 5)) == {
+            "at": 157.46, "eod": 157.92}
+    assert history.get_historical_prices(
+        "M", as_market_time(2015, 11, 12, 16, 5, 28)) == {
+            "at": 40.73, "eod": 40.15}
+    assert history.get_historical_prices(
+        "M", as_market_time(2015, 7, 16, 9, 14, 15)) == {
+            "at": 71.75, "eod": 72.8}
+
+
+def test_get_eod(history):
+    assert history.get_eod("NYT", as_market_time(2017, 2, 6, 11, 32, 0)) == {
+        "close": 14.5,
+        "first": as_market_time(2017, 2, 6, 9, 30, 0),
+        "last": as_market_time(2017, 2, 6, 16, 5, 0)}
+    assert history.get_eod("NYT", as_market_time(2017, 2, 5)) is None
+    assert history.get_eod("$NAP", as_market_time(2017, 2, 6)) is None
+
+
+def test_build_eod_index(history):
+    eod_index = history.build_eod_index("NYT", history.get_days("NYT"))
+    assert sorted(eod_index) == ["20170203", "20170206", "20170207"]
+    assert history.read_eod_index("NYT") == eod_index
+    assert history.is_eod_index_current(
+        "NYT", history.get_days("NYT"), eod_index)
+
+
+def test_get_days(history):
+    assert history.get_days("NYT") == ["20170203", "20170206", "20170207"]
+    assert history.get_days("$NAP") == []
+
+
+def test_get_data_files(history):
+    filenames = history.get_data_files("NYT")
+    assert "market_data/NYT_20170206.txt" in filenames
+    assert "market_data/NYT_eod.csv" not in filenames
+    assert history.get_data_files("$NAP") == []
+
+
+def test_get_day_quotes(history):
+    quotes = history.get_day_quotes(
+        "NYT", as_market_time(2017, 2, 6, 11, 32, 0))
+    assert len(quotes) == 367
+    assert quotes[0] == {
+        "price": 14.25, "time": as_market_time(2017, 2, 6, 9, 30, 0)}
+    assert quotes[-1] == {
+        "price": 14.5, "time": as_market_time(2017, 2, 6, 16, 5, 0)}
+
+
+def test_get_historical_prices_bulk(history):
+    requests = [
+        ("F", as_market_time(2017, 1, 24, 19, 46, 57)),
+        ("GM", as_market_time(2017, 1, 24, 19, 46, 57)),
+        ("F", as_market_time(2017, 1, 18, 7, 34, 9)),
+        ("WMT", as_market_time(2017, 1, 17, 12, 55, 38)),
+        ("FCAU", as_market_time(2017, 1, 9, 9, 16, 34)),
+        ("FCAU", as_market_time(2017, 1, 9, 9, 14, 10)),
+        ("$NAP", as_market_time(2017, 1, 9, 9, 14, 10))]
+    assert history.get_historical_prices_bulk(requests) == [
+        {"at": 12.6, "eod": 12.78},
+        {"at": 37.09, "eod": 38.28},
+        {"at": 12.6, "eod": 12.41},
+        {"at": 68.53, "eod": 68.5},
+        {"at": 10.57, "eod": 10.57},
+        {"at": 10.55, "eod": 10.57},
+        None]
+    assert history.get_historical_prices_bulk([]) == []
+
+
+def test_get_historical_prices_from_bars(history):
+    for ticker, timestamp in [
+            ("F", as_market_time(2017, 1, 24, 19, 46, 57)),
+            ("F", as_market_time(2017, 1, 18, 7, 34, 9)),
+            ("FCAU", as_market_time(2017, 1, 9, 9, 14, 10)),
+            ("GM", as_market_time(2017, 1, 3, 7, 30, 5)),
+            ("NYT", as_market_time(2017, 2, 5, 12, 0, 0)),
+            ("$NAP", as_market_time(2017, 1, 9, 9, 14, 10))]:
+        assert history.get_historical_prices_from_bars(
+            ticker, timestamp, history.get_day_bars) == \
+            history.get_historical_prices(ticker, timestamp)
+
+
+def test_get_day_bars(history):
+    bars = history.get_day_bars("BA", as_market_time(2016, 12, 5))
+    assert len(bars["time"]) == 405
+    assert epoch_to_market_time(bars["time"][0]) == as_market_time(
+        2016, 12, 5, 9, 29)
+    assert bars["open"][1] == 153.23
+    assert bars["high"][1] == 153.29
+    assert bars["low"][1] == 153.0
+    assert bars["close"][1] == 153.29
+    assert bars["volume"][1] == 2960
+    assert history.get_day_bars("BA", as_market_time(2016, 12, 4)) is None
+
+
+def test_market_time_to_epoch():
+    timestamp = as_market_time(2017, 1, 3, 11, 44)
+    assert market_time_to_epoch(timestamp) == 1483461840
+    assert epoch_to_market_time(1483461840) == timestamp
+    assert market_times_to_epoch(["201701031144"]).tolist() == [1483461840]
+    assert market_times_to_epoch(["201707031144"]).tolist() == [1499096640]
+
+
+@fixture
+def ingest_history(tmpdir, monkeypatch):
+    monkeypatch.setattr("history.EOD_INDEX_FILE",
+                        str(tmpdir.join("%s_eod.csv")))
+    monkeypatch.setattr("history.ARCHIVE_INDEX_FILE",
+                        str(tmpdir.join("%s.index")))
+    monkeypatch.setattr("archive.ARCHIVE_DATA_FILE",
+                        str(tmpdir.join("%s.bars")))
+    monkeypatch.setattr("archive.ARCHIVE_INDEX_FILE",
+                        str(tmpdir.join("%s.index")))
+    return History(logs_to_cloud=False)
+
+
+def test_ingest(ingest_history):
+    day_bars = ingest_history.read_csv_bars("TM", "20170105")
+
+    # Update the last bar of a day on file.
+    last_bar = select_bars(day_bars, slice(-1, None))
+    last_bar["open"] = last_bar["open"] + 1.0
+    assert ingest_history.ingest("TM", last_bar) == ["20170105"]
+    bars = ingest_history.get_day_bars("TM", as_market_time(2017, 1, 5))
+    assert bars["time"].tolist() == day_bars["time"].tolist()
+    assert bars["open"][:-1].tolist() == day_bars["open"][:-1].tolist()
+    assert bars["open"][-1] == day_bars["open"][-1] + 1.0
+    assert ingest_history.get_eod("TM", as_market_time(2017, 1, 5))[
+        "close"] == day_bars["open"][-1] + 1.0
+
+    # Add the next day out of order.
+    next_day_bars = select_bars(day_bars, slice(None, None, -1))
+    next_day_bars["time"] = next_day_bars["time"] + 24 * 3600
+    assert ingest_history.ingest("TM", next_day_bars) == ["20170106"]
+    assert ingest_history.get_eod("TM", as_market_time(2017, 1, 6)) == {
+        "close": day_bars["open"][-1],
+        "first": as_market_time(2017, 1, 6, 9, 30),
+        "last": as_market_time(2017, 1, 6, 16, 2)}
+    assert History(logs_to_cloud=False).read_eod_index("TM") == (
+        ingest_history.get_eod_index("TM"))
+
+
+def test_ingest_unreadable_day(ingest_history, monkeypatch):
+    day_bars = ingest_history.read_csv_bars("TM", "20170105")
+
+    # A day file which can't be read is skipped instead of failing the ingest.
+    monkeypatch.setattr(ingest_history, "read_csv_bars",
+                        lambda ticker, day: None)
+    last_bar = select_bars(day_bars, slice(-1, None))
+    assert ingest_history.ingest("TM", last_bar) == ["20170105"]
+    bars = ingest_history.archive.read_day("TM", "20170105")
+    assert bars["time"].tolist() == last_bar["time"].tolist()
@@ -0,0 +1,26 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from sys import argv
+
+from history import History
+
+if __name__ == "__main__":
+    history = History(logs_to_cloud=False)
+
+    # Add the minute bars from each file to the archive, e.g. new day files or
+    # partial updates in the same format:
+    # $ ./ingest.py market_data/F_20170124.txt updates.txt
+    for filename in argv[1:]:
+        bars_by_ticker = history.read_bars_file(filename)
+        if bars_by_ticker is None:
+            print "%s: failed to read" % filename
+            continue
+
+        for ticker, bars in sorted(bars_by_ticker.iteritems()):
+            days = history.ingest(ticker, bars)
+            if days is None:
+                print "%s: failed to ingest %s" % (filename, ticker)
+                continue
+            print "%s: %s bars for %s on %s" % (
+                filename, len(bars["time"]), ticker, ", ".join(days))
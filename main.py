@@ -4,6 +4,9 @@
 from analysis import Analysis
 from logs import Logs
 from trading import Trading
+from twitter import make_worker_pool
+from twitter import ROUTE_ALERT
+from twitter import ROUTE_TRADE
 from twitter import Twitter
 from os import getenv
 from sched import scheduler
@@ -13,18 +16,26 @@ import __builtin__
 # Whether to send all logs to the cloud instead of a local file.
 LOGS_TO_CLOUD = True
 
-def twitter_callback(tweet):
-    """Analyzes Trump tweets, makes stock trades, and sends tweet alerts."""
+def twitter_callback(tweet, route):
+    """Analyzes tweets and, depending on the route of their author, makes
+    stock trades and sends tweet alerts.
+    """
 
     # Initialize these here to create separate httplib2 instances per thread.
     analysis = Analysis(logs_to_cloud=LOGS_TO_CLOUD)
-    trading = Trading(logs_to_cloud=LOGS_TO_CLOUD)
 
     companies = analysis.find_companies(tweet)
     logs.debug("Using companies: %s" % companies)
-    if companies:
+    if not companies:
+        return
+
+    if route == ROUTE_TRADE:
+        trading = Trading(logs_to_cloud=LOGS_TO_CLOUD)
         trading.make_trades(companies)
-        twitter.tweet(companies, tweet)
+
+    # Post the alert in the background, so the trades aren't held up.
+    if route in [ROUTE_TRADE, ROUTE_ALERT]:
+        twitter.queue_tweet(companies, tweet)
 
 
 def close_all_positions():
@@ -44,11 +55,17 @@ if __name__ == "__main__":
     s = scheduler(time, sleep)
     close_all_positions()
 
-    # Restart in a loop if there are any errors so we stay up.
+    # Share the worker threads between sessions, so restarts don't add more.
+    workers = make_worker_pool(logs_to_cloud=LOGS_TO_CLOUD)
+
+    # The stream reconnects by itself after errors, keeping the API clients
+    # and the worker threads.
+    twitter = Twitter(logs_to_cloud=LOGS_TO_CLOUD, workers=workers)
+
+    # Restart in a loop if there are any other errors so we stay up.
     while True:
         logs.info("Starting new session.")
 
-        twitter = Twitter(logs_to_cloud=LOGS_TO_CLOUD)
         try:
             twitter.start_streaming(twitter_callback)
         except BaseException as exception:
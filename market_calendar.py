@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+from calendar import timegm
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from numpy import arange
+from numpy import array
+from numpy import cumsum
+from numpy import in1d
+from numpy import int64
+from numpy import ndarray
+from numpy import searchsorted
+from pytz import timezone
+
+# We're using NYSE and NASDAQ, which are both in the eastern timezone.
+MARKET_TIMEZONE = timezone("US/Eastern")
+
+# The ordinal of the first day of epoch seconds.
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# The range of years covered by the trading calendar by default.
+CALENDAR_START_YEAR = 1990
+CALENDAR_END_YEAR = 2040
+
+# The market hours as (hour, minute) in market time. These are the same for
+# NYSE and NASDAQ and include Questrade's extended hours. (http://help.questrade.com/how-to/frequently-asked-questions-
+# (faqs)/self-directed-trading/learning-trading-basics/when-are-the-stock-markets-open-and-what-are-pre--and-post-market-hours-)
+PRE_MARKET_TIME = (7, 30)
+OPEN_TIME = (9, 30)
+CLOSE_TIME = (16, 0)
+EARLY_CLOSE_TIME = (13, 0)
+AFTER_HOURS_TIME = (17, 30)
+
+# The market status for each session code. Session codes count the session
+# boundaries passed on a trading day modulo four.
+MARKET_STATUSES = array(["closed", "pre", "open", "after"])
+
+# Days where the markets closed for special events, apart from the regular
+# holidays (https://www.nyse.com/markets/hours-calendars).
+SPECIAL_CLOSURES = [
+    date(1994, 4, 27),  # President Nixon's funeral.
+    date(2001, 9, 11),  # September 11 attacks.
+    date(2001, 9, 12),
+    date(2001, 9, 13),
+    date(2001, 9, 14),
+    date(2004, 6, 11),  # President Reagan's funeral.
+    date(2007, 1, 2),  # President Ford's funeral.
+    date(2012, 10, 29),  # Hurricane Sandy.
+    date(2012, 10, 30),
+    date(2018, 12, 5),  # President George H.W. Bush's funeral.
+    date(2025, 1, 9)]  # President Carter's funeral.
+
+
+def market_time_to_epoch(timestamp):
+    """Converts a timezone-aware timestamp to epoch seconds."""
+
+    return timegm(timestamp.utctimetuple())
+
+
+def epoch_to_market_time(seconds):
+    """Converts epoch seconds to a timestamp in market time."""
+
+    return datetime.fromtimestamp(seconds, MARKET_TIMEZONE)
+
+
+def get_market_midnight(day):
+    """Finds the start of a date in market time as epoch seconds."""
+
+    # Market hours never span a daylight saving time change, so use the UTC
+    # offset at noon for the whole day.
+    noon = MARKET_TIMEZONE.localize(datetime(day.year, day.month, day.day, 12))
+    return market_time_to_epoch(noon) - 12 * 3600
+
+
+def epoch_to_market_ordinals(times):
+    """Finds the ordinal of the market day for an array of epoch seconds."""
+
+    # Markets are closed overnight, so a fixed offset of five hours gives the
+    # right day for all market hours regardless of daylight saving time.
+    return (times - 5 * 3600) // (24 * 3600) + EPOCH_ORDINAL
+
+
+def get_nth_weekday(year, month, weekday, n):
+    """Finds the nth weekday (Monday is 0) of a month. Negative n counts from
+    the end of the month.
+    """
+
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 +
+                                 7 * (n - 1))
+    else:
+        if month == 12:
+            last = date(year, 12, 31)
+        else:
+            last = date(year, month + 1, 1) - timedelta(days=1)
+        return last - timedelta(days=(last.weekday() - weekday) % 7 +
+                                7 * (-n - 1))
+
+
+def get_easter(year):
+    """Finds the date of Easter Sunday with the anonymous Gregorian
+    algorithm.
+    """
+
+    a = year % 19
+    b = year // 100
+    c = year % 100
+    d = b // 4
+    e = b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i = c // 4
+    k = c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    n = h + l - 7 * m + 114
+    return date(year, n // 31, n % 31 + 1)
+
+
+def get_observed(holiday):
+    """Moves a holiday on a weekend to the closest weekday."""
+
+    if holiday.weekday() == 5:
+        return holiday - timedelta(days=1)
+    elif holiday.weekday() == 6:
+        return holiday + timedelta(days=1)
+    else:
+        return holiday
+
+
+def get_holidays(year):
+    """Lists the days in a year where NYSE and NASDAQ are closed apart from
+    weekends.
+    """
+
+    holidays = []
+
+    # New Year's Day moves to Monday when it's on a Sunday, but isn't moved
+    # into the previous year when it's on a Saturday.
+    new_years_day = date(year, 1, 1)
+    if new_years_day.weekday() != 5:
+        holidays.append(get_observed(new_years_day))
+
+    # Martin Luther King, Jr. Day has been observed since 1998.
+    if year >= 1998:
+        holidays.append(get_nth_weekday(year, 1, 0, 3))
+
+    # Washington's Birthday.
+    holidays.append(get_nth_weekday(year, 2, 0, 3))
+
+    # Good Friday.
+    holidays.append(get_easter(year) - timedelta(days=2))
+
+    # Memorial Day.
+    holidays.append(get_nth_weekday(year, 5, 0, -1))
+
+    # Juneteenth has been observed since 2022.
+    if year >= 2022:
+        holidays.append(get_observed(date(year, 6, 19)))
+
+    # Independence Day.
+    holidays.append(get_observed(date(year, 7, 4)))
+
+    # Labor Day.
+    holidays.append(get_nth_weekday(year, 9, 0, 1))
+
+    # Thanksgiving Day.
+    holidays.append(get_nth_weekday(year, 11, 3, 4))
+
+    # Christmas Day.
+    holidays.append(get_observed(date(year, 12, 25)))
+
+    holidays.extend([closure for closure in SPECIAL_CLOSURES if
+                     closure.year == year])
+    return holidays
+
+
+def get_early_closes(year):
+    """Lists the days in a year where the markets close early at 1:00 PM."""
+
+    early_closes = []
+
+    # The day before Independence Day, unless that's observed on a Friday or
+    # Monday.
+    if date(year, 7, 4).weekday() in [1, 2, 3, 4]:
+        early_closes.append(date(year, 7, 3))
+
+    # The day after Thanksgiving.
+    early_closes.append(get_nth_weekday(year, 11, 3, 4) + timedelta(days=1))
+
+    # Christmas Eve, unless it's on a weekend or observed as Christmas Day.
+    christmas_eve = date(year, 12, 24)
+    if christmas_eve.weekday() in [0, 1, 2, 3]:
+        early_closes.append(christmas_eve)
+
+    return early_closes
+
+
+class MarketCalendar:
+    """A precomputed calendar of the trading days of NYSE and NASDAQ."""
+
+    def __init__(self, start_year=CALENDAR_START_YEAR,
+                 end_year=CALENDAR_END_YEAR):
+        self.start_ordinal = date(start_year, 1, 1).toordinal()
+        self.end_ordinal = date(end_year, 12, 31).toordinal()
+
+        holidays = []
+        early_closes = []
+        for year in range(start_year, end_year + 1):
+            holidays.extend(get_holidays(year))
+            early_closes.extend(get_early_closes(year))
+
+        # Mark the trading days among all days by their ordinals, where the
+        # first ordinal is a Monday.
+        ordinals = arange(self.start_ordinal, self.end_ordinal + 1)
+        self.trading = ((ordinals - 1) % 7 < 5) & ~in1d(
+            ordinals, [holiday.toordinal() for holiday in holidays])
+
+        # The sorted ordinals of all trading days, and for every day the
+        # position of the last trading day at or before it.
+        self.days = ordinals[self.trading]
+        self.positions = cumsum(self.trading) - 1
+
+        # Whether each trading day closes early.
+        self.early_closes = in1d(self.days, [early_close.toordinal() for
+                                             early_close in early_closes])
+
+        # The session boundaries are computed when they're first needed.
+        self.boundaries = None
+
+    def get_offset(self, day):
+        """Finds the offset of a day into the calendar."""
+
+        offset = day.toordinal() - self.start_ordinal
+        if offset < 0 or day.toordinal() > self.end_ordinal:
+            raise ValueError("Day outside of the trading calendar: %s" % day)
+        return offset
+
+    def get_position(self, day):
+        """Finds the position of a trading day among all trading days."""
+
+        offset = self.get_offset(day)
+        if not self.trading[offset]:
+            raise ValueError("Not a trading day: %s" % day)
+        return self.positions[offset]
+
+    def get_positions(self, ordinals):
+        """Finds the position of the last trading day at or before each of an
+        array of day ordinals, and whether each is a trading day.
+        """
+
+        offsets = ordinals - self.start_ordinal
+        if len(offsets) and (offsets.min() < 0 or
+                             ordinals.max() > self.end_ordinal):
+            raise ValueError("Days outside of the trading calendar.")
+        return self.positions[offsets], self.trading[offsets]
+
+    def get_day(self, position):
+        """Finds the trading day at a position among all trading days."""
+
+        if position < 0 or position >= len(self.days):
+            raise ValueError("Position outside of the trading calendar: %s" %
+                             position)
+        return date.fromordinal(int(self.days[position]))
+
+    def is_trading_day(self, day):
+        """Tests whether markets are open on a given day."""
+
+        return bool(self.trading[self.get_offset(day)])
+
+    def is_early_close(self, day):
+        """Tests whether markets close early on a given day."""
+
+        return (self.is_trading_day(day) and
+                bool(self.early_closes[self.get_position(day)]))
+
+    def get_nth_day(self, day, n):
+        """Finds the trading day n trading days after a day, or before it for
+        negative n. For n = 0 this is the day itself if it's a trading day and
+        the next trading day otherwise.
+        """
+
+        offset = self.get_offset(day)
+        position = self.positions[offset] + n
+        if not self.trading[offset] and n <= 0:
+            position += 1
+        return self.get_day(position)
+
+    def get_previous_day(self, day):
+        """Finds the previous trading day."""
+
+        return self.get_nth_day(day, -1)
+
+    def get_next_day(self, day):
+        """Finds the next trading day."""
+
+        return self.get_nth_day(day, 1)
+
+    def get_trading_days(self, start, end):
+        """Lists the trading days between two days, including both."""
+
+        start_position = searchsorted(self.days, start.toordinal())
+        end_position = searchsorted(self.days, end.toordinal(), side="right")
+        return [date.fromordinal(ordinal) for ordinal in
+                self.days[start_position:end_position].tolist()]
+
+    def count_trading_days(self, start, end):
+        """Counts the trading days between two days, including both."""
+
+        start_offset = self.get_offset(start)
+        end_offset = self.get_offset(end)
+        if end_offset < start_offset:
+            return 0
+        return int(self.positions[end_offset] - self.positions[start_offset] +
+                   self.trading[start_offset])
+
+    def get_close_time(self, day):
+        """Finds the closing time of the regular session on a trading day as
+        (hour, minute) in market time.
+        """
+
+        if self.is_early_close(day):
+            return EARLY_CLOSE_TIME
+        return CLOSE_TIME
+
+    def get_boundaries(self):
+        """Finds the start of the pre-market, regular and after-hours sessions
+        and the end of the after-hours session on each trading day, as a flat
+        sorted array of epoch seconds.
+        """
+
+        if self.boundaries is not None:
+            return self.boundaries
+
+        boundaries = []
+        for ordinal, early_close in zip(self.days.tolist(),
+                                        self.early_closes.tolist()):
+            day = date.fromordinal(ordinal)
+            if early_close:
+                close_time = EARLY_CLOSE_TIME
+            else:
+                close_time = CLOSE_TIME
+
+            midnight = get_market_midnight(day)
+            for hour, minute in [PRE_MARKET_TIME, OPEN_TIME, close_time,
+                                 AFTER_HOURS_TIME]:
+                boundaries.append(midnight + hour * 3600 + minute * 60)
+
+        self.boundaries = array(boundaries, dtype=int64)
+        return self.boundaries
+
+    def get_session_codes(self, times):
+        """Classifies an array of epoch seconds into session codes, which are
+        indices into MARKET_STATUSES.
+        """
+
+        # Each trading day has four boundaries, so the number of boundaries
+        # passed modulo four is the session. Anything outside of the calendar
+        # counts as closed.
+        boundaries = self.get_boundaries()
+        return searchsorted(boundaries, times, side="right") % 4
+
+    def get_market_status(self, timestamp):
+        """Infers the market status at a timezone-aware timestamp, or for each
+        element of an array of epoch seconds.
+        """
+
+        if isinstance(timestamp, ndarray):
+            return MARKET_STATUSES[self.get_session_codes(timestamp)]
+
+        code = self.get_session_codes(market_time_to_epoch(timestamp))
+        return str(MARKET_STATUSES[code])
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+from datetime import datetime
+from numpy import array
+from pytest import fixture
+from pytest import raises
+
+from market_calendar import get_early_closes
+from market_calendar import get_easter
+from market_calendar import get_holidays
+from market_calendar import get_market_midnight
+from market_calendar import MARKET_TIMEZONE
+from market_calendar import market_time_to_epoch
+from market_calendar import MarketCalendar
+
+
+@fixture
+def calendar():
+    return MarketCalendar()
+
+
+def test_get_market_midnight():
+    # The UTC offset changes with daylight saving time.
+    assert get_market_midnight(date(2017, 1, 3)) == market_time_to_epoch(
+        MARKET_TIMEZONE.localize(datetime(2017, 1, 3)))
+    assert get_market_midnight(date(2017, 3, 13)) == market_time_to_epoch(
+        MARKET_TIMEZONE.localize(datetime(2017, 3, 13)))
+    assert get_market_midnight(date(2017, 3, 13)) % (24 * 3600) == 4 * 3600
+
+
+def test_get_holidays():
+    assert sorted(get_holidays(2017)) == [
+        date(2017, 1, 2), date(2017, 1, 16), date(2017, 2, 20),
+        date(2017, 4, 14), date(2017, 5, 29), date(2017, 7, 4),
+        date(2017, 9, 4), date(2017, 11, 23), date(2017, 12, 25)]
+    assert sorted(get_holidays(2018)) == [
+        date(2018, 1, 1), date(2018, 1, 15), date(2018, 2, 19),
+        date(2018, 3, 30), date(2018, 5, 28), date(2018, 7, 4),
+        date(2018, 9, 3), date(2018, 11, 22), date(2018, 12, 5),
+        date(2018, 12, 25)]
+    assert sorted(get_holidays(2022)) == [
+        date(2022, 1, 17), date(2022, 2, 21), date(2022, 4, 15),
+        date(2022, 5, 30), date(2022, 6, 20), date(2022, 7, 4),
+        date(2022, 9, 5), date(2022, 11, 24), date(2022, 12, 26)]
+
+
+def test_get_early_closes():
+    assert get_early_closes(2017) == [date(2017, 7, 3), date(2017, 11, 24)]
+    assert get_early_closes(2018) == [
+        date(2018, 7, 3), date(2018, 11, 23), date(2018, 12, 24)]
+    assert get_early_closes(2020) == [date(2020, 11, 27), date(2020, 12, 24)]
+
+
+def test_get_easter():
+    assert get_easter(2016) == date(2016, 3, 27)
+    assert get_easter(2017) == date(2017, 4, 16)
+    assert get_easter(2019) == date(2019, 4, 21)
+
+
+def test_is_trading_day(calendar):
+    assert not calendar.is_trading_day(date(2017, 1, 22))
+    assert calendar.is_trading_day(date(2017, 1, 23))
+    assert calendar.is_trading_day(date(2017, 1, 27))
+    assert not calendar.is_trading_day(date(2017, 1, 28))
+    assert not calendar.is_trading_day(date(2017, 1, 2))
+    assert not calendar.is_trading_day(date(2017, 4, 14))
+    with raises(ValueError):
+        calendar.is_trading_day(date(1989, 12, 29))
+
+
+def test_is_early_close(calendar):
+    assert calendar.is_early_close(date(2017, 11, 24))
+    assert not calendar.is_early_close(date(2017, 11, 23))
+    assert not calendar.is_early_close(date(2017, 11, 27))
+
+
+def test_get_nth_day(calendar):
+    assert calendar.get_previous_day(date(2017, 1, 3)) == date(2016, 12, 30)
+    assert calendar.get_previous_day(date(2017, 1, 22)) == date(2017, 1, 20)
+    assert calendar.get_next_day(date(2017, 1, 27)) == date(2017, 1, 30)
+    assert calendar.get_next_day(date(2016, 12, 30)) == date(2017, 1, 3)
+    assert calendar.get_nth_day(date(2017, 1, 27), 0) == date(2017, 1, 27)
+    assert calendar.get_nth_day(date(2017, 1, 28), 0) == date(2017, 1, 30)
+    assert calendar.get_nth_day(date(2017, 1, 3), 251) == date(2018, 1, 2)
+    assert calendar.get_nth_day(date(2018, 1, 2), -251) == date(2017, 1, 3)
+    with raises(ValueError):
+        calendar.get_previous_day(date(1990, 1, 2))
+
+
+def test_get_trading_days(calendar):
+    assert calendar.get_trading_days(date(2016, 12, 29), date(2017, 1, 4)) == [
+        date(2016, 12, 29), date(2016, 12, 30), date(2017, 1, 3),
+        date(2017, 1, 4)]
+    assert len(calendar.get_trading_days(date(2017, 1, 1),
+                                         date(2017, 12, 31))) == 251
+    assert calendar.count_trading_days(date(2017, 1, 1),
+                                       date(2017, 12, 31)) == 251
+    assert calendar.count_trading_days(date(2018, 1, 1),
+                                       date(2018, 12, 31)) == 251
+    assert calendar.count_trading_days(date(2017, 1, 3),
+                                       date(2017, 1, 3)) == 1
+    assert calendar.count_trading_days(date(2017, 1, 4),
+                                       date(2017, 1, 3)) == 0
+
+
+def as_market_time(year, month, day, hour, minute=0):
+    return MARKET_TIMEZONE.localize(datetime(year, month, day, hour, minute))
+
+
+def test_get_market_status(calendar):
+    assert calendar.get_market_status(as_market_time(
+        2017, 1, 23, 7, 29)) == "closed"
+    assert calendar.get_market_status(as_market_time(
+        2017, 1, 23, 7, 30)) == "pre"
+    assert calendar.get_market_status(as_market_time(
+        2017, 1, 23, 9, 30)) == "open"
+    assert calendar.get_market_status(as_market_time(
+        2017, 7, 3, 12, 59)) == "open"
+    assert calendar.get_market_status(as_market_time(
+        2017, 7, 3, 13, 0)) == "after"
+    assert calendar.get_market_status(as_market_time(
+        2017, 1, 23, 15, 59)) == "open"
+    assert calendar.get_market_status(as_market_time(
+        2017, 1, 23, 16, 0)) == "after"
+    assert calendar.get_market_status(as_market_time(
+        2017, 1, 23, 17, 30)) == "closed"
+    assert calendar.get_market_status(as_market_time(
+        2017, 1, 22, 12, 0)) == "closed"
+    assert calendar.get_market_status(as_market_time(
+        2017, 4, 14, 12, 0)) == "closed"
+    assert calendar.get_market_status(as_market_time(
+        1989, 12, 29, 12, 0)) == "closed"
+
+
+def test_get_market_status_array(calendar):
+    timestamps = [as_market_time(2017, 3, 10, 8, 0),
+                  as_market_time(2017, 3, 13, 9, 29),
+                  as_market_time(2017, 3, 13, 9, 30),
+                  as_market_time(2017, 11, 6, 16, 59),
+                  as_market_time(2017, 11, 24, 13, 30),
+                  as_market_time(2017, 12, 25, 10, 0)]
+    times = array([market_time_to_epoch(timestamp) for timestamp in
+                   timestamps])
+    statuses = calendar.get_market_status(times)
+    assert statuses.tolist() == [
+        "pre", "pre", "open", "after", "after", "closed"]
+    assert statuses.tolist() == [calendar.get_market_status(timestamp) for
+                                 timestamp in timestamps]
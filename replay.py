@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+from time import time
+import __builtin__
+
+from analysis import Analysis
+from benchmark import CASSETTE_MODE
+from benchmark import format_dollar
+from benchmark import format_ratio
+from broker import PaperBroker
+from history import History
+from simulation import FUND_DOLLARS
+from sweep import get_events
+from trading import Trading
+from twitter import Twitter
+
+# How often in minutes the bot tries to close out all positions, like the
+# scheduler in main.py.
+CLOSE_OUT_INTERVAL = 5
+
+
+def get_close_out_times(history, events):
+    """Lists the times on the days of the events when the bot would try to
+    close out all positions before the close.
+    """
+
+    # Use the first timestamp on each day.
+    day_timestamps = {}
+    for event in events:
+        day = event["timestamp"].date()
+        if day not in day_timestamps:
+            day_timestamps[day] = event["timestamp"]
+
+    close_out_times = []
+    for day in sorted(day_timestamps):
+        timestamp = day_timestamps[day]
+        if not history.is_trading_day(timestamp):
+            continue
+        close_hour, close_minute = history.get_close_time(timestamp)
+        close_time = timestamp.replace(hour=close_hour, minute=close_minute,
+                                       second=0, microsecond=0)
+        for minutes in range(15, 0, -CLOSE_OUT_INTERVAL):
+            close_out_times.append(close_time - timedelta(minutes=minutes))
+
+    return close_out_times
+
+
+def replay_events(events, history, broker, trading):
+    """Replays the events through the trading code against the paper broker,
+    trading at each event and closing out positions before each close.
+    Returns the run statistics.
+    """
+
+    # Run everything in order of the simulated clock.
+    steps = [(event["timestamp"], 0, event) for event in events]
+    steps += [(timestamp, 1, None) for timestamp in get_close_out_times(
+        history, events)]
+    steps.sort(key=lambda step: (step[0], step[1]))
+
+    start = time()
+    for timestamp, _, event in steps:
+        broker.set_time(timestamp)
+        if event:
+            if event["companies"]:
+                trading.make_trades(event["companies"])
+        else:
+            trading.close_out_all_positions()
+
+    # Move the clock a day past the last step, so that the orders placed on
+    # the last day are either filled or expired.
+    if steps:
+        broker.set_time(steps[-1][0] + timedelta(days=1))
+
+    elapsed = time() - start
+    simulated = 0.0
+    if steps:
+        simulated = (steps[-1][0] - steps[0][0]).total_seconds()
+
+    return {"events": len(events),
+            "orders": len(broker.orders),
+            "fills": len([order for order in broker.orders if
+                          order["state"] == "Executed"]),
+            "requests": broker.num_requests,
+            "elapsed": elapsed,
+            "simulated": simulated,
+            "value": broker.cash + broker.get_market_value()}
+
+
+if __name__ == "__main__":
+    # The paper broker hands out its own tokens.
+    __builtin__.QUESTRADE_REFRESH_TOKEN = "paper"
+
+    analysis = Analysis(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+    history = History(logs_to_cloud=False)
+    twitter = Twitter(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+
+    events = get_events(analysis, twitter)
+    broker = PaperBroker(history, events[0]["timestamp"], logs_to_cloud=False)
+    trading = Trading(logs_to_cloud=False, broker=broker)
+    stats = replay_events(events, history, broker, trading)
+
+    # Print out the results as markdown.
+    print "## Replay Report"
+    print
+    print ("This replays %s tweets through the live trading code against a "
+           "paper broker answering from historical minute bars.") % (
+               stats["events"])
+    print
+    print "Statistic | Value"
+    print "----------|------"
+    print "Orders | %s" % stats["orders"]
+    print "Fills | %s" % stats["fills"]
+    print "API requests | %s" % stats["requests"]
+    print "Requests per second | %.0f" % (
+        stats["requests"] / max(stats["elapsed"], 1e-9))
+    print "Speedup over real time | %.0fx" % (
+        stats["simulated"] / max(stats["elapsed"], 1e-9))
+    print "Final value | %s" % format_dollar(stats["value"])
+    print "Return | %s" % format_ratio(stats["value"] / FUND_DOLLARS)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from pytest import fixture
+import __builtin__
+
+from broker import PaperBroker
+from history import History
+from history import MARKET_TIMEZONE
+from replay import get_close_out_times
+from replay import replay_events
+from simulation import FUND_DOLLARS
+from trading import Trading
+
+
+def as_market_time(year, month, day, hour=0, minute=0):
+    """Creates a timestamp in market time."""
+
+    return MARKET_TIMEZONE.localize(datetime(year, month, day, hour, minute))
+
+
+@fixture
+def history():
+    return History(logs_to_cloud=False)
+
+
+def make_company(ticker, sentiment):
+    return {"name": ticker, "exchange": "New York Stock Exchange",
+            "ticker": ticker, "sentiment": sentiment}
+
+
+@fixture
+def events():
+    return [{"timestamp": as_market_time(2017, 1, 24, 12, 49),
+             "companies": [make_company("TRP", 0.5)]},
+            {"timestamp": as_market_time(2017, 1, 24, 19, 46),
+             "companies": [make_company("TRP", 0.5)]}]
+
+
+def test_get_close_out_times(history, events):
+    assert get_close_out_times(history, events) == [
+        as_market_time(2017, 1, 24, 15, 45),
+        as_market_time(2017, 1, 24, 15, 50),
+        as_market_time(2017, 1, 24, 15, 55)]
+
+
+def test_replay_events(history, events, monkeypatch):
+    monkeypatch.setattr(__builtin__, "QUESTRADE_REFRESH_TOKEN", "paper",
+                        raising=False)
+    broker = PaperBroker(history, events[0]["timestamp"], logs_to_cloud=False)
+    trading = Trading(logs_to_cloud=False, broker=broker)
+    stats = replay_events(events, history, broker, trading)
+
+    # Buy after the first tweet, sell before the close and skip the tweet
+    # after hours.
+    assert stats["events"] == 2
+    assert [order["side"] for order in broker.orders] == ["Buy", "Sell"]
+    assert stats["fills"] == 2
+    assert not any(broker.positions.values())
+    assert stats["value"] == broker.cash
+    assert stats["value"] != FUND_DOLLARS
+    assert stats["requests"] > 0
+
+
+def test_replay_last_step(history, monkeypatch):
+    monkeypatch.setattr(__builtin__, "QUESTRADE_REFRESH_TOKEN", "paper",
+                        raising=False)
+    events = [{"timestamp": as_market_time(2017, 1, 24, 15, 52),
+               "companies": [make_company("TRP", 0.5)]}]
+    broker = PaperBroker(history, events[0]["timestamp"], logs_to_cloud=False)
+    trading = Trading(logs_to_cloud=False, broker=broker)
+    stats = replay_events(events, history, broker, trading)
+
+    # The sell from the last close-out is filled too.
+    assert [order["side"] for order in broker.orders] == ["Buy", "Sell"]
+    assert stats["fills"] == 2
+    assert not broker.pending_orders
+    assert not any(broker.positions.values())
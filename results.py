@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+from hashlib import sha1
+from os import makedirs
+from os import path
+from simplejson import dumps
+from simplejson import loads
+
+from cassettes import get_fingerprint
+from files import write_file
+from logs import Logs
+
+# The filename pattern for cached results, by the hash of their inputs.
+RESULT_FILE = "results/%s.json"
+
+# The size of the pieces in which files are read for their checksums.
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
+
+def get_file_checksum(filename):
+    """Calculates the SHA-1 checksum of a file's content."""
+
+    checksum = sha1()
+    checksum_file = open(filename, "rb")
+    try:
+        while True:
+            block = checksum_file.read(CHECKSUM_BLOCK_SIZE)
+            if not block:
+                break
+            checksum.update(block)
+    finally:
+        checksum_file.close()
+    return checksum.hexdigest()
+
+
+class ResultCache:
+    """A cache of computed results, stored under a hash of everything they
+    depend on: their inputs, the source code computing them and the data
+    files they read. Any change to these is a new key, so results never go
+    stale.
+    """
+
+    def __init__(self, logs_to_cloud):
+        self.logs = Logs(name="results", to_cloud=logs_to_cloud)
+
+        # The checksums of the files which have been read, by filename, along
+        # with the modification time and size they were read at.
+        self.checksums = {}
+
+    def get_checksum(self, filename):
+        """Finds the checksum of a file, or None if it doesn't exist. Files
+        are only read again if they were modified.
+        """
+
+        if not path.isfile(filename):
+            return None
+
+        modified = path.getmtime(filename)
+        size = path.getsize(filename)
+        cached = self.checksums.get(filename)
+        if cached and cached[0] == modified and cached[1] == size:
+            return cached[2]
+
+        checksum = get_file_checksum(filename)
+        self.checksums[filename] = (modified, size, checksum)
+        return checksum
+
+    def get_key(self, stage, inputs, filenames):
+        """Creates the key of a result from the name of the stage computing
+        it, its JSON-serializable inputs and the files it depends on.
+        """
+
+        checksums = [[filename, self.get_checksum(filename)] for filename in
+                     sorted(filenames)]
+        return get_fingerprint([stage, inputs, checksums])
+
+    def call(self, stage, inputs, filenames, function):
+        """Returns the cached result for the inputs to a stage or computes it
+        with the function and caches it.
+        """
+
+        key = self.get_key(stage, inputs, filenames)
+        result = self.read_result(key)
+        if result is not None:
+            self.logs.debug("Using cached %s result: %s" % (stage, key))
+            return result["value"]
+
+        value = function()
+        self.write_result(key, value)
+        return value
+
+    def read_result(self, key):
+        """Reads a cached result or returns None if it's missing."""
+
+        filename = RESULT_FILE % key
+        if not path.isfile(filename):
+            return None
+
+        try:
+            result_file = open(filename)
+            try:
+                return loads(result_file.read())
+            finally:
+                result_file.close()
+        except (IOError, ValueError) as exception:
+            self.logs.warn("Failed to read cached result %s: %s" %
+                           (key, exception))
+            return None
+
+    def write_result(self, key, value):
+        """Writes a result to the cache."""
+
+        filename = RESULT_FILE % key
+        directory = path.dirname(filename)
+        if not path.isdir(directory):
+            try:
+                makedirs(directory)
+            except OSError:
+                # Another worker created it first.
+                pass
+
+        write_file(filename, lambda result_file: result_file.write(
+            dumps({"value": value})))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from os import utime
+from pytest import fixture
+
+from results import get_file_checksum
+from results import ResultCache
+
+
+@fixture
+def result_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr("results.RESULT_FILE",
+                        str(tmpdir.join("results", "%s.json")))
+    return ResultCache(logs_to_cloud=False)
+
+
+def test_get_file_checksum(tmpdir):
+    data_file = tmpdir.join("data.txt")
+    data_file.write("abc")
+    assert get_file_checksum(str(data_file)) == \
+        "a9993e364706816aba3e25717850c26c9cd0d89d"
+
+
+def test_get_checksum(result_cache, tmpdir):
+    data_file = tmpdir.join("data.txt")
+    data_file.write("abc")
+    filename = str(data_file)
+    checksum = result_cache.get_checksum(filename)
+    assert result_cache.get_checksum(filename) == checksum
+
+    data_file.write("abcd")
+    utime(filename, (0, 0))
+    assert result_cache.get_checksum(filename) != checksum
+    assert result_cache.get_checksum(str(tmpdir.join("missing.txt"))) is None
+
+
+def test_call(result_cache, tmpdir):
+    data_file = tmpdir.join("data.txt")
+    data_file.write("abc")
+    filenames = [str(data_file)]
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return {"value": value}
+
+    assert result_cache.call("stage", {"text": "a"}, filenames,
+                             lambda: compute(1)) == {"value": 1}
+    assert result_cache.call("stage", {"text": "a"}, filenames,
+                             lambda: compute(2)) == {"value": 1}
+    assert calls == [1]
+
+    # Changing the inputs, the stage or the files computes again.
+    assert result_cache.call("stage", {"text": "b"}, filenames,
+                             lambda: compute(3)) == {"value": 3}
+    assert result_cache.call("other", {"text": "a"}, filenames,
+                             lambda: compute(4)) == {"value": 4}
+    data_file.write("abcd")
+    utime(str(data_file), (0, 0))
+    assert result_cache.call("stage", {"text": "a"}, filenames,
+                             lambda: compute(5)) == {"value": 5}
+    assert calls == [1, 3, 4, 5]
+
+    # Empty results are cached too.
+    assert result_cache.call("stage", {"text": "c"}, [], lambda: []) == []
+    assert result_cache.call("stage", {"text": "c"}, [], lambda: [1]) == []
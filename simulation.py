@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+from numpy import concatenate
+from numpy import cumsum
+from numpy import float64
+from numpy import full
+from numpy import int64
+from numpy import nonzero
+from numpy import where
+from numpy import zeros
+
+from trading import CASH_HOLD
+
+# The initial amount in dollars for the fund simulation.
+FUND_DOLLARS = 100000
+
+# The fee in dollars per trade (http://www.questrade.com/pricing/self-directed-investing/commissions/stocks).
+TRADE_FEE_MIN = 4.95
+TRADE_FEE_MAX = 9.95
+TRADE_FEE_PER_SHARE = 0.01
+
+# The direction of each strategy action, where shorting profits from falling
+# prices.
+ACTION_DIRECTIONS = {"bull": 1, "bear": -1, "hold": 0}
+
+
+def get_fees(quantities, fee_min=TRADE_FEE_MIN, fee_max=TRADE_FEE_MAX,
+             fee_per_share=TRADE_FEE_PER_SHARE):
+    """Calculates the fee for trades of an array of share quantities,
+    accounting for Questrade's fee logic. A fee per share of zero means a
+    flat fee of the minimum.
+    """
+
+    if not fee_per_share:
+        return full(quantities.shape, fee_min, dtype=float64)
+
+    return where(quantities < (fee_min / fee_per_share),
+                 fee_min,
+                 where(quantities > (fee_max / fee_per_share),
+                       fee_max,
+                       quantities * fee_per_share))
+
+
+def make_simulation_inputs(events):
+    """Converts events with strategies into the event by strategy matrices of
+    the fund simulation. Events without as many strategies as the largest one
+    are padded with holds.
+    """
+
+    num_events = len(events)
+    num_strategies = max([len(event["strategies"]) for event in events] +
+                         [0])
+
+    days = zeros(num_events, dtype=int64)
+    directions = zeros((num_events, num_strategies), dtype=int64)
+    prices_at = zeros((num_events, num_strategies), dtype=float64)
+    prices_eod = zeros((num_events, num_strategies), dtype=float64)
+
+    for event_index, event in enumerate(events):
+        days[event_index] = event["timestamp"].toordinal()
+        for strategy_index, strategy in enumerate(event["strategies"]):
+            directions[event_index, strategy_index] = ACTION_DIRECTIONS[
+                strategy["action"]]
+            prices_at[event_index, strategy_index] = strategy["price_at"] or 0
+            prices_eod[event_index, strategy_index] = (
+                strategy["price_eod"] or 0)
+
+    return {"days": days,
+            "directions": directions,
+            "prices_at": prices_at,
+            "prices_eod": prices_eod}
+
+
+def get_trades(days, directions, prices_at, prices_eod):
+    """Determines which strategies of which events are traded. A strategy
+    trades if it's active and has known prices, but we invest the whole value,
+    so only the first event with such strategies on each day trades.
+    """
+
+    candidates = (directions != 0) & (prices_at > 0) & (prices_eod > 0)
+    if not len(days):
+        return candidates
+
+    has_candidates = candidates.any(axis=1)
+
+    # Count the earlier events with candidates on the same day, using the
+    # position where each run of equal days starts.
+    earlier = cumsum(has_candidates) - has_candidates
+    day_starts = concatenate(([0], nonzero(days[1:] != days[:-1])[0] + 1))
+    run_lengths = concatenate((day_starts[1:], [len(days)])) - day_starts
+    earlier_same_day = earlier - earlier[day_starts].repeat(run_lengths)
+
+    trading_events = has_candidates & (earlier_same_day == 0)
+    return candidates & trading_events[:, None]
+
+
+def simulate_fund(days, directions, prices_at, prices_eod,
+                  initial_value=FUND_DOLLARS, cash_hold=CASH_HOLD,
+                  fee_min=TRADE_FEE_MIN, fee_max=TRADE_FEE_MAX,
+                  fee_per_share=TRADE_FEE_PER_SHARE):
+    """Simulates the value of a fund which trades the strategies of events in
+    order, given as event by strategy matrices. Events need to be sorted by
+    time. Returns the trades, share quantities and fees and the value of the
+    fund after each strategy.
+    """
+
+    trades = get_trades(days, directions, prices_at, prices_eod)
+    num_trades = trades.sum(axis=1)
+
+    # The profit per share of each strategy, regardless of the budget.
+    profits_per_share = where(trades, directions * (prices_eod - prices_at),
+                              0.0)
+    safe_prices_at = where(trades, prices_at, 1.0)
+
+    quantities = zeros(directions.shape, dtype=int64)
+    fees = zeros(directions.shape, dtype=float64)
+
+    # Each budget depends on the value after all earlier trades, which leaves
+    # a loop over the events with trades, but at most one per day.
+    event_values = zeros(len(days), dtype=float64)
+    value = float(initial_value)
+    previous_event = 0
+    for event_index in nonzero(num_trades)[0].tolist():
+        event_values[previous_event:event_index] = value
+        event_values[event_index] = value
+        previous_event = event_index + 1
+
+        event_trades = trades[event_index]
+        budget = round(max(0.0, value - cash_hold) /
+                       num_trades[event_index], 2)
+        event_quantities = where(
+            event_trades, budget // safe_prices_at[event_index],
+            0).astype(int64)
+        event_fees = where(event_trades, get_fees(
+            event_quantities, fee_min, fee_max, fee_per_share), 0.0)
+
+        quantities[event_index] = event_quantities
+        fees[event_index] = event_fees
+        value += float((event_quantities * profits_per_share[event_index] -
+                        2 * event_fees).sum())
+    event_values[previous_event:] = value
+
+    # The value after each strategy adds up the trades so far in its event.
+    changes = quantities * profits_per_share - 2 * fees
+    values = event_values[:, None] + cumsum(changes, axis=1)
+
+    return {"trades": trades,
+            "quantities": quantities,
+            "fees": fees,
+            "values": values}
+
+
+def simulate_event(event, value=FUND_DOLLARS, traded_day=None, **kwargs):
+    """Simulates the fund for a single event, given the value before it and
+    the day of the last trade, so that events can be simulated as they come
+    in. Returns the results and the day of the last trade after the event.
+    """
+
+    inputs = make_simulation_inputs([event])
+    if inputs["days"][0] == traded_day:
+        inputs["directions"][:] = 0
+
+    results = simulate_fund(initial_value=value, **dict(inputs, **kwargs))
+    if results["trades"].any():
+        traded_day = inputs["days"][0]
+
+    return results, traded_day
+
+
+def get_final_value(results, initial_value=FUND_DOLLARS):
+    """Finds the value of the fund at the end of a simulation."""
+
+    values = results["values"]
+    if not values.size:
+        return float(initial_value)
+    return float(values[-1, -1])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from numpy import array
+from numpy.random import RandomState
+
+from simulation import FUND_DOLLARS
+from simulation import get_fees
+from simulation import get_final_value
+from simulation import get_trades
+from simulation import make_simulation_inputs
+from simulation import simulate_event
+from simulation import simulate_fund
+from simulation import TRADE_FEE_MAX
+from simulation import TRADE_FEE_MIN
+from trading import CASH_HOLD
+
+
+def simulate_events(events):
+    """Simulates the fund one trade at a time, like the benchmark used to."""
+
+    value = FUND_DOLLARS
+    values = []
+    previous_trade_day = None
+    for event in events:
+        day = event["timestamp"].toordinal()
+        strategies = event["strategies"]
+        trades = [previous_trade_day != day and
+                  strategy["action"] != "hold" and
+                  bool(strategy["price_at"]) and bool(strategy["price_eod"])
+                  for strategy in strategies]
+        if sum(trades):
+            budget = round(max(0.0, value - CASH_HOLD) / sum(trades), 2)
+
+        event_values = []
+        for strategy, trade in zip(strategies, trades):
+            if trade:
+                price_at = strategy["price_at"]
+                price_eod = strategy["price_eod"]
+                quantity = int(budget // price_at)
+                value -= 2 * get_fees(array([quantity]))[0]
+                if strategy["action"] == "bull":
+                    value += quantity * (price_eod - price_at)
+                else:
+                    value += quantity * (price_at - price_eod)
+            event_values.append(value)
+        values.append(event_values)
+
+        if any(trades):
+            previous_trade_day = day
+
+    return values
+
+
+def make_event(day, hour, strategies):
+    return {"timestamp": datetime(2017, 1, day, hour),
+            "strategies": [{"action": action,
+                            "price_at": price_at,
+                            "price_eod": price_eod} for
+                           action, price_at, price_eod in strategies]}
+
+
+def test_get_fees():
+    assert get_fees(array([0, 494, 495, 700, 995, 996, 10000])).tolist() == [
+        TRADE_FEE_MIN, TRADE_FEE_MIN, 4.95, 7.0, 9.95, TRADE_FEE_MAX,
+        TRADE_FEE_MAX]
+
+
+def test_get_trades():
+    events = [make_event(3, 8, [("hold", 10.0, 11.0), ("bull", 10.0, 11.0)]),
+              make_event(3, 9, [("bull", 10.0, 11.0)]),
+              make_event(4, 8, [("bear", None, None)]),
+              make_event(4, 9, [("bear", 10.0, 11.0), ("hold", 1.0, 1.0)]),
+              make_event(5, 9, [])]
+    inputs = make_simulation_inputs(events)
+    assert get_trades(**inputs).tolist() == [
+        [False, True], [False, False], [False, False], [True, False],
+        [False, False]]
+    empty_inputs = make_simulation_inputs([])
+    assert get_trades(**empty_inputs).shape == (0, 0)
+    assert get_final_value(simulate_fund(**empty_inputs)) == FUND_DOLLARS
+
+
+def test_simulate_fund():
+    events = [make_event(3, 8, [("bull", 100.0, 110.0)]),
+              make_event(3, 9, [("bear", 100.0, 90.0)]),
+              make_event(4, 8, [("bear", 50.0, 40.0), ("bull", 20.0, 19.0)])]
+    results = simulate_fund(**make_simulation_inputs(events))
+    assert results["quantities"].tolist() == [[990, 0], [0, 0], [1088, 2722]]
+    assert results["fees"].tolist() == [[9.9, 0.0], [0.0, 0.0],
+                                        [9.95, 9.95]]
+    assert results["values"][0, 0] == FUND_DOLLARS + 9900 - 2 * 9.9
+    assert get_final_value(results) == (
+        FUND_DOLLARS + 9900 - 2 * 9.9 + 10880 - 2722 - 4 * 9.95)
+
+
+def test_simulate_fund_random():
+    random = RandomState(0)
+    actions = ["bull", "bear", "hold"]
+    events = []
+    for day in range(1, 29):
+        for hour in sorted(random.choice(range(24), 3, replace=False)):
+            strategies = []
+            for _ in range(random.randint(0, 4)):
+                price_at = round(random.uniform(1, 500), 2)
+                price_eod = round(price_at * random.uniform(0.9, 1.1), 2)
+                if random.rand() < 0.1:
+                    price_eod = None
+                strategies.append((actions[random.randint(3)], price_at,
+                                   price_eod))
+            events.append(make_event(day, hour, strategies))
+
+    results = simulate_fund(**make_simulation_inputs(events))
+    for event_index, event_values in enumerate(simulate_events(events)):
+        for strategy_index, value in enumerate(event_values):
+            assert abs(results["values"][event_index, strategy_index] -
+                       value) < 1e-6
+
+    # Simulating one event at a time gives the same values.
+    value = FUND_DOLLARS
+    traded_day = None
+    for event_index, event in enumerate(events):
+        event_results, traded_day = simulate_event(event, value, traded_day)
+        assert (event_results["trades"][0] ==
+                results["trades"][event_index, :len(event["strategies"])]).all()
+        if event["strategies"]:
+            assert abs(event_results["values"][0, -1] -
+                       results["values"][event_index,
+                                         len(event["strategies"]) - 1]) < 1e-6
+        value = get_final_value(event_results, value)
+    assert abs(value - get_final_value(results)) < 1e-6
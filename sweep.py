@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from itertools import product
+from multiprocessing import cpu_count
+from multiprocessing import Pool
+from numpy import array
+from numpy import float64
+from numpy import int64
+from numpy import zeros
+from os import getenv
+from pytz import utc
+
+from analysis import Analysis
+from benchmark import CASSETTE_MODE
+from benchmark import format_dollar
+from benchmark import format_ratio
+from benchmark import TWEET_IDS
+from history import epoch_to_market_time
+from history import History
+from history import MARKET_TIMEZONE
+from history import market_time_to_epoch
+from simulation import FUND_DOLLARS
+from simulation import get_final_value
+from simulation import simulate_fund
+from trading import get_direction
+from twitter import Twitter
+
+# The settings to sweep. Every combination is simulated against the same
+# events.
+SWEEP_CASH_HOLDS = [0, 1000, 5000, 20000]
+SWEEP_FEES = [(4.95, 9.95, 0.01),  # Questrade.
+              (4.95, 4.95, 0.0),  # Flat fee.
+              (0.0, 0.0, 0.0)]  # No fees.
+SWEEP_SENTIMENT_THRESHOLDS = [0.0, 0.1, 0.2, 0.3, 0.5]
+SWEEP_ENTRY_DELAYS = [0, 1, 5, 15, 30, 60]  # Minutes after the tweet.
+SWEEP_EXIT_TIMES = [None, (10, 30), (12, 0), (15, 45)]  # None means EOD.
+
+# The number of worker processes simulating configurations.
+SWEEP_WORKERS = int(getenv("SWEEP_WORKERS", cpu_count()))
+
+# The inputs shared by all simulations. Workers inherit them when the pool
+# forks, so they aren't copied per configuration.
+sweep_inputs = None
+
+
+def get_events(analysis, twitter):
+    """Looks up the tweets and finds the companies in each."""
+
+    events = []
+    for tweet in twitter.get_tweets(TWEET_IDS):
+        timestamp = utc.localize(datetime.strptime(
+            tweet["created_at"], "%a %b %d %H:%M:%S +0000 %Y")).astimezone(
+                MARKET_TIMEZONE)
+        events.append({"timestamp": timestamp,
+                       "companies": analysis.find_companies(tweet)})
+
+    return sorted(events, key=lambda event: event["timestamp"])
+
+
+def make_sweep_inputs(events, history):
+    """Converts the events into event by company matrices of directions for
+    every entry delay and sentiment threshold and of the entry and exit prices
+    for every entry delay and exit time.
+    """
+
+    num_events = len(events)
+    num_companies = max([len(event["companies"]) for event in events] + [0])
+
+    times = array([market_time_to_epoch(event["timestamp"]) for event in
+                   events], dtype=int64)
+    days = array([event["timestamp"].toordinal() for event in events],
+                 dtype=int64)
+
+    # Choose the directions like the trading code, with the market status at
+    # entry.
+    directions = {}
+    for entry_delay in SWEEP_ENTRY_DELAYS:
+        entry_statuses = history.get_market_status(times + entry_delay * 60)
+        for threshold in SWEEP_SENTIMENT_THRESHOLDS:
+            entry_directions = zeros((num_events, num_companies), dtype=int64)
+            for event_index, event in enumerate(events):
+                for company_index, company in enumerate(event["companies"]):
+                    direction, _ = get_direction(
+                        company, entry_statuses[event_index], threshold)
+                    entry_directions[event_index, company_index] = direction
+            directions[(entry_delay, threshold)] = entry_directions
+
+    prices = {}
+    for entry_delay, exit_time in product(SWEEP_ENTRY_DELAYS,
+                                          SWEEP_EXIT_TIMES):
+        prices[(entry_delay, exit_time)] = get_sweep_prices(
+            events, times, history, entry_delay, exit_time, num_companies)
+
+    return {"days": days,
+            "directions": directions,
+            "prices": prices}
+
+
+def get_sweep_prices(events, times, history, entry_delay, exit_time,
+                     num_companies):
+    """Looks up the entry and exit prices of every company for an entry delay
+    and an exit time. Missing prices are zero.
+    """
+
+    entry_requests = []
+    exit_requests = []
+    indices = []
+    for event_index, event in enumerate(events):
+        entry_time = times[event_index] + entry_delay * 60
+        entry_timestamp = epoch_to_market_time(entry_time)
+        if exit_time:
+            exit_timestamp = MARKET_TIMEZONE.localize(datetime(
+                entry_timestamp.year, entry_timestamp.month,
+                entry_timestamp.day, exit_time[0], exit_time[1]))
+
+            # Can't exit before entering.
+            if market_time_to_epoch(exit_timestamp) <= entry_time:
+                continue
+
+        for company_index, company in enumerate(event["companies"]):
+            entry_requests.append((company["ticker"], entry_timestamp))
+            if exit_time:
+                exit_requests.append((company["ticker"], exit_timestamp))
+            indices.append((event_index, company_index))
+
+    prices_at = zeros((len(events), num_companies), dtype=float64)
+    prices_exit = zeros((len(events), num_companies), dtype=float64)
+    entry_prices = history.get_historical_prices_bulk(entry_requests)
+    if exit_time:
+        exit_prices = history.get_historical_prices_bulk(exit_requests)
+    else:
+        exit_prices = entry_prices
+
+    for index, entry_price, exit_price in zip(indices, entry_prices,
+                                              exit_prices):
+        if not entry_price or not exit_price:
+            continue
+        prices_at[index] = entry_price["at"] or 0
+        if exit_time:
+            prices_exit[index] = exit_price["at"] or 0
+        else:
+            prices_exit[index] = exit_price["eod"] or 0
+
+    return prices_at, prices_exit
+
+
+def get_configurations():
+    """Lists every combination of the settings to sweep."""
+
+    return [{"cash_hold": cash_hold,
+             "fees": fees,
+             "sentiment_threshold": sentiment_threshold,
+             "entry_delay": entry_delay,
+             "exit_time": exit_time} for
+            cash_hold, fees, sentiment_threshold, entry_delay, exit_time in
+            product(SWEEP_CASH_HOLDS, SWEEP_FEES, SWEEP_SENTIMENT_THRESHOLDS,
+                    SWEEP_ENTRY_DELAYS, SWEEP_EXIT_TIMES)]
+
+
+def simulate_configuration(configuration, inputs=None):
+    """Simulates the fund for one configuration and returns its final value
+    and number of trades.
+    """
+
+    if inputs is None:
+        inputs = sweep_inputs
+
+    directions = inputs["directions"][(configuration["entry_delay"],
+                                       configuration["sentiment_threshold"])]
+
+    prices_at, prices_exit = inputs["prices"][(configuration["entry_delay"],
+                                               configuration["exit_time"])]
+    fee_min, fee_max, fee_per_share = configuration["fees"]
+    results = simulate_fund(inputs["days"], directions, prices_at,
+                            prices_exit,
+                            cash_hold=configuration["cash_hold"],
+                            fee_min=fee_min, fee_max=fee_max,
+                            fee_per_share=fee_per_share)
+
+    return {"configuration": configuration,
+            "value": get_final_value(results),
+            "trades": int(results["trades"].sum())}
+
+
+def format_exit_time(exit_time):
+    """Converts an exit time into a readable string."""
+
+    if not exit_time:
+        return "EOD"
+    return "%d:%02d" % exit_time
+
+
+def format_fees(fees):
+    """Converts a fee schedule into a readable string."""
+
+    fee_min, fee_max, fee_per_share = fees
+    if not fee_per_share:
+        return format_dollar(fee_min)
+    return "%s/share (%s-%s)" % (format_dollar(fee_per_share),
+                                 format_dollar(fee_min),
+                                 format_dollar(fee_max))
+
+
+if __name__ == "__main__":
+    analysis = Analysis(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+    history = History(logs_to_cloud=False)
+    twitter = Twitter(logs_to_cloud=False, cassette_mode=CASSETTE_MODE)
+
+    # Analyze the tweets and look up the prices once for all configurations.
+    events = get_events(analysis, twitter)
+    sweep_inputs = make_sweep_inputs(events, history)
+
+    configurations = get_configurations()
+    pool = Pool(SWEEP_WORKERS)
+    try:
+        results = pool.map(simulate_configuration, configurations,
+                           chunksize=max(1, len(configurations) //
+                                         (4 * SWEEP_WORKERS)))
+    finally:
+        pool.close()
+        pool.join()
+
+    # Print out the results ranked by return as markdown.
+    results = sorted(results, key=lambda result: result["value"],
+                     reverse=True)
+    print "## Sweep Report"
+    print
+    print ("This ranks %s configurations of the fund simulation by their return"
+           " on an initial investment of %s.") % (
+               len(results), format_dollar(FUND_DOLLARS))
+    print
+    print ("Rank | Cash hold | Fees | Sentiment threshold | Entry delay | Exit "
+           "| Trades | Value | Return")
+    print ("-----|-----------|------|---------------------|-------------|-----"
+           "-|--------|-------|-------")
+    for rank, result in enumerate(results):
+        configuration = result["configuration"]
+        print "%s | %s | %s | %s | %s min | %s | %s | %s | %s" % (
+            rank + 1,
+            format_dollar(configuration["cash_hold"]),
+            format_fees(configuration["fees"]),
+            configuration["sentiment_threshold"],
+            configuration["entry_delay"],
+            format_exit_time(configuration["exit_time"]),
+            result["trades"],
+            format_dollar(result["value"]),
+            format_ratio(result["value"] / FUND_DOLLARS))
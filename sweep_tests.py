@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from pytest import fixture
+
+from history import History
+from history import MARKET_TIMEZONE
+from simulation import FUND_DOLLARS
+from sweep import get_configurations
+from sweep import make_sweep_inputs
+from sweep import simulate_configuration
+
+
+@fixture
+def history():
+    return History(logs_to_cloud=False)
+
+
+def as_market_time(year, month, day, hour=0, minute=0):
+    """Creates a timestamp in market time."""
+
+    return MARKET_TIMEZONE.localize(datetime(year, month, day, hour, minute))
+
+
+def make_company(ticker, sentiment):
+    return {"ticker": ticker, "sentiment": sentiment}
+
+
+@fixture
+def events():
+    return [{"timestamp": as_market_time(2017, 1, 3, 11, 44),
+             "companies": [make_company("F", 0.2)]},
+            {"timestamp": as_market_time(2017, 1, 17, 12, 55),
+             "companies": [make_company("GM", 0.1),
+                           make_company("WMT", 0.4)]},
+            {"timestamp": as_market_time(2017, 1, 24, 19, 46),
+             "companies": [make_company("F", 0.5)]}]
+
+
+def test_make_sweep_inputs(events, history, monkeypatch):
+    monkeypatch.setattr("sweep.SWEEP_ENTRY_DELAYS", [0, 15])
+    monkeypatch.setattr("sweep.SWEEP_EXIT_TIMES", [None, (12, 0)])
+    inputs = make_sweep_inputs(events, history)
+
+    # The tweet after hours can't be traded.
+    assert inputs["directions"][(0, 0.0)].tolist() == [
+        [1, 0], [1, 1], [0, 0]]
+
+    # Sentiments within the threshold are neutral.
+    assert inputs["directions"][(0, 0.3)].tolist() == [
+        [0, 0], [0, 1], [0, 0]]
+
+    prices_at, prices_exit = inputs["prices"][(0, None)]
+    price = history.get_historical_prices("WMT", events[1]["timestamp"])
+    assert prices_at[1, 1] == price["at"]
+    assert prices_exit[1, 1] == price["eod"]
+
+    prices_at, prices_exit = inputs["prices"][(15, (12, 0))]
+    assert prices_at[0, 0] == history.get_historical_prices(
+        "F", as_market_time(2017, 1, 3, 11, 59))["at"]
+    assert prices_exit[0, 0] == history.get_historical_prices(
+        "F", as_market_time(2017, 1, 3, 12, 0))["at"]
+
+    # Exiting at noon is before the entry after noon.
+    assert prices_exit[1].tolist() == [0, 0]
+
+
+def test_simulate_configuration(events, history, monkeypatch):
+    monkeypatch.setattr("sweep.SWEEP_ENTRY_DELAYS", [0])
+    monkeypatch.setattr("sweep.SWEEP_EXIT_TIMES", [None])
+    monkeypatch.setattr("sweep.SWEEP_CASH_HOLDS", [1000])
+    monkeypatch.setattr("sweep.SWEEP_FEES", [(0.0, 0.0, 0.0)])
+    monkeypatch.setattr("sweep.SWEEP_SENTIMENT_THRESHOLDS", [0.0, 0.3])
+    inputs = make_sweep_inputs(events, history)
+    configurations = get_configurations()
+    assert len(configurations) == 2
+
+    all_results = simulate_configuration(configurations[0], inputs)
+    threshold_results = simulate_configuration(configurations[1], inputs)
+    assert all_results["trades"] == 3
+    assert threshold_results["trades"] == 1
+    assert all_results["value"] != FUND_DOLLARS
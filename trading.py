@@ -6,12 +6,14 @@ from dateutil import parser
 from simplejson import loads
 from oauth2 import Client
 from os import getenv
-from os import path
-from pytz import timezone
 from pytz import utc
 import json
 import __builtin__
 
+from cassettes import Cassette
+from cassettes import CassetteHttp
+from history import History
+from history import MARKET_TIMEZONE
 from logs import Logs
 
 # Base URL for retrieving oAuth tokens.
@@ -29,30 +31,60 @@ CASH_HOLD = 1000
 # Blacklisted stock ticker symbols, e.g. to avoid insider trading.
 TICKER_BLACKLIST = []
 
-# We're using NYSE and NASDAQ, which are both in the eastern timezone.
-MARKET_TIMEZONE = timezone("US/Eastern")
+# The actions of the strategies by direction.
+DIRECTION_ACTIONS = {1: "bull", -1: "bear", 0: "hold"}
 
-# TODO: Use a comprehensive list.
-# A list of days where the markets are closed apart from weekends.
-TRADING_HOLIDAYS = [MARKET_TIMEZONE.localize(date) for date in [
-    datetime(2017, 1, 2)]]
 
-# The filename pattern for historical market data.
-MARKET_DATA_FILE = "market_data/%s_%s.txt"
+def get_direction(company, market_status, threshold=0.0):
+    """Determines the direction for trading a company based on sentiment and
+    market status: 1 for bull, -1 for bear and 0 for hold, along with the
+    reason. Sentiments within the threshold of zero count as neutral.
+    """
+
+    # Don't do anything with blacklisted stocks.
+    if company["ticker"] in TICKER_BLACKLIST:
+        return 0, "blacklist"
+
+    # TODO: Figure out some strategy for the markets closed case.
+    # Don't trade unless the markets are open or are about to open.
+    if market_status != "open" and market_status != "pre":
+        return 0, "market closed"
+
+    # Can't trade without sentiment.
+    sentiment = company["sentiment"]
+    if abs(sentiment) <= threshold:
+        return 0, "neutral sentiment"
+
+    # Determine bull or bear based on sentiment direction.
+    if sentiment > 0:
+        return 1, "positive sentiment"
+    else:  # sentiment < 0
+        return -1, "negative sentiment"
 
 
 class Trading:
     """A helper for making stock trades."""
 
-    def __init__(self, logs_to_cloud):
+    def __init__(self, logs_to_cloud, cassette_mode=None, broker=None):
         self.logs = Logs(name="trading", to_cloud=logs_to_cloud)
+        self.history = History(logs_to_cloud=logs_to_cloud)
+
+        # Optionally send all API requests to a paper broker instead.
+        self.broker = broker
+
+        # Optionally record and replay the API responses.
+        if cassette_mode:
+            self.cassette = Cassette(name="questrade", mode=cassette_mode,
+                                     logs_to_cloud=logs_to_cloud)
+        else:
+            self.cassette = None
 
         # Get initial API keys from Questrade
         url = QUESTRADE_AUTH_API_URL % __builtin__.QUESTRADE_REFRESH_TOKEN
         method = "GET"
         body = ""
         headers = None
-        client = Client(None, None)
+        client = self.make_client()
 
         self.logs.debug("Questrade request: %s %s %s %s" % (url, method, body, headers))
         response, content = client.request(url, method=method, body=body, headers=headers)
@@ -62,7 +94,7 @@ class Trading:
             response = loads(content)
             self.access_token = response['access_token']
             self.api_server = response['api_server']
-            self.expires_in = datetime.now() + datetime.timedelta(0, response['expires_in'])
+            self.expires_in = datetime.now() + timedelta(0, response['expires_in'])
             __builtin__.QUESTRADE_REFRESH_TOKEN = response['refresh_token']
             self.token_type = response['token_type']
 
@@ -75,7 +107,7 @@ class Trading:
         method = "GET"
         body = ""
         headers = None
-        client = Client(None, None)
+        client = self.make_client()
 
         self.logs.debug("Questrade request: %s %s %s %s" % (url, method, body, headers))
         response, content = client.request(url, method=method, body=body, headers=headers)
@@ -85,7 +117,7 @@ class Trading:
             response = loads(content)
             self.access_token = response['access_token']
             self.api_server = response['api_server']
-            self.expires_in = datetime.now() + datetime.timedelta(0, response['expires_in'])
+            self.expires_in = datetime.now() + timedelta(0, response['expires_in'])
             __builtin__.QUESTRADE_REFRESH_TOKEN = response['refresh_token']
             self.token_type = response['token_type']
 
@@ -152,7 +184,6 @@ class Trading:
         """
 
         ticker = company["ticker"]
-        sentiment = company["sentiment"]
 
         strategy = {}
         strategy["name"] = company["name"]
@@ -162,34 +193,10 @@ class Trading:
         strategy["ticker"] = ticker
         strategy["exchange"] = company["exchange"]
 
-        # Don't do anything with blacklisted stocks.
-        if ticker in TICKER_BLACKLIST:
-            strategy["action"] = "hold"
-            strategy["reason"] = "blacklist"
-            return strategy
-
-        # TODO: Figure out some strategy for the markets closed case.
-        # Don't trade unless the markets are open or are about to open.
-        if market_status != "open" and market_status != "pre":
-            strategy["action"] = "hold"
-            strategy["reason"] = "market closed"
-            return strategy
-
-        # Can't trade without sentiment.
-        if sentiment == 0:
-            strategy["action"] = "hold"
-            strategy["reason"] = "neutral sentiment"
-            return strategy
-
-        # Determine bull or bear based on sentiment direction.
-        if sentiment > 0:
-            strategy["action"] = "bull"
-            strategy["reason"] = "positive sentiment"
-            return strategy
-        else:  # sentiment < 0
-            strategy["action"] = "bear"
-            strategy["reason"] = "negative sentiment"
-            return strategy
+        direction, reason = get_direction(company, market_status)
+        strategy["action"] = DIRECTION_ACTIONS[direction]
+        strategy["reason"] = reason
+        return strategy
 
     def get_budget(self, balance, num_strategies):
         """Calculates the budget per company based on the available balance."""
@@ -212,178 +219,42 @@ class Trading:
         clock_response = response["time"]
         timestamp = parser.parse(clock_response)
 
-        if not self.is_trading_day(timestamp):
-            return "closed"
-
-        # Calculate the market hours for the given day. These are the same for NYSE
-        # and NASDAQ and include Questrade's extended hours. (http://help.questrade.com/how-to/frequently-asked-questions-
-        # (faqs)/self-directed-trading/learning-trading-basics/when-are-the-stock-markets-open-and-what-are-pre--and-post-market-hours-)
-        pre_time = timestamp.replace(hour=7, minute=30)
-        open_time = timestamp.replace(hour=9, minute=30)
-        close_time = timestamp.replace(hour=16)
-        after_time = timestamp.replace(hour=17, minute=30)
-
-        # Return the market status for each bucket.
-        if timestamp >= pre_time and timestamp < open_time:
-            current = "pre"
-        elif timestamp >= open_time and timestamp < close_time:
-            current = "open"
-        elif timestamp >= close_time and timestamp < after_time:
-            current = "after"
-        else:
-            current = "closed"
+        current = self.history.get_market_status(timestamp)
 
         self.logs.debug("Current market status: %s" % current)
         return current
 
-    def get_historical_prices(self, ticker, timestamp, depth=0):
+    def get_historical_prices(self, ticker, timestamp):
         """Finds the last price at or before a timestamp and at EOD."""
 
-        # Limit the recursion depth to two weeks.
-        if depth >= 14:
-            self.logs.warn("Limiting recursion.")
-            return None
+        return self.history.get_historical_prices(ticker, timestamp)
+
+    def get_historical_prices_bulk(self, requests):
+        """Finds the last price at or before a timestamp and at EOD for a list
+        of (ticker, timestamp) pairs.
+        """
 
-        # Start with today's quotes.
-        quotes = self.get_day_quotes(ticker, timestamp)
-        if not quotes:
-            self.logs.warn("No quotes for day: %s" % timestamp)
-            # Use the end of the previous trading day and retry recursively.
-            timestamp_eod = timestamp.replace(hour=15, minute=59, second=59)
-            previous_day = self.get_previous_day(timestamp_eod)
-            return self.get_historical_prices(ticker, previous_day,
-                                              depth=depth + 1)
-
-        # Depending on where we land relative to the trading day, pick the
-        # right quote and EOD quote.
-        first_quote = quotes[0]
-        first_quote_time = first_quote["time"]
-        last_quote = quotes[-1]
-        last_quote_time = last_quote["time"]
-        if timestamp < first_quote_time:
-            self.logs.debug("Using previous quote.")
-            previous_day = self.get_previous_day(timestamp)
-            previous_quotes = self.get_day_quotes(ticker, previous_day)
-            if not previous_quotes:
-                self.logs.error("No quotes for previous day: %s" %
-                                previous_day)
-                return None
-            quote_at = previous_quotes[-1]
-            quote_eod = last_quote
-        elif timestamp >= first_quote_time and timestamp <= last_quote_time:
-            self.logs.debug("Using closest quote.")
-            # Walk through the quotes unitl we stepped over the timestamp.
-            previous_quote = first_quote
-            for quote in quotes:
-                quote_time = quote["time"]
-                if quote_time > timestamp:
-                    break
-                previous_quote = quote
-            quote_at = previous_quote
-            quote_eod = last_quote
-        else:  # timestamp > last_quote_time
-            self.logs.debug("Using last quote.")
-            quote_at = last_quote
-            next_day = self.get_next_day(timestamp)
-            next_quotes = self.get_day_quotes(ticker, next_day)
-            if not next_quotes:
-                self.logs.error("No quotes for next day: %s" % next_day)
-                return None
-            quote_eod = next_quotes[-1]
-
-        self.logs.debug("Using quotes: %s %s" % (quote_at, quote_eod))
-        return {"at": quote_at["price"], "eod": quote_eod["price"]}
+        return self.history.get_historical_prices_bulk(requests)
 
     def get_day_quotes(self, ticker, timestamp):
         """Collects all quotes from the day of the market timestamp."""
 
-        # The timestamp is expected in market time.
-        day = timestamp.strftime("%Y%m%d")
-        filename = MARKET_DATA_FILE % (ticker, day)
-
-        if not path.isfile(filename):
-            self.logs.error("Day quotes not on file for: %s %s" %
-                            (ticker, timestamp))
-            return None
-
-        quotes_file = open(filename, "r")
-        try:
-            lines = quotes_file.readlines()
-            quotes = []
-
-            # Skip the header line, then read the quotes.
-            for line in lines[1:]:
-                columns = line.split(",")
-
-                market_time_str = columns[1]
-                try:
-                    market_time = MARKET_TIMEZONE.localize(datetime.strptime(
-                        market_time_str, "%Y%m%d%H%M"))
-                except ValueError:
-                    self.logs.error("Failed to decode market time: %s" %
-                                    market_time_str)
-                    return None
-
-                price_str = columns[2]
-                try:
-                    price = float(price_str)
-                except ValueError:
-                    self.logs.error("Failed to decode price: %s" % price_str)
-                    return None
-
-                quote = {"time": market_time, "price": price}
-                quotes.append(quote)
-
-            return quotes
-        except IOError as exception:
-            self.logs.error("Failed to read quotes cache file: %s" % exception)
-            return None
-        finally:
-            quotes_file.close()
+        return self.history.get_day_quotes(ticker, timestamp)
 
     def is_trading_day(self, timestamp):
         """Tests whether markets are open on a given day."""
 
-        day = timestamp.replace(hour=0, minute=0, second=0)
-
-        # Markets are closed on holidays.
-        if day in TRADING_HOLIDAYS:
-            self.logs.debug("Identified holiday: %s" % timestamp)
-            return False
-
-        # Markets are closed on weekends.
-        if day.weekday() in [5, 6]:
-            self.logs.debug("Identified weekend: %s" % timestamp)
-            return False
-
-        # Otherwise markets are open.
-        return True
+        return self.history.is_trading_day(timestamp)
 
     def get_previous_day(self, timestamp):
         """Finds the previous trading day."""
 
-        previous_day = timestamp - timedelta(days=1)
-
-        # Walk backwards until we hit a trading day.
-        while not self.is_trading_day(previous_day):
-            previous_day -= timedelta(days=1)
-
-        self.logs.debug("Previous trading day for %s: %s" %
-                        (timestamp, previous_day))
-        return previous_day
+        return self.history.get_previous_day(timestamp)
 
     def get_next_day(self, timestamp):
         """Finds the next trading day."""
 
-        next_day = timestamp + timedelta(days=1)
-
-        # Walk forward until we hit a trading day.
-        while not self.is_trading_day(next_day):
-            next_day += timedelta(days=1)
-
-        self.logs.debug("Next trading day for %s: %s" %
-                        (timestamp, next_day))
-        return next_day
+        return self.history.get_next_day(timestamp)
 
     def utc_to_market_time(self, timestamp):
         """Converts a UTC timestamp to local market time."""
@@ -407,10 +278,21 @@ class Trading:
         market_time = datetime(year, month, day, hour, minute, second)
         return MARKET_TIMEZONE.localize(market_time)
 
+    def make_client(self):
+        """Creates a client for requests to the Questrade API."""
+
+        if self.broker:
+            return self.broker
+
+        if self.cassette:
+            return CassetteHttp(self.cassette, lambda: Client(None, None))
+
+        return Client(None, None)
+
     def make_request(self, url, method="GET", body="", headers=None):
         """Makes a request to the Questrade API."""
 
-        client = Client(None, None)
+        client = self.make_client()
         if headers is None:
             headers = {'Authorization': ("%s %s" % (self.token_type, self.access_token))}
 
@@ -521,7 +403,7 @@ class Trading:
             return None
 
         details = details_response['symbols'][0]
-        if ("marketCap" not in details_response) or ("averageVol3Months" not in details_response):
+        if ("marketCap" not in details) or ("averageVol3Months" not in details):
             self.logs.error("Malformed detailed quotes response for %s: %s" %
                             (ticker, details_response))
             return None
@@ -555,7 +437,9 @@ class Trading:
         """Gets the Questrade URL for placing orders."""
 
         url_path = "v1/accounts/%s/orders" % QUESTRADE_ACCOUNT_NUMBER
-        if not USE_REAL_MONEY:
+
+        # Orders with the paper broker never use real money.
+        if not USE_REAL_MONEY and not self.broker:
             url_path += "/impact"
         return self.api_server % url_path
 
@@ -604,13 +488,13 @@ class Trading:
         """
 
         # Calculate the quantity.
-        quantity = -1 * self.get_quantity(ticker, budget)
+        quantity = self.get_quantity(ticker, budget)
         if not quantity:
             self.logs.warn("Not trading without quantity.")
             return False
 
         # Short the stock now.
-        if not self.make_order_request(ticker, quantity):
+        if not self.make_order_request(ticker, -1 * quantity):
             return False
 
         return True
@@ -648,7 +532,7 @@ class Trading:
 
         # Check if the response is in the expected format.
         order_response = response["orders"]
-        if not order_response or "id" not in order_response:
+        if not order_response or "id" not in order_response[0]:
             self.logs.error("Malformed order response: %s" % order_response)
             return False
 
@@ -689,8 +573,10 @@ class Trading:
         if not self.is_trading_day(timestamp):
             return None
 
-        sell_time = timestamp.replace(hour=15, minute=45)
-        close_time = timestamp.replace(hour=16)
+        # Use the early close time on days where markets close early.
+        close_hour, close_minute = self.history.get_close_time(timestamp)
+        close_time = timestamp.replace(hour=close_hour, minute=close_minute)
+        sell_time = close_time - timedelta(minutes=15)
 
         # Short circuit if the market doesn't close within 15 minutes
         if timestamp < sell_time or timestamp > close_time:
@@ -1,16 +1,23 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
 from os import getenv
+from re import compile
 from simplejson import loads
-from Queue import Queue
 from threading import Event
-from threading import Thread
+from threading import Lock
+from time import sleep
+from time import time
 from tweepy import API
 from tweepy import OAuthHandler
+from tweepy import RateLimitError
 from tweepy import Stream
+from tweepy import TweepError
 from tweepy.streaming import StreamListener
 
+from cassettes import Cassette
 from logs import Logs
+from workers import WorkerPool
 
 # The keys for the Twitter account we're using for API requests and tweeting
 # alerts (@Trump2Cash). Read from environment variables.
@@ -25,43 +32,327 @@ TWITTER_CONSUMER_SECRET = getenv("TWITTER_CONSUMER_SECRET")
 # The user ID of @realDonaldTrump.
 TRUMP_USER_ID = "25073877"
 
+# The routes for the tweets of followed accounts: analyze them only, analyze
+# them and tweet an alert, or also trade on them.
+ROUTE_ANALYSIS = "analysis"
+ROUTE_ALERT = "alert"
+ROUTE_TRADE = "trade"
+ROUTES = [ROUTE_ANALYSIS, ROUTE_ALERT, ROUTE_TRADE]
+
+# The accounts to follow by default, by user ID, with their routes.
+DEFAULT_FOLLOWS = {TRUMP_USER_ID: ROUTE_TRADE}
+
+# An optional file listing the accounts to follow instead, with a user ID and
+# route per line. Read from an environment variable.
+TWITTER_FOLLOW_LIST = getenv("TWITTER_FOLLOW_LIST")
+
 # The URL pattern for links to tweets.
 TWEET_URL = "https://twitter.com/%s/status/%s"
 
+# A pattern for the strings in raw JSON.
+JSON_STRING_PATTERN = compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+
+# A pattern for the user objects in the raw JSON of a tweet. Quotes inside
+# JSON strings are escaped, so each match without a backslash before it is a
+# key.
+USER_OBJECT_PATTERN = compile(r'"user"\s*:\s*\{')
+
+# A pattern for the tokens in raw JSON which matter for finding the ID in a
+# user object: strings, with a colon if they are keys, and brackets.
+JSON_TOKEN_PATTERN = compile(r'("[^"\\]*(?:\\.[^"\\]*)*")(\s*:)?|[{}\[\]]')
+
+# A pattern for the control messages in the stream, which aren't tweets.
+CONTROL_MESSAGE_PATTERN = compile(
+    r'\s*\{\s*"(delete|scrub_geo|limit|status_withheld|user_withheld|'
+    r'disconnect|warning)"')
+
+# The control messages which need attention.
+CONTROL_MESSAGE_WARNINGS = ["disconnect", "warning"]
+
+# How much longer to wait before each reconnect after network errors, and
+# for how long at most, in seconds. This follows Twitter's guidelines:
+# https://dev.twitter.com/streaming/overview/connecting
+NETWORK_BACKOFF_STEP = 0.25
+NETWORK_BACKOFF_CAP = 16
+
+# How long to wait before reconnecting after HTTP errors, doubled with each
+# retry up to a maximum, in seconds.
+HTTP_BACKOFF_START = 5
+HTTP_BACKOFF_CAP = 320
+
+# How long to wait before reconnecting after being rate limited, in seconds.
+RATE_LIMIT_STATUS = 420
+RATE_LIMIT_BACKOFF_START = 60
+
+# How long the stream may stay silent before it's considered stalled and
+# reconnected, in seconds. Twitter sends keep-alives every 30 seconds.
+STREAM_STALL_TIMEOUT = 90
+
+# How long tweet IDs are remembered to discard duplicates, in seconds, and how
+# many of them at most.
+SEEN_TWEETS_WINDOW = 24 * 60 * 60
+SEEN_TWEETS_SIZE = 10000
+
+# The minimum time between alert tweets, in seconds. Twitter allows 300 tweets
+# per three hours.
+ALERT_INTERVAL = 36
+
+# How often to retry posting an alert which failed, and how long to wait
+# before the first retry, doubled with each retry, in seconds.
+ALERT_RETRIES = 5
+ALERT_RETRY_DELAY = 60
+
+# How long to wait before posting again after being rate limited, in seconds.
+ALERT_RATE_LIMIT_DELAY = 15 * 60
+
+# The Twitter API error codes for being over the tweet limits.
+ALERT_RATE_LIMIT_CODES = [88, 185]
+
+# The Twitter API error codes for alerts which would fail again, like
+# duplicates.
+ALERT_FATAL_CODES = [186, 187]
+
 # Some emoji.
 EMOJI_THUMBS_UP = u"\U0001f44d"
 EMOJI_THUMBS_DOWN = u"\U0001f44e"
 EMOJI_SHRUG = u"¯\_(\u30c4)_/¯"
 
-# The number of worker threads processing tweets.
-NUM_THREADS = 100
+
+def handle_listener_data(logs, task):
+    """Hands the data from a task on the shared queue to the listener which
+    received it.
+    """
+
+    listener, data = task
+    listener.handle_data(logs, data)
+
+
+def get_reconnect_delay(error, delay):
+    """Finds how long to wait before reconnecting to the stream after an
+    error, which is either an HTTP status code or an exception, given the
+    previous delay or zero.
+    """
+
+    # Back off exponentially from HTTP errors, and more so when rate limited.
+    if isinstance(error, int):
+        if error == RATE_LIMIT_STATUS:
+            start = RATE_LIMIT_BACKOFF_START
+        else:
+            start = HTTP_BACKOFF_START
+        return min(max(start, delay * 2), HTTP_BACKOFF_CAP)
+
+    # Back off linearly from network errors.
+    return min(delay + NETWORK_BACKOFF_STEP, NETWORK_BACKOFF_CAP)
+
+
+def get_author_id(data):
+    """Finds the ID of the author of a tweet in its raw JSON, which is the
+    "id_str" of the top-level "user" object, without decoding it. Returns None
+    if there is no such ID.
+    """
+
+    for user in USER_OBJECT_PATTERN.finditer(data):
+        if data[user.start() - 1:user.start()] == "\\":
+            continue
+
+        # Only the user object of the tweet itself is the author, not those
+        # of retweeted or quoted tweets. Find its depth by counting the
+        # brackets outside of strings before it.
+        prefix = JSON_STRING_PATTERN.sub("", data[:user.start()])
+        if (prefix.count("{") + prefix.count("[") - prefix.count("}") -
+                prefix.count("]")) != 1:
+            continue
+
+        # Look for the ID among the keys of the user object, skipping any
+        # nested objects.
+        depth = 0
+        key = None
+        for token in JSON_TOKEN_PATTERN.finditer(data, user.end() - 1):
+            string, colon = token.groups()
+            if string is None:
+                if token.group(0) in "{[":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if not depth:
+                        return None
+                key = None
+            elif colon:
+                key = string
+            else:
+                if depth == 1 and key == '"id_str"':
+                    return string[1:-1]
+                key = None
+
+        return None
+
+    return None
+
+
+def make_worker_pool(logs_to_cloud):
+    """Creates a pool of worker threads for handling streaming data, which can
+    be shared by the listeners of consecutive streams.
+    """
+
+    return WorkerPool(handler=handle_listener_data, name="twitter-listener",
+                      logs_to_cloud=logs_to_cloud)
 
 
 class Twitter:
     """A helper for talking to Twitter APIs."""
 
-    def __init__(self, logs_to_cloud):
+    def __init__(self, logs_to_cloud, cassette_mode=None, workers=None,
+                 stall_timeout=STREAM_STALL_TIMEOUT, follows=None):
         self.logs_to_cloud = logs_to_cloud
         self.logs = Logs(name="twitter", to_cloud=self.logs_to_cloud)
+
+        # The accounts to stream, by user ID, with their routes. The same
+        # dictionary is shared with the listener. Streaming without any
+        # accounts would only reconnect in a loop, so that's an error.
+        if follows is not None:
+            self.follows = follows
+        elif TWITTER_FOLLOW_LIST:
+            self.follows = self.read_follow_list(TWITTER_FOLLOW_LIST)
+        else:
+            self.follows = dict(DEFAULT_FOLLOWS)
+        if not self.follows:
+            self.logs.error("No accounts to follow.")
+            raise ValueError("No accounts to follow.")
+
+        # An optional worker pool shared with other streams, which outlives
+        # this one.
+        self.workers = workers
+        self.twitter_listener = None
+        self.twitter_stream = None
+
+        # The tweets which were already handled, across reconnects.
+        self.seen_tweets = SeenTweets()
+
+        # The worker thread posting alerts, started with the first one.
+        self.alerts = None
+        self.alerts_lock = Lock()
+        self.next_alert_time = 0
+
+        # The stalled connections which were detected, and how long after
+        # the last activity it took in total.
+        self.stall_timeout = stall_timeout
+        self.num_stalls = 0
+        self.total_stall_detect_time = 0.0
+        self.last_stall_detect_time = None
+
+        # Optionally record and replay the API responses.
+        if cassette_mode:
+            self.cassette = Cassette(name="twitter", mode=cassette_mode,
+                                     logs_to_cloud=self.logs_to_cloud)
+        else:
+            self.cassette = None
+
         self.twitter_auth = OAuthHandler(TWITTER_CONSUMER_KEY,
                                          TWITTER_CONSUMER_SECRET)
         self.twitter_auth.set_access_token(TWITTER_ACCESS_TOKEN,
                                            TWITTER_ACCESS_TOKEN_SECRET)
         self.twitter_api = API(self.twitter_auth)
 
+    def read_follow_list(self, filename):
+        """Reads the accounts to follow from a file with a user ID and a route
+        per line. Blank lines and lines starting with "#" are skipped, as are
+        any more columns, like the screen name.
+        """
+
+        follows = {}
+        follow_file = open(filename)
+        try:
+            for line in follow_file:
+                columns = line.split()
+                if not columns or columns[0].startswith("#"):
+                    continue
+
+                if len(columns) < 2 or not columns[0].isdigit() or (
+                        columns[1] not in ROUTES):
+                    self.logs.error("Bad line in follow list: %s" % line)
+                    continue
+
+                follows[columns[0]] = columns[1]
+        finally:
+            follow_file.close()
+
+        self.logs.debug("Following %s accounts." % len(follows))
+        return follows
+
     def start_streaming(self, callback):
-        """Starts streaming tweets and returning data to the callback."""
+        """Starts streaming tweets and returning data and routes to the
+        callback until the stream is stopped. After errors, only the
+        connection is re-established while the listener and its workers keep
+        running.
+        """
 
         self.twitter_listener = TwitterListener(
-            callback=callback, logs_to_cloud=self.logs_to_cloud)
-        twitter_stream = Stream(self.twitter_auth, self.twitter_listener)
+            callback=callback, logs_to_cloud=self.logs_to_cloud,
+            workers=self.workers, seen_tweets=self.seen_tweets,
+            follows=self.follows)
+
+        delay = 0
+        while not self.twitter_listener.is_stopped():
+            self.logs.debug("Starting stream.")
+            self.twitter_listener.connected = False
+            self.twitter_listener.error_status = None
+
+            # The read timeout is the watchdog, which breaks the connection
+            # if neither data nor keep-alives arrive in time.
+            self.twitter_stream = Stream(self.twitter_auth,
+                                         self.twitter_listener,
+                                         timeout=self.stall_timeout)
+            try:
+                self.twitter_stream.filter(follow=self.follows.keys())
+                error = self.twitter_listener.get_error_status()
+            except Exception as exception:
+                error = exception
+
+            if self.twitter_listener.is_stopped():
+                break
+
+            self.check_stall()
 
-        self.logs.debug("Starting stream.")
-        twitter_stream.filter(follow=[TRUMP_USER_ID])
+            # Start backing off again once a connection succeeded.
+            if self.twitter_listener.connected:
+                delay = 0
+            delay = get_reconnect_delay(error, delay)
 
-        # If we got here because of an API error, raise it.
-        if self.twitter_listener.get_error_status():
-            raise Exception(self.twitter_listener.get_error_status())
+            self.logs.warn("Reconnecting stream in %s seconds after: %s" %
+                           (delay, error))
+            self.twitter_listener.wait(delay)
+
+    def check_stall(self):
+        """Checks whether the last connection ended because it was silent for
+        too long and updates the stall metrics.
+        """
+
+        if not self.twitter_listener.connected:
+            return
+
+        detect_time = time() - self.twitter_listener.last_activity
+        if detect_time < self.stall_timeout:
+            return
+
+        self.num_stalls += 1
+        self.total_stall_detect_time += detect_time
+        self.last_stall_detect_time = detect_time
+        self.logs.warn("Stream stalled and was detected after %.1f seconds." %
+                       detect_time)
+
+    def get_stall_metrics(self):
+        """Returns the number of stalled connections and how long it took to
+        detect them after the last activity.
+        """
+
+        if self.num_stalls:
+            mean_detect_time = self.total_stall_detect_time / self.num_stalls
+        else:
+            mean_detect_time = None
+
+        return {"stalls": self.num_stalls,
+                "last_time_to_detect": self.last_stall_detect_time,
+                "mean_time_to_detect": mean_detect_time}
 
     def stop_streaming(self):
         """Stops the current stream."""
@@ -72,6 +363,8 @@ class Twitter:
 
         self.logs.debug("Stopping stream.")
         self.twitter_listener.stop_queue()
+        if self.twitter_stream:
+            self.twitter_stream.disconnect()
 
     def tweet(self, companies, tweet):
         """Posts a tweet listing the companies, their ticker symbols, and a
@@ -84,6 +377,61 @@ class Twitter:
         self.logs.info("Tweeting: %s" % text)
         self.twitter_api.update_status(text)
 
+    def queue_tweet(self, companies, tweet):
+        """Queues a tweet listing the companies, their ticker symbols, and a
+        quote of the original tweet, to be posted in the background.
+        """
+
+        link = self.get_tweet_link(tweet)
+        text = self.make_tweet_text(companies, link)
+
+        # A single worker posts the alerts in order and paced for the rate
+        # limits.
+        with self.alerts_lock:
+            if not self.alerts:
+                self.alerts = WorkerPool(handler=self.post_alert,
+                                         name="twitter-alerts",
+                                         logs_to_cloud=self.logs_to_cloud,
+                                         min_workers=1, max_workers=1)
+
+        self.logs.debug("Queueing tweet: %s" % text)
+        self.alerts.put(text)
+
+    def post_alert(self, logs, text):
+        """Posts the text of an alert, pacing it after the previous one and
+        retrying after errors.
+        """
+
+        delay = ALERT_RETRY_DELAY
+        for _ in range(ALERT_RETRIES + 1):
+            wait = self.next_alert_time - time()
+            if wait > 0:
+                sleep(wait)
+
+            try:
+                logs.info("Tweeting: %s" % text)
+                self.twitter_api.update_status(text)
+                self.next_alert_time = time() + ALERT_INTERVAL
+                return
+            except TweepError as error:
+                if error.api_code in ALERT_FATAL_CODES:
+                    logs.error("Failed to tweet: %s" % error)
+                    self.next_alert_time = time() + ALERT_INTERVAL
+                    return
+
+                # Back off before the retry and any alerts queued after it.
+                if (isinstance(error, RateLimitError) or
+                        error.api_code in ALERT_RATE_LIMIT_CODES):
+                    wait = ALERT_RATE_LIMIT_DELAY
+                else:
+                    wait = delay
+                    delay *= 2
+                self.next_alert_time = time() + wait
+                logs.warn("Retrying tweet in %s seconds after: %s" %
+                          (wait, error))
+
+        logs.error("Giving up on tweet: %s" % text)
+
     def make_tweet_text(self, companies, link):
         """Generates the text for a tweet."""
 
@@ -117,6 +465,15 @@ class Twitter:
     def get_tweets(self, ids):
         """Looks up metadata for a list of tweets."""
 
+        if self.cassette:
+            return self.cassette.call(["statuses_lookup", ids],
+                                      lambda: self.lookup_statuses(ids))
+
+        return self.lookup_statuses(ids)
+
+    def lookup_statuses(self, ids):
+        """Looks up the raw JSON of a list of tweets."""
+
         statuses = self.twitter_api.statuses_lookup(ids)
         self.logs.debug("Got statuses response: %s" % statuses)
 
@@ -138,69 +495,104 @@ class Twitter:
         return link
 
 
+class SeenTweets:
+    """A bounded set of the IDs of recently seen tweets, which forgets IDs
+    once they're too old or too many. It's safe to share between threads.
+    """
+
+    def __init__(self, window=SEEN_TWEETS_WINDOW, size=SEEN_TWEETS_SIZE):
+        self.window = window
+        self.size = size
+        self.ids = OrderedDict()
+        self.lock = Lock()
+
+    def add(self, id_str):
+        """Adds a tweet ID and returns whether it's new."""
+
+        now = time()
+        with self.lock:
+            # Forget the oldest IDs first, which are at the front.
+            while self.ids:
+                oldest = next(self.ids.itervalues())
+                if now - oldest < self.window and len(self.ids) < self.size:
+                    break
+                self.ids.popitem(last=False)
+
+            if id_str in self.ids:
+                return False
+
+            self.ids[id_str] = now
+            return True
+
+
 class TwitterListener(StreamListener):
     """A listener class for handling streaming Twitter data."""
 
-    def __init__(self, callback, logs_to_cloud):
+    def __init__(self, callback, logs_to_cloud, workers=None,
+                 seen_tweets=None, follows=None):
         self.logs_to_cloud = logs_to_cloud
         self.logs = Logs(name="twitter-listener", to_cloud=self.logs_to_cloud)
         self.callback = callback
+        self.seen_tweets = seen_tweets or SeenTweets()
+        if follows is not None:
+            self.follows = follows
+        else:
+            self.follows = dict(DEFAULT_FOLLOWS)
         self.error_status = None
-        self.start_queue()
+        self.connected = False
+        self.last_activity = None
+        self.stop_event = Event()
+        self.start_queue(workers)
 
-    def start_queue(self):
-        """Creates a queue and starts the worker threads."""
+    def start_queue(self, workers):
+        """Uses the shared pool of worker threads, if there is one, or creates
+        one which grows and shrinks with the work.
+        """
 
-        self.queue = Queue()
-        self.stop_event = Event()
-        self.logs.debug("Starting %s worker threads." % NUM_THREADS)
-        self.workers = []
-        for worker_id in range(NUM_THREADS):
-            worker = Thread(target=self.process_queue, args=[worker_id])
-            worker.daemon = True
-            worker.start()
-            self.workers.append(worker)
+        self.owns_workers = not workers
+        if self.owns_workers:
+            self.workers = make_worker_pool(self.logs_to_cloud)
+        else:
+            self.workers = workers
 
     def stop_queue(self):
-        """Shuts down the worker threads."""
-
-        if not self.workers:
-            self.logs.warn("No worker threads to stop.")
-            return
+        """Stops queueing data and shuts down the worker threads unless they
+        are shared.
+        """
 
         self.stop_event.set()
-        for worker in self.workers:
-            # Terminate the thread immediately.
-            worker.join(0)
-
-    def process_queue(self, worker_id):
-        """Continuously processes tasks on the queue."""
-
-        # Create a new logs instance (with its own httplib2 instance) so that
-        # there is a separate one for each thread.
-        logs = Logs("twitter-listener-worker-%s" % worker_id,
-                    to_cloud=self.logs_to_cloud)
-
-        logs.debug("Started worker thread: %s" % worker_id)
-        while not self.stop_event.is_set():
-            # The main loop doesn't catch and report exceptions from background
-            # threads, so do that here.
-            try:
-                size = self.queue.qsize()
-                logs.debug("Processing queue of size: %s" % size)
-                data = self.queue.get(block=True)
-                self.handle_data(logs, data)
-                self.queue.task_done()
-            except BaseException as exception:
-                logs.catch(exception)
-        logs.debug("Stopped worker thread: %s" % worker_id)
+        if self.owns_workers:
+            self.workers.stop()
+
+    def is_stopped(self):
+        """Checks whether the listener was stopped."""
+
+        return self.stop_event.is_set()
+
+    def wait(self, timeout):
+        """Waits for the timeout or until the listener is stopped."""
+
+        self.stop_event.wait(timeout)
+
+    def on_connect(self):
+        """Notes that the stream connected."""
+
+        self.connected = True
+        self.error_status = None
+        self.last_activity = time()
+
+    def keep_alive(self):
+        """Notes that a keep-alive arrived."""
+
+        self.last_activity = time()
 
     def on_error(self, status):
-        """Handles any API errors."""
+        """Handles any API errors by ending the connection, which is retried
+        with a backoff.
+        """
 
         self.logs.error("Twitter error: %s" % status)
         self.error_status = status
-        self.stop_queue()
         return False
 
     def get_error_status(self):
@@ -210,12 +602,39 @@ class TwitterListener(StreamListener):
     def on_data(self, data):
         """Puts a task to process the new data on the queue."""
 
+        self.last_activity = time()
+
         # Stop streaming if requested.
-        if self.stop_event.is_set():
+        if self.stop_event.is_set() or self.workers.is_stopped():
             return False
 
+        # Drop anything which can't be a tweet by the user we follow before
+        # it takes up a worker.
+        if not self.is_relevant(data):
+            return True
+
         # Put the task on the queue and keep streaming.
-        self.queue.put(data)
+        self.workers.put((self, data))
+        return True
+
+    def is_relevant(self, data):
+        """Checks the raw data from the stream for a tweet which may be by a
+        user we follow, without decoding the JSON. Control messages and tweets
+        by other users, including their retweets and quotes of the users we
+        follow, are irrelevant, while anything unrecognized is left for the
+        full check.
+        """
+
+        control_message = CONTROL_MESSAGE_PATTERN.match(data)
+        if control_message:
+            if control_message.group(1) in CONTROL_MESSAGE_WARNINGS:
+                self.logs.warn("Stream control message: %s" % data)
+            return False
+
+        author_id = get_author_id(data)
+        if author_id is not None and author_id not in self.follows:
+            return False
+
         return True
 
     def handle_data(self, logs, data):
@@ -231,21 +650,29 @@ class TwitterListener(StreamListener):
             return
 
         # Do a basic check on the response format we expect.
-        if ("user" not in tweet or "id_str" not in tweet["user"] or
+        if ("id_str" not in tweet or "user" not in tweet or
+            "id_str" not in tweet["user"] or
             "screen_name" not in tweet["user"]):
             logs.error("Malformed tweet: %s" % tweet)
             return
 
-        # We're only interested in tweets from Mr. Trump himself, so skip the
-        # rest.
+        # We're only interested in tweets from the users we follow
+        # themselves, so skip the rest.
         user_id_str = tweet["user"]["id_str"]
         screen_name = tweet["user"]["screen_name"]
-        if user_id_str != TRUMP_USER_ID:
+        route = self.follows.get(user_id_str)
+        if not route:
             logs.debug("Skipping tweet from user: %s (%s)" %
                        (screen_name, user_id_str))
             return
 
-        logs.info("Examining tweet: %s" % tweet)
+        # Skip tweets which were delivered more than once, like after a
+        # reconnect.
+        if not self.seen_tweets.add(tweet["id_str"]):
+            logs.debug("Skipping duplicate tweet: %s" % tweet["id_str"])
+            return
+
+        logs.info("Examining tweet with route %s: %s" % (route, tweet))
 
         # Call the callback.
-        self.callback(tweet)
+        self.callback(tweet, route)
@@ -2,10 +2,25 @@
 
 from datetime import datetime
 from pytest import fixture
+from pytest import raises
 from threading import Timer
 from time import sleep
+from tweepy import RateLimitError
+from tweepy import TweepError
 
+from twitter import ALERT_INTERVAL
+from twitter import ALERT_RATE_LIMIT_DELAY
+from twitter import ALERT_RETRY_DELAY
+from twitter import get_author_id
+from twitter import get_reconnect_delay
+from twitter import make_worker_pool
+from twitter import ROUTE_ALERT
+from twitter import ROUTE_ANALYSIS
+from twitter import ROUTE_TRADE
+from twitter import SeenTweets
+from twitter import TRUMP_USER_ID
 from twitter import Twitter
+from twitter import TwitterListener
 from twitter import TWITTER_CONSUMER_KEY
 from twitter import TWITTER_CONSUMER_SECRET
 from twitter import TWITTER_ACCESS_TOKEN
@@ -17,6 +32,13 @@ def twitter():
     return Twitter(logs_to_cloud=False)
 
 
+@fixture
+def listener():
+    listener = TwitterListener(callback=callback, logs_to_cloud=False)
+    yield listener
+    listener.stop_queue()
+
+
 def test_environment_variables():
     assert TWITTER_CONSUMER_KEY
     assert TWITTER_CONSUMER_SECRET
@@ -24,9 +46,10 @@ def test_environment_variables():
     assert TWITTER_ACCESS_TOKEN_SECRET
 
 
-def callback(tweet):
+def callback(tweet, route):
     # TODO: Test whether the callback was called.
     assert tweet
+    assert route
 
 
 def test_streaming(twitter):
@@ -102,3 +125,347 @@ def test_get_tweet_link(twitter):
     tweet = twitter.get_tweets(["828574430800539648"])[0]
     assert twitter.get_tweet_link(tweet) == (
         "https://twitter.com/realDonaldTrump/status/828574430800539648")
+
+
+def test_get_author_id():
+    assert get_author_id(
+        '{"id_str":"1","text":"{\\"user\\":{\\"id_str\\":\\"2\\"}}",'
+        '"user":{"entities":{"url":{"urls":[]}},"id_str":"25073877"}}') == \
+        "25073877"
+    assert get_author_id(
+        '{"retweeted_status":{"user":{"id_str":"25073877"}},'
+        '"user": {"id": 1234, "id_str": "1234"}}') == "1234"
+    assert get_author_id('{"user":{"id":1234},"id_str":"1"}') is None
+    assert get_author_id('{"user":null,"id_str":"1"}') is None
+    assert get_author_id('{"say \\"user": {"id_str":"1"}}') is None
+    assert get_author_id('not json') is None
+
+
+def test_is_relevant(listener):
+    # Tweets by the user we follow.
+    assert listener.is_relevant(
+        '{"id_str":"1","text":"Hi","user":{"id":25073877,'
+        '"id_str":"25073877","screen_name":"realDonaldTrump"}}')
+
+    # Tweets by other users.
+    assert not listener.is_relevant(
+        '{"id_str":"3","user":{"id_str":"1234","screen_name":"someone"}}')
+    assert not listener.is_relevant(
+        '{"user":{"id":1,"entities":{},"id_str":"1"}}')
+
+    # Retweets and quotes of the user we follow by other users.
+    assert not listener.is_relevant(
+        '{"id_str":"2","user": {"id_str": "1234"},"retweeted_status":'
+        '{"user": {"id_str": "25073877"}}}')
+    assert not listener.is_relevant(
+        '{"id_str":"2","retweeted_status":{"user":{"id_str":"25073877"}},'
+        '"user":{"id_str":"1234"}}')
+    assert not listener.is_relevant(
+        '{"id_str":"8","quoted_status":{"id_str":"9","user":'
+        '{"id_str":"25073877"}},"user":{"id_str":"1234"}}')
+
+    # Control messages.
+    assert not listener.is_relevant(
+        '{"delete":{"status":{"id_str":"1","user_id_str":"25073877"}}}')
+    assert not listener.is_relevant('{"limit":{"track":1234}}')
+    assert not listener.is_relevant(
+        '{"disconnect":{"code":4,"stream_name":"","reason":"Stalled"}}')
+
+    # Tweets by the user we follow with the keys in another order.
+    assert listener.is_relevant(
+        '{"user":{"entities":{"url":{}},"id_str":"25073877"},"id_str":"4"}')
+    assert listener.is_relevant(
+        '{"id_str":"5","user":{"status":{"id_str":"1234"},'
+        '"id_str":"25073877"}}')
+
+    # Tweets by the user we follow quoting another user, in either order.
+    assert listener.is_relevant(
+        '{"id_str":"6","quoted_status":{"id_str":"7","user":'
+        '{"id_str":"1234"}},"user":{"id_str":"25073877"}}')
+    assert listener.is_relevant(
+        '{"id_str":"6","user":{"entities":{},"id_str":"25073877"},'
+        '"quoted_status":{"id_str":"7","user":{"id_str":"1234"}}}')
+
+    # Anything unrecognized is left for the full check.
+    assert listener.is_relevant('{"user":{"id":1},"id_str":"1"}')
+    assert listener.is_relevant('not json')
+
+
+def test_on_data(listener):
+    assert listener.on_data('{"user":{"id_str":"1234"}}')
+    assert listener.on_data('{"limit":{"track":1234}}')
+    assert listener.workers.queue.empty()
+
+
+def test_shared_workers():
+    workers = make_worker_pool(logs_to_cloud=False)
+    tweets = []
+
+    # Stopping a listener leaves the shared worker threads running for the
+    # next one.
+    first = TwitterListener(callback=lambda tweet, route: tweets.append(tweet),
+                            logs_to_cloud=False, workers=workers)
+    first.stop_queue()
+    assert not first.on_data('{"user":{"id_str":"25073877"}}')
+    assert not workers.is_stopped()
+
+    second = TwitterListener(
+        callback=lambda tweet, route: tweets.append(tweet),
+        logs_to_cloud=False, workers=workers)
+    assert second.workers is workers
+    assert second.on_data('{"id_str":"1","user":{"id_str":"25073877",'
+                          '"screen_name":"realDonaldTrump"}}')
+    workers.queue.join()
+    assert [tweet["id_str"] for tweet in tweets] == ["1"]
+    second.stop_queue()
+
+    workers.stop()
+    assert workers.join(timeout=5.0)
+
+
+def test_get_reconnect_delay():
+    # Network errors back off linearly.
+    delay = 0
+    delays = []
+    for _ in range(70):
+        delay = get_reconnect_delay(IOError("Connection reset."), delay)
+        delays.append(delay)
+    assert delays[:3] == [0.25, 0.5, 0.75]
+    assert delays[-1] == 16
+
+    # HTTP errors back off exponentially.
+    assert get_reconnect_delay(503, 0) == 5
+    assert get_reconnect_delay(503, 5) == 10
+    assert get_reconnect_delay(503, 0.5) == 5
+    assert get_reconnect_delay(503, 320) == 320
+
+    # Rate limits back off more.
+    assert get_reconnect_delay(420, 0) == 60
+    assert get_reconnect_delay(420, 60) == 120
+
+
+def test_reconnect(twitter, monkeypatch):
+    listeners = []
+
+    class FakeStream:
+        def __init__(self, auth, listener, **options):
+            self.listener = listener
+
+        def filter(self, follow):
+            listeners.append(self.listener)
+            if len(listeners) == 1:
+                raise IOError("Connection reset.")
+            elif len(listeners) == 2:
+                self.listener.on_error(503)
+            elif len(listeners) == 3:
+                self.listener.on_connect()
+                self.listener.on_error(503)
+            else:
+                self.listener.on_connect()
+                twitter.stop_streaming()
+
+        def disconnect(self):
+            pass
+
+    delays = []
+    monkeypatch.setattr("twitter.Stream", FakeStream)
+    monkeypatch.setattr("twitter.TwitterListener.wait",
+                        lambda listener, timeout: delays.append(timeout))
+
+    # The same listener reconnects with a backoff, which starts over once a
+    # connection succeeds.
+    twitter.start_streaming(callback)
+    assert len(listeners) == 4
+    assert all(listener is listeners[0] for listener in listeners)
+    assert delays == [0.25, 5, 5]
+
+
+def test_stall(monkeypatch):
+    twitter = Twitter(logs_to_cloud=False, stall_timeout=90)
+    attempts = []
+
+    class FakeStream:
+        def __init__(self, auth, listener, **options):
+            assert options["timeout"] == 90
+            self.listener = listener
+
+        def filter(self, follow):
+            attempts.append(follow)
+            self.listener.on_connect()
+            if len(attempts) == 1:
+                # Data arrived, then the stream went silent until the read
+                # timed out.
+                self.listener.on_data('{"limit":{"track":1}}')
+                self.listener.last_activity -= 95
+                raise IOError("Read timed out.")
+            elif len(attempts) == 2:
+                # The connection broke while keep-alives were arriving.
+                self.listener.keep_alive()
+                raise IOError("Connection reset.")
+            else:
+                twitter.stop_streaming()
+
+        def disconnect(self):
+            pass
+
+    monkeypatch.setattr("twitter.Stream", FakeStream)
+    monkeypatch.setattr("twitter.TwitterListener.wait",
+                        lambda listener, timeout: None)
+
+    assert twitter.get_stall_metrics() == {"stalls": 0,
+                                           "last_time_to_detect": None,
+                                           "mean_time_to_detect": None}
+    twitter.start_streaming(callback)
+    assert len(attempts) == 3
+    metrics = twitter.get_stall_metrics()
+    assert metrics["stalls"] == 1
+    assert 95 <= metrics["last_time_to_detect"] < 100
+    assert metrics["mean_time_to_detect"] == metrics["last_time_to_detect"]
+
+
+def test_seen_tweets():
+    seen_tweets = SeenTweets(window=60, size=3)
+    assert seen_tweets.add("1")
+    assert not seen_tweets.add("1")
+
+    # The oldest IDs are forgotten once there are too many.
+    assert seen_tweets.add("2")
+    assert seen_tweets.add("3")
+    assert seen_tweets.add("4")
+    assert seen_tweets.ids.keys() == ["2", "3", "4"]
+    assert seen_tweets.add("1")
+    assert seen_tweets.ids.keys() == ["3", "4", "1"]
+
+    # IDs are forgotten once they're too old.
+    seen_tweets.ids["3"] -= 61
+    assert seen_tweets.add("5")
+    assert seen_tweets.ids.keys() == ["4", "1", "5"]
+
+
+def test_handle_duplicates():
+    tweets = []
+    seen_tweets = SeenTweets()
+    data = ('{"id_str":"1","user":{"id_str":"25073877",'
+            '"screen_name":"realDonaldTrump"}}')
+
+    # Duplicates are skipped across listeners sharing the seen tweets.
+    for _ in range(2):
+        listener = TwitterListener(
+            callback=lambda tweet, route: tweets.append(tweet),
+            logs_to_cloud=False,
+            seen_tweets=seen_tweets)
+        listener.handle_data(listener.logs, data)
+        listener.handle_data(listener.logs, data)
+        listener.stop_queue()
+    assert [tweet["id_str"] for tweet in tweets] == ["1"]
+
+
+def test_post_alert(twitter, monkeypatch):
+    posted = []
+    errors = [TweepError("Internal error.", api_code=131),
+              RateLimitError("Rate limit exceeded.")]
+
+    def update_status(text):
+        if errors:
+            raise errors.pop(0)
+        posted.append(text)
+
+    sleeps = []
+    monkeypatch.setattr(twitter.twitter_api, "update_status", update_status)
+    monkeypatch.setattr("twitter.sleep", sleeps.append)
+    monkeypatch.setattr("twitter.time", lambda: 1000.0)
+
+    # Errors are retried with a backoff, and longer when rate limited.
+    twitter.post_alert(twitter.logs, "Alert")
+    assert posted == ["Alert"]
+    assert sleeps == [ALERT_RETRY_DELAY, ALERT_RATE_LIMIT_DELAY]
+
+    # The next alert waits for the interval.
+    twitter.post_alert(twitter.logs, "Next alert")
+    assert posted == ["Alert", "Next alert"]
+    assert sleeps[-1] == ALERT_INTERVAL
+
+    # Duplicates aren't retried.
+    errors.append(TweepError("Duplicate status.", api_code=187))
+    twitter.next_alert_time = 0
+    del sleeps[:]
+    twitter.post_alert(twitter.logs, "Next alert")
+    assert posted == ["Alert", "Next alert"]
+    assert sleeps == []
+
+
+def test_queue_tweet(twitter, monkeypatch):
+    posted = []
+    monkeypatch.setattr(twitter.twitter_api, "update_status", posted.append)
+    tweet = {"id_str": "1", "user": {"screen_name": "realDonaldTrump"}}
+    companies = [{"name": "Boeing", "ticker": "BA", "sentiment": -0.1}]
+
+    twitter.queue_tweet(companies, tweet)
+    twitter.alerts.queue.join()
+    assert posted == [u"Boeing $BA \U0001f44e\n"
+                      u"https://twitter.com/realDonaldTrump/status/1"]
+    twitter.alerts.stop()
+
+
+def test_read_follow_list(twitter, tmpdir):
+    follow_list = tmpdir.join("follows.txt")
+    follow_list.write("# User ID, route and screen name.\n"
+                      "25073877 trade realDonaldTrump\n"
+                      "\n"
+                      "813286 alert BarackObama\n"
+                      "1234 analysis\n"
+                      "5678 sell\n"
+                      "someone trade\n")
+    assert twitter.read_follow_list(str(follow_list)) == {
+        TRUMP_USER_ID: ROUTE_TRADE, "813286": ROUTE_ALERT,
+        "1234": ROUTE_ANALYSIS}
+
+
+def test_follows():
+    routes = []
+    follows = {TRUMP_USER_ID: ROUTE_TRADE, "1234": ROUTE_ANALYSIS}
+    listener = TwitterListener(
+        callback=lambda tweet, route: routes.append((tweet["id_str"], route)),
+        logs_to_cloud=False, follows=follows)
+
+    # Tweets by any of the followed users get through with their routes.
+    for id_str, user_id in [("1", TRUMP_USER_ID), ("2", "1234"),
+                            ("3", "5678")]:
+        data = ('{"id_str":"%s","user":{"id_str":"%s","screen_name":"a"}}' %
+                (id_str, user_id))
+        assert listener.is_relevant(data) == (user_id in follows)
+        listener.handle_data(listener.logs, data)
+    assert routes == [("1", ROUTE_TRADE), ("2", ROUTE_ANALYSIS)]
+    listener.stop_queue()
+
+
+def test_empty_follows(tmpdir, monkeypatch):
+    follow_list = tmpdir.join("follows.txt")
+    follow_list.write("# No accounts.\n1234 sell\n")
+    monkeypatch.setattr("twitter.TWITTER_FOLLOW_LIST", str(follow_list))
+    with raises(ValueError):
+        Twitter(logs_to_cloud=False)
+    with raises(ValueError):
+        Twitter(logs_to_cloud=False, follows={})
+
+
+def test_shared_follows(monkeypatch):
+    follows = {"1234": ROUTE_ALERT}
+    twitter = Twitter(logs_to_cloud=False, follows=follows)
+    filters = []
+
+    class FakeStream:
+        def __init__(self, auth, listener, **options):
+            self.listener = listener
+
+        def filter(self, follow):
+            filters.append(follow)
+            twitter.stop_streaming()
+
+        def disconnect(self):
+            pass
+
+    monkeypatch.setattr("twitter.Stream", FakeStream)
+    twitter.start_streaming(callback)
+    assert filters == [["1234"]]
+    assert twitter.twitter_listener.follows is follows
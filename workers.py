@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+from Queue import Empty
+from Queue import Queue
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import time
+
+from logs import Logs
+
+# The number of worker threads kept running while there's no work, and the
+# most that are started for bursts of work.
+MIN_WORKERS = 2
+MAX_WORKERS = 100
+
+# How long in seconds an idle worker waits for a task before it retires, as
+# long as more than the minimum number of workers are running.
+WORKER_IDLE_TIMEOUT = 60
+
+# How long in seconds a task may wait on the queue before another worker is
+# started.
+WORKER_LATENCY_TARGET = 1.0
+
+# The queue item telling a worker to stop.
+STOP_SENTINEL = None
+
+
+class WorkerPool:
+    """A pool of worker threads handling tasks from a queue. It starts small,
+    grows with the queue depth and latency up to a maximum, and retires
+    workers which stay idle. A pool can outlive the producers putting tasks
+    on it, so long-running processes keep a constant number of threads.
+    """
+
+    def __init__(self, handler, name, logs_to_cloud, min_workers=MIN_WORKERS,
+                 max_workers=MAX_WORKERS, idle_timeout=WORKER_IDLE_TIMEOUT,
+                 latency_target=WORKER_LATENCY_TARGET):
+        self.logs_to_cloud = logs_to_cloud
+        self.logs = Logs(name=name, to_cloud=self.logs_to_cloud)
+        self.handler = handler
+        self.name = name
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self.latency_target = latency_target
+
+        self.queue = Queue()
+        self.stop_event = Event()
+        self.lock = Lock()
+        self.num_workers = 0
+        self.num_idle = 0
+        self.peak_workers = 0
+        self.next_worker_id = 0
+        self.threads = {}
+
+        self.logs.debug("Starting %s worker threads." % self.min_workers)
+        with self.lock:
+            for _ in range(self.min_workers):
+                self.start_worker()
+
+    def put(self, task):
+        """Puts a task on the queue, starting another worker if all of them
+        are busy.
+        """
+
+        with self.lock:
+            if self.stop_event.is_set():
+                self.logs.warn("Dropping task for stopped worker threads.")
+                return
+
+            self.queue.put((time(), task))
+            if self.queue.qsize() > self.num_idle:
+                self.start_worker()
+
+    def stop(self):
+        """Signals the workers to stop once they have handled the tasks
+        already on the queue.
+        """
+
+        with self.lock:
+            if self.stop_event.is_set():
+                return
+            self.stop_event.set()
+
+            # Wake up every worker blocked on the queue with its own sentinel.
+            for _ in range(self.num_workers):
+                self.queue.put(STOP_SENTINEL)
+
+    def join(self, timeout=None):
+        """Waits for the stopped workers to exit and returns whether they
+        all did.
+        """
+
+        with self.lock:
+            threads = self.threads.values()
+
+        start = time()
+        for thread in threads:
+            if timeout is None:
+                thread.join()
+            else:
+                thread.join(max(0, timeout - (time() - start)))
+
+        with self.lock:
+            return not self.threads
+
+    def is_stopped(self):
+        """Checks whether the pool was stopped."""
+
+        return self.stop_event.is_set()
+
+    def start_worker(self):
+        """Starts a worker thread unless the maximum is running. Needs to hold
+        the lock.
+        """
+
+        if self.stop_event.is_set() or self.num_workers >= self.max_workers:
+            return
+
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        self.num_workers += 1
+        self.num_idle += 1
+        self.peak_workers = max(self.peak_workers, self.num_workers)
+
+        worker = Thread(target=self.work, args=[worker_id])
+        worker.daemon = True
+        self.threads[worker_id] = worker
+        worker.start()
+
+    def work(self, worker_id):
+        """Processes tasks from the queue until the worker gets a stop
+        sentinel or retires.
+        """
+
+        # Each worker gets its own logs instance (with its own httplib2
+        # instance), but only once it has work to do.
+        logs = None
+
+        while True:
+            try:
+                item = self.queue.get(block=True, timeout=self.idle_timeout)
+            except Empty:
+                # Retire if there are more workers than needed. Once stopping,
+                # wait for the sentinel which was put on the queue for this
+                # worker instead, or it would be left on the queue.
+                with self.lock:
+                    if (not self.stop_event.is_set() and
+                            self.num_workers > self.min_workers):
+                        self.num_workers -= 1
+                        self.num_idle -= 1
+                        del self.threads[worker_id]
+                        self.logs.debug("Retiring idle worker thread: %s" %
+                                        worker_id)
+                        return
+                continue
+
+            if item is STOP_SENTINEL:
+                self.queue.task_done()
+                break
+
+            enqueued, task = item
+
+            with self.lock:
+                self.num_idle -= 1
+
+                # Add a worker if tasks are waiting too long.
+                if (time() - enqueued > self.latency_target and
+                        not self.queue.empty()):
+                    self.start_worker()
+
+            if not logs:
+                logs = Logs("%s-worker-%s" % (self.name, worker_id),
+                            to_cloud=self.logs_to_cloud)
+
+            # The main loop doesn't catch and report exceptions from background
+            # threads, so do that here.
+            try:
+                logs.debug("Processing queue of size: %s" %
+                           self.queue.qsize())
+                self.handler(logs, task)
+            except BaseException as exception:
+                logs.catch(exception)
+            finally:
+                self.queue.task_done()
+                with self.lock:
+                    self.num_idle += 1
+
+        with self.lock:
+            self.num_workers -= 1
+            self.num_idle -= 1
+            del self.threads[worker_id]
+        self.logs.debug("Stopped worker thread: %s" % worker_id)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from threading import active_count
+from threading import Event
+from time import sleep
+from time import time
+
+from workers import WorkerPool
+
+
+def wait_for(condition, timeout=5.0):
+    """Waits until a condition holds or the timeout passes."""
+
+    start = time()
+    while not condition() and time() - start < timeout:
+        sleep(0.01)
+    return condition()
+
+
+def test_start_small():
+    pool = WorkerPool(handler=lambda logs, task: None, name="test",
+                      logs_to_cloud=False, min_workers=2, max_workers=10)
+    assert pool.num_workers == 2
+    pool.stop()
+
+
+def test_grow_and_retire():
+    release = Event()
+    handled = []
+
+    def handler(logs, task):
+        release.wait()
+        handled.append(task)
+
+    pool = WorkerPool(handler=handler, name="test", logs_to_cloud=False,
+                      min_workers=1, max_workers=4, idle_timeout=0.1)
+
+    # A burst of blocking tasks grows the pool up to the maximum.
+    for task in range(10):
+        pool.put(task)
+    assert wait_for(lambda: pool.num_workers == 4)
+    assert pool.peak_workers == 4
+
+    # All tasks are handled and the idle workers retire.
+    release.set()
+    pool.queue.join()
+    assert sorted(handled) == range(10)
+    assert wait_for(lambda: pool.num_workers == 1)
+    pool.stop()
+
+
+def test_handler_exception():
+    handled = []
+
+    def handler(logs, task):
+        handled.append(task)
+        if task == 0:
+            raise ValueError("Failed task.")
+
+    pool = WorkerPool(handler=handler, name="test", logs_to_cloud=False,
+                      min_workers=1, max_workers=1)
+    pool.put(0)
+    pool.put(1)
+    pool.queue.join()
+    assert handled == [0, 1]
+    assert pool.num_workers == 1
+    pool.stop()
+
+
+def test_stop():
+    handled = []
+    pool = WorkerPool(handler=lambda logs, task: handled.append(task),
+                      name="test", logs_to_cloud=False, min_workers=3,
+                      max_workers=3, idle_timeout=60)
+    pool.put(0)
+    pool.put(1)
+
+    # The workers exit promptly even though they're blocked on the queue, and
+    # only after the queued tasks are handled.
+    pool.stop()
+    assert pool.join(timeout=5.0)
+    assert sorted(handled) == [0, 1]
+    assert pool.num_workers == 0
+    assert not pool.threads
+
+    # Tasks put after stopping are dropped.
+    pool.put(2)
+    assert pool.queue.empty()
+    assert sorted(handled) == [0, 1]
+
+
+def test_stop_thread_count():
+    thread_count = active_count()
+    for _ in range(5):
+        pool = WorkerPool(handler=lambda logs, task: None, name="test",
+                          logs_to_cloud=False, min_workers=2, max_workers=10)
+        pool.stop()
+        assert pool.join(timeout=5.0)
+    assert active_count() == thread_count
+
+
+def test_stop_while_retiring():
+    pool = WorkerPool(handler=lambda logs, task: None, name="test",
+                      logs_to_cloud=False, min_workers=1, max_workers=3,
+                      idle_timeout=0.05)
+    with pool.lock:
+        pool.start_worker()
+        pool.start_worker()
+    assert pool.num_workers == 3
+
+    # Stop like stop() does while the idle workers are waiting for the lock
+    # to retire.
+    with pool.lock:
+        sleep(0.2)
+        pool.stop_event.set()
+        for _ in range(pool.num_workers):
+            pool.queue.put(None)
+
+    # Every sentinel is taken, so joining the queue doesn't hang.
+    assert pool.join(timeout=5.0)
+    assert pool.queue.unfinished_tasks == 0